@@ -0,0 +1,220 @@
+"""
+Batch seat allocation from ranked section preferences.
+
+Students rank the sections of a course before registration opens. For every course the allocator
+seats students in lottery order and, each time a student is added, re-arranges the students seated
+so far so that the total rank of all seated students stays as low as possible (min-cost flow by
+successive shortest paths). A student seated earlier is never pushed out, only moved to another
+section they ranked, so the lottery decides who gets a seat and the ranks decide where. Courses are
+allocated one after the other, and sections meeting at the same time as a section a student got
+in an earlier course are taken out of their choices first, so nobody gets two clashing lessons.
+
+The shortest paths run over a graph with one node per section: an edge i -> j means "some student
+in i also ranked j" and costs the cheapest rank change of such a student. A course with s sections
+costs at most O(s^2 log s) per seated student, and a student whose first choice still has room is
+seated without a search at all.
+
+    $ DATABASE_URL=postgres://... python allocation.py --seed 2024
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+from database import Database
+
+
+def allocate_course(students, choices, free):
+    """
+    :param students: Student IDs in lottery order
+    :param choices: Dictionary of student ID -> list of (lesson ID, rank), best first
+    :param free: Dictionary of lesson ID -> free seats, seats taken are subtracted from it
+    :return: Dictionary of student ID -> lesson ID
+    """
+    assigned = {}
+    ranks = {}
+    # (from lesson, to lesson) -> heap of (rank change, student). Entries of students that have
+    # left the "from" lesson are dropped lazily.
+    exchanges = defaultdict(list)
+    neighbours = defaultdict(set)
+    # Dijkstra potentials, keep the reduced cost of every exchange edge non-negative.
+    potential = dict.fromkeys(free, 0)
+    seats = sum(free.values())
+
+    def place(student, lesson):
+        assigned[student] = lesson
+        here = ranks[student][lesson]
+        for other, rank in ranks[student].items():
+            if other != lesson:
+                heapq.heappush(exchanges[lesson, other], (rank - here, student))
+                neighbours[lesson].add(other)
+
+    def cheapest(source, target):
+        heap = exchanges[source, target]
+        while heap and assigned.get(heap[0][1]) != source:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    for student in students:
+        if seats == 0:
+            break
+
+        ranks[student] = dict(choices[student])
+        first = choices[student][0][0]
+        if free[first] > 0:
+            free[first] -= 1
+            seats -= 1
+            place(student, first)
+            continue
+
+        # Reduced distances from the new student to every section and how each was reached.
+        distance = {}
+        previous = {}
+        queue = []
+        for lesson, rank in choices[student]:
+            reduced = rank - potential[lesson]
+            if reduced < distance.get(lesson, reduced + 1):
+                distance[lesson] = reduced
+                previous[lesson] = None
+                heapq.heappush(queue, (reduced, lesson))
+
+        settled = set()
+        target = None
+        best = None
+        while queue:
+            reduced, lesson = heapq.heappop(queue)
+            if lesson in settled:
+                continue
+            settled.add(lesson)
+            if free[lesson] > 0:
+                cost = reduced + potential[lesson]
+                if best is None or cost < best:
+                    target, best = lesson, cost
+            for other in neighbours[lesson]:
+                edge = cheapest(lesson, other)
+                if edge is None or other in settled:
+                    continue
+                change, moved = edge
+                candidate = reduced + change + potential[lesson] - potential[other]
+                if candidate < distance.get(other, candidate + 1):
+                    distance[other] = candidate
+                    previous[other] = (lesson, moved)
+                    heapq.heappush(queue, (candidate, other))
+
+        if target is None:
+            continue
+
+        limit = distance[target]
+        for lesson in potential:
+            potential[lesson] += min(distance.get(lesson, limit), limit)
+
+        lesson = target
+        while previous[lesson] is not None:
+            source, moved = previous[lesson]
+            place(moved, lesson)
+            lesson = source
+        place(student, lesson)
+        free[target] -= 1
+        seats -= 1
+
+    return assigned
+
+
+def _clashes(periods, booked):
+    return any(start < other_end and other_start < end
+               for start, end in periods for other_start, other_end in booked)
+
+
+def allocate(rows, seed=None, periods=None):
+    """
+    :param rows: (code, lesson ID, free seats, student ID, rank) tuples, see
+        Database.get_allocation_input
+    :param seed: Seed of the lottery, a random one is used if None
+    :param periods: Dictionary of lesson ID -> (start, end) minutes since Monday 00:00 of its
+        meetings, see Database.get_allocation_periods. Lessons without any never clash.
+    :return: List of (student ID, lesson ID) pairs
+    """
+    periods = periods or {}
+    courses = defaultdict(lambda: (defaultdict(list), {}))
+    for code, lesson, free, student, rank in rows:
+        choices, seats = courses[code]
+        choices[student].append((rank, lesson))
+        seats[lesson] = free
+
+    # One lottery number per student, shared by all of their courses.
+    lottery = sorted({row[3] for row in rows})
+    random.Random(seed).shuffle(lottery)
+    order = {student: number for number, student in enumerate(lottery)}
+
+    # Student ID -> meetings of the sections they got in the courses allocated so far.
+    booked = defaultdict(list)
+    assignments = []
+    for code in sorted(courses):
+        choices, seats = courses[code]
+        for student in list(choices):
+            kept = [(lesson, rank) for rank, lesson in sorted(choices[student])
+                    if not _clashes(periods.get(lesson, ()), booked[student])]
+            if kept:
+                choices[student] = kept
+            else:
+                del choices[student]
+        students = sorted(choices, key=order.__getitem__)
+        assigned = allocate_course(students, choices, seats)
+        for student, lesson in assigned.items():
+            booked[student].extend(periods.get(lesson, ()))
+        assignments.extend(sorted(assigned.items()))
+    return assignments
+
+
+def run(seed=None, dry_run=False):
+    """
+    Allocates seats for every submitted preference and enrolls the students. Lessons with
+    preferences are locked from reading until the enrollments are written.
+
+    :return: Summary dictionary, None if the preferences could not be read
+    """
+    started = time.monotonic()
+    db = Database(scoped=True)
+    rows = db.get_allocation_input()
+    if rows is None:
+        db.close(commit=False)
+        return None
+
+    periods = db.get_allocation_periods()
+    if periods is None:
+        db.close(commit=False)
+        return None
+
+    assignments = allocate(rows, seed, periods)
+    written = 0 if dry_run else db.write_allocation(assignments)
+    committed = db.close(commit=not dry_run and written is not None)
+
+    firsts = {(student, lesson) for _, lesson, _, student, rank in rows if rank == 1}
+    return {
+        "requests": len({(row[0], row[3]) for row in rows}),
+        "assigned": len(assignments),
+        "first_choice": sum(1 for assignment in assignments if assignment in firsts),
+        "written": written,
+        "committed": committed,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Allocates seats from ranked section preferences.")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the lottery")
+    parser.add_argument("--dry-run", action="store_true", help="allocate without enrolling anyone")
+    args = parser.parse_args()
+
+    if os.getenv("DATABASE_URL") is None:
+        print("Usage: DATABASE_URL=url python allocation.py [--seed N] [--dry-run]", file=sys.stderr)
+        sys.exit(1)
+
+    summary = run(args.seed, args.dry_run)
+    if summary is None:
+        sys.exit(1)
+    for key, value in summary.items():
+        print("%-13s %s" % (key + ":", value))
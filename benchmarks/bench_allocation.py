@@ -0,0 +1,71 @@
+"""
+Benchmark of the seat allocator on generated preferences, runs without a database.
+
+Every student picks a few courses and ranks up to --choices sections of each. A share of the
+sections is popular so the first choices are oversubscribed and the allocator has to search.
+
+    $ python benchmarks/bench_allocation.py --students 30000 --sections 3000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from allocation import allocate
+
+
+def make_rows(args, rng):
+    courses = max(1, args.sections // args.sections_per_course)
+    sections = {code: list(range(code * args.sections_per_course, (code + 1) * args.sections_per_course))
+                for code in range(courses)}
+    free = {lesson: args.cap for lessons in sections.values() for lesson in lessons}
+
+    rows = []
+    for student in range(args.students):
+        for code in rng.sample(range(courses), min(args.courses, courses)):
+            lessons = sections[code]
+            # The first sections of every course are the popular ones.
+            weights = [4 if i < len(lessons) // 4 else 1 for i in range(len(lessons))]
+            picked = []
+            while len(picked) < min(args.choices, len(lessons)):
+                lesson = rng.choices(lessons, weights)[0]
+                if lesson not in picked:
+                    picked.append(lesson)
+            for rank, lesson in enumerate(picked, 1):
+                rows.append((code, lesson, free[lesson], student, rank))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--students", type=int, default=30000)
+    parser.add_argument("--sections", type=int, default=3000)
+    parser.add_argument("--sections-per-course", type=int, default=10)
+    parser.add_argument("--courses", type=int, default=4, help="courses picked by every student")
+    parser.add_argument("--choices", type=int, default=4, help="sections ranked per course")
+    parser.add_argument("--cap", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rows = make_rows(args, rng)
+    requests = len({(row[0], row[3]) for row in rows})
+    firsts = {(row[3], row[1]) for row in rows if row[4] == 1}
+
+    started = time.perf_counter()
+    assignments = allocate(rows, args.seed)
+    elapsed = time.perf_counter() - started
+
+    print("preferences:  %d rows, %d course requests" % (len(rows), requests))
+    print("seats:        %d" % (args.sections * args.cap))
+    print("assigned:     %d (%.1f%% of requests)" % (len(assignments), 100.0 * len(assignments) / requests))
+    print("first choice: %.1f%% of assigned" % (
+        100.0 * sum(1 for assignment in assignments if assignment in firsts) / max(len(assignments), 1)))
+    print("time:         %.2f s" % elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark of the classroom allocator on a generated term, runs without a database.
+
+Lessons meet once or twice a week in the usual two hour blocks and some ask for a classroom type
+or board. Checks that every placement is suitable and that no room is double booked.
+
+    $ python benchmarks/bench_room_allocation.py --lessons 3000 --rooms 250
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from room_allocation import allocate_rooms, suitable
+
+TYPES = ("Lecture", "Auditoria", "Seminar", "Interactive")
+BOARDS = ("Mixed", "Black", "White")
+STARTS = (510, 630, 750, 870, 990)
+
+
+def make_term(args, rng):
+    rooms = {}
+    for room in range(1, args.rooms + 1):
+        rooms[room] = (rng.choice((30, 40, 60, 80, 120, 200)), rng.choice(TYPES), rng.choice(BOARDS))
+
+    lessons = {}
+    for lesson in range(1, args.lessons + 1):
+        meetings = set()
+        for _ in range(rng.choice((1, 2))):
+            day = rng.randrange(5)
+            start = rng.choice(STARTS)
+            meetings.add((day * 1440 + start, day * 1440 + start + 110))
+        room_type = rng.choice(TYPES) if rng.random() < args.typed_share else None
+        board_type = rng.choice(BOARDS) if rng.random() < args.typed_share else None
+        lessons[lesson] = (rng.choice((20, 30, 40, 50, 70, 100, 150)), room_type, board_type, sorted(meetings))
+    return lessons, rooms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lessons", type=int, default=3000)
+    parser.add_argument("--rooms", type=int, default=250)
+    parser.add_argument("--typed-share", type=float, default=0.2,
+                        help="share of lessons asking for a classroom type, and for a board")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    lessons, rooms = make_term(args, random.Random(args.seed))
+    started = time.perf_counter()
+    assigned, unplaced = allocate_rooms(lessons, rooms)
+    elapsed = time.perf_counter() - started
+
+    unsuitable = sum(1 for lesson, room in assigned.items() if not suitable(lessons[lesson][:3], rooms[room]))
+    booked = {}
+    double_booked = 0
+    for lesson, room in assigned.items():
+        for start, end in lessons[lesson][3]:
+            for minute in range(start, end, 10):
+                if booked.setdefault((room, minute), lesson) != lesson:
+                    double_booked += 1
+
+    print("lessons:     %d, rooms: %d" % (len(lessons), len(rooms)))
+    print("assigned:    %d, unplaced: %d" % (len(assigned), len(unplaced)))
+    print("time:        %.2f s" % elapsed)
+    print("correctness: %d unsuitable rooms, %d double bookings" % (unsuitable, double_booked))
+    if unsuitable or double_booked:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Micro-benchmark of row decoding: the old ROW-constructor text parsing against rows.decode.
+
+Runs without a database, rows are generated in the shape psycopg2 returns them for
+get_lab_info (one text column for the old statement, plain columns for the new one).
+
+    $ python benchmarks/bench_rows.py [rows] [repeats]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rows import decode
+
+KEYS = ("ID", "Name", "Department", "Faculty", "Building", "Room", "Investigator")
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+def make_rows(count):
+    plain = []
+    text = []
+    for i in range(count):
+        row = (i, "Lab %d" % i, "Computer Engineering", "Computer and Informatics",
+               "EEB", "D%d" % (i % 500), "Investigator %d" % i)
+        plain.append(row)
+        text.append(("(%d,\"%s\",\"%s\",\"%s\",%s,%s,\"%s\")" % row,))
+    return plain, text
+
+
+def parse_text(data):
+    retval = []
+    for datum in data:
+        datum = datum[0].lstrip("(").rstrip(")").split(",")
+        val = {
+            "ID": datum[0],
+            "Name": datum[1].strip('"'),
+            "Department": datum[2].strip('"'),
+            "Faculty": datum[3].strip('"'),
+            "Building": datum[4].strip('"'),
+            "Room": datum[5].strip('"'),
+            "Investigator": datum[6].strip('"')
+        }
+        retval.append(val)
+    return retval
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    plain, text = make_rows(count)
+
+    old = min(timeit.repeat(lambda: parse_text(text), number=1, repeat=repeats))
+    new = min(timeit.repeat(lambda: decode(FakeCursor(plain), KEYS), number=1, repeat=repeats))
+
+    print("rows:            %d" % count)
+    print("text parsing:    %.3f ms" % (old * 1000))
+    print("rows.decode:     %.3f ms" % (new * 1000))
+    print("speedup:         %.1fx" % (old / new))
+
+    # Names with commas are split into the wrong columns by the old parser.
+    broken = parse_text([('(1,"Vision, Graphics Lab","Computer Engineering","CI",EEB,D1,"Ann")',)])[0]
+    print("comma in name:   %r / %r" % (broken["Name"], broken["Department"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark of the exam timetabling engine on a generated term.
+
+Seeds students, sections, exam rooms and about --students x --per-student enrollments into the
+database at DATABASE_URL. Students mostly take sections of their own program, as they do in a real
+term. Then times the conflict graph query and the slot/room assignment and checks that no student
+has two exams at once and no room is double booked.
+
+Use a scratch database, the seeded rows are removed afterwards unless --keep is given. The run
+replaces the EXAMS table.
+
+    $ DATABASE_URL=postgres://... python benchmarks/exam_timetable.py --students 200000
+"""
+import argparse
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import psycopg2 as dbapi2
+
+from registration_load import cleanup, seed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--students", type=int, default=200000)
+    parser.add_argument("--sections", type=int, default=3000)
+    parser.add_argument("--per-student", type=int, default=5, help="enrollments per student")
+    parser.add_argument("--program", type=int, default=20, help="sections per program")
+    parser.add_argument("--outside-share", type=float, default=0.02,
+                        help="share of enrollments outside the student's program")
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=10)
+    parser.add_argument("--keep", action="store_true", help="keep the seeded rows")
+    return parser.parse_args()
+
+
+def seed_term(url, args):
+    # Capacity is not what is measured here, every section takes everyone.
+    args.cap = args.students
+    students, lessons = seed(url, args)
+    with dbapi2.connect(url) as connection:
+        cursor = connection.cursor()
+        cursor.execute("""INSERT INTO ENROLLMENT (STUDENT_ID, LESSON_ID)
+            SELECT DISTINCT s.id, CASE WHEN random() < %(outside)s
+                THEN (%(lessons)s::INTEGER[])[1 + floor(random() * %(count)s)::INTEGER]
+                ELSE (%(lessons)s::INTEGER[])[1 + (s.n %% %(programs)s) * %(program)s + floor(random() * %(program)s)::INTEGER]
+                END
+            FROM unnest(%(students)s::INTEGER[]) WITH ORDINALITY AS s (id, n), generate_series(1, %(per)s)""",
+                       {"outside": args.outside_share, "lessons": lessons, "count": len(lessons),
+                        "programs": max(1, len(lessons) // args.program), "program": args.program,
+                        "students": students, "per": args.per_student})
+        cursor.execute("""UPDATE LESSONS SET ENROLLED = e.n
+            FROM (SELECT LESSON_ID, count(*) AS n FROM ENROLLMENT WHERE LESSON_ID = ANY(%s) GROUP BY LESSON_ID) e
+            WHERE LESSONS.LESSON_ID = e.LESSON_ID""", [lessons])
+        cursor.execute("SELECT count(*) FROM ENROLLMENT WHERE LESSON_ID = ANY(%s)", [lessons])
+        enrollments = cursor.fetchone()[0]
+
+        cursor.execute("""INSERT INTO ROOMS (BUILDING, ROOM_NAME, CLASS)
+            SELECT BU_ID, 'BEN' || i, TRUE FROM BUILDINGS, generate_series(1, %s) i
+            WHERE BU_CODE = 'BENCH' RETURNING ROOM_ID""", [args.rooms])
+        rooms = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""INSERT INTO CLASSES (CL_ID, CAP)
+            SELECT id, (ARRAY[40, 60, 80, 120, 200])[1 + n %% 5] FROM unnest(%s::INTEGER[]) WITH ORDINALITY AS r (id, n)""",
+                       [rooms])
+        cursor.close()
+    return students, lessons, enrollments
+
+
+def check(url):
+    with dbapi2.connect(url) as connection:
+        cursor = connection.cursor()
+        cursor.execute("""SELECT count(*) FROM (SELECT e.STUDENT_ID, x.SLOT FROM ENROLLMENT e
+            JOIN (SELECT DISTINCT LESSON_ID, SLOT FROM EXAMS) x ON x.LESSON_ID = e.LESSON_ID
+            GROUP BY e.STUDENT_ID, x.SLOT HAVING count(*) > 1) clashes""")
+        clashes = cursor.fetchone()[0]
+        cursor.execute("""SELECT count(*) FROM (SELECT 1 FROM EXAMS GROUP BY ROOM, SLOT HAVING count(*) > 1) rooms""")
+        double_booked = cursor.fetchone()[0]
+        cursor.execute("""SELECT count(*) FROM LESSONS l
+            JOIN (SELECT LESSON_ID, sum(SEATS) AS seats FROM EXAMS GROUP BY LESSON_ID) x ON x.LESSON_ID = l.LESSON_ID
+            WHERE x.seats < l.ENROLLED""")
+        short = cursor.fetchone()[0]
+        cursor.close()
+    return clashes, double_booked, short
+
+
+def main():
+    args = parse_args()
+    url = os.getenv("DATABASE_URL")
+    if url is None:
+        print("Usage: DATABASE_URL=url python benchmarks/exam_timetable.py", file=sys.stderr)
+        sys.exit(1)
+
+    import dbinit
+    import timetabling
+    dbinit.initialize(url)
+    dbinit.create_indexes(url)
+
+    students, lessons, enrollments = seed_term(url, args)
+    print("seeded %d students, %d sections, %d enrollments, %d rooms" % (
+        len(students), len(lessons), enrollments, args.rooms))
+
+    summary = timetabling.run(datetime.date.today(), args.days)
+    for key in ("sections", "conflicts", "slots", "slots_used", "scheduled", "split", "load_seconds", "schedule_seconds"):
+        print("%-17s %s" % (key + ":", summary[key]))
+    print("%-17s %d" % ("unscheduled:", len(summary["unscheduled"])))
+    clashes, double_booked, short = check(url)
+    print("correctness:      %d student clashes, %d double booked rooms, %d sections short of seats" % (
+        clashes, double_booked, short))
+
+    if not args.keep:
+        with dbapi2.connect(url) as connection:
+            cursor = connection.cursor()
+            cleanup(cursor)
+            cursor.close()
+
+    if clashes or double_booked or short:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
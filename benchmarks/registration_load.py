@@ -0,0 +1,290 @@
+"""
+Registration-day load benchmark for enroll/leave.
+
+Seeds sections and students into the database at DATABASE_URL, then lets many threads enroll
+into (and sometimes leave) the same handful of popular sections at once, either by calling
+Database.enroll_for_student/leave_for_student directly or by going through the Flask endpoints.
+Sections meet at a few different times, some of which overlap, so enrollments are also turned away
+for clashing with a student's timetable. Reports throughput, p50/p99 latency, lock waits and
+whether the seat counters are still correct and no student holds clashing sections.
+
+Use a scratch database, the seeded rows are removed afterwards unless --keep is given.
+
+    $ DATABASE_URL=postgres://... python benchmarks/registration_load.py --threads 32 --ops 200
+    $ DATABASE_URL=postgres://... python benchmarks/registration_load.py --mode flask
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import psycopg2 as dbapi2
+
+import timeslots
+
+CRN_BASE = 900000
+MAIL_SUFFIX = "@registration.bench"
+
+# Meeting times given out to the sections in turn. Neighbours in the list overlap.
+DATES = ("Monday 08:30-10:30", "Monday 09:30-11:30", "Tuesday 10:30-12:30", "Tue/Thu 11:30-12:30",
+         "Wednesday 13:30-15:30", "Wednesday 15:30-17:30", "Friday 08:30-11:30", "Friday 10:30-12:30")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--students", type=int, default=5000)
+    parser.add_argument("--sections", type=int, default=200)
+    parser.add_argument("--cap", type=int, default=40)
+    parser.add_argument("--hot", type=int, default=10, help="number of sections most requests go to")
+    parser.add_argument("--hot-share", type=float, default=0.8, help="share of requests going to hot sections")
+    parser.add_argument("--leave-share", type=float, default=0.1, help="share of operations that are leaves")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--ops", type=int, default=200, help="operations per thread")
+    parser.add_argument("--mode", choices=["db", "flask"], default="db")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded rows")
+    return parser.parse_args()
+
+
+def cleanup(cursor):
+    cursor.execute("DELETE FROM LESSONS WHERE CRN >= %s", [CRN_BASE])
+    cursor.execute("""DELETE FROM STUDENTS WHERE STU_ID IN
+        (SELECT P_ID FROM PEOPLE WHERE EMAIL LIKE %s)""", ["%" + MAIL_SUFFIX])
+    cursor.execute("""DELETE FROM DEPARTMENTS WHERE DEAN IN
+        (SELECT P_ID FROM PEOPLE WHERE EMAIL LIKE %s)""", ["%" + MAIL_SUFFIX])
+    cursor.execute("""DELETE FROM FACULTIES WHERE DEAN IN
+        (SELECT P_ID FROM PEOPLE WHERE EMAIL LIKE %s)""", ["%" + MAIL_SUFFIX])
+    cursor.execute("DELETE FROM BUILDINGS WHERE BU_CODE = 'BENCH'")
+    cursor.execute("DELETE FROM PEOPLE WHERE EMAIL LIKE %s", ["%" + MAIL_SUFFIX])
+
+
+def seed(url, args):
+    with dbapi2.connect(url) as connection:
+        cursor = connection.cursor()
+        cleanup(cursor)
+
+        cursor.execute("INSERT INTO BUILDINGS (BU_NAME, BU_CODE, CAMPUS) VALUES ('Bench', 'BENCH', 'Bench') RETURNING BU_ID")
+        building = cursor.fetchone()[0]
+        cursor.execute("""INSERT INTO PEOPLE (NAME, EMAIL, TYPE) VALUES ('Bench Dean', %s, 'instructor')
+            RETURNING P_ID""", ["dean" + MAIL_SUFFIX])
+        dean = cursor.fetchone()[0]
+        cursor.execute("""INSERT INTO FACULTIES (FAC_NAME, FAC_BUILDING, DEAN, DEAN_ASST_1)
+            VALUES ('Bench Faculty', %s, %s, %s) RETURNING FAC_ID""", [building, dean, dean])
+        faculty = cursor.fetchone()[0]
+        cursor.execute("""INSERT INTO DEPARTMENTS (DEP_NAME, FACULTY, BUILDING, DEAN)
+            VALUES ('Bench Department', %s, %s, %s) RETURNING DEP_ID""", [faculty, building, dean])
+        department = cursor.fetchone()[0]
+
+        cursor.execute("""INSERT INTO PEOPLE (NAME, EMAIL, PASSWORD, TYPE)
+            SELECT 'Student ' || i, 'student' || i || %s, md5('bench'), 'student'
+            FROM generate_series(1, %s) i
+            RETURNING P_ID""", [MAIL_SUFFIX, args.students])
+        students = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""INSERT INTO STUDENTS (STU_ID, NUMBER, EARNED_CREDITS, DEPARTMENT, FACULTY)
+            SELECT id, id, 0, %s, %s FROM unnest(%s) id""", [department, faculty, students])
+
+        cursor.execute("""INSERT INTO LESSONS (CAP, ENROLLED, DATE, CRN, CODE, CREDIT)
+            SELECT %s, 0, (%s::TEXT[])[1 + i %% %s], %s + i, 'BEN' || (i %% 1000), 3
+            FROM generate_series(1, %s) i
+            RETURNING LESSON_ID, DATE""", [args.cap, list(DATES), len(DATES), CRN_BASE, args.sections])
+        rows = cursor.fetchall()
+        cursor.execute(timeslots.INSERT_SLOTS, timeslots.slot_arrays(rows))
+        lessons = sorted(row[0] for row in rows)
+        cursor.close()
+    return students, lessons
+
+
+class LockMonitor(threading.Thread):
+    """
+    Samples pg_locks for lock requests that are waiting.
+    """
+
+    def __init__(self, url, interval=0.01):
+        super().__init__(daemon=True)
+        self.url = url
+        self.interval = interval
+        self.samples = 0
+        self.waiting_samples = 0
+        self.max_waiting = 0
+        self._done = threading.Event()
+
+    def run(self):
+        connection = dbapi2.connect(self.url)
+        connection.autocommit = True
+        cursor = connection.cursor()
+        while not self._done.is_set():
+            cursor.execute("SELECT count(*) FROM pg_locks WHERE NOT granted")
+            waiting = cursor.fetchone()[0]
+            self.samples += 1
+            if waiting:
+                self.waiting_samples += 1
+                self.max_waiting = max(self.max_waiting, waiting)
+            time.sleep(self.interval)
+        cursor.close()
+        connection.close()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def deadlocks(url):
+    with dbapi2.connect(url) as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()")
+        value = cursor.fetchone()[0]
+        cursor.close()
+    return value
+
+
+def db_worker(students, lessons, args, seed_value, latencies, outcomes):
+    from database import Database
+
+    db = Database()
+    rng = random.Random(seed_value)
+    hot = lessons[:args.hot]
+    mine = {}
+    for _ in range(args.ops):
+        student = rng.choice(students)
+        leaving = mine.get(student) and rng.random() < args.leave_share
+        started = time.perf_counter()
+        if leaving:
+            ok = db.leave_for_student(student, mine[student].pop())
+            kind = "leave"
+        else:
+            lesson = rng.choice(hot) if rng.random() < args.hot_share else rng.choice(lessons)
+            ok = db.enroll_for_student(student, lesson)
+            if ok:
+                mine.setdefault(student, []).append(lesson)
+            kind = "enroll"
+        latencies.append(time.perf_counter() - started)
+        outcomes.append((kind, ok))
+
+
+def flask_worker(students, lessons, args, seed_value, latencies, outcomes):
+    from server import app
+
+    client = app.test_client()
+    rng = random.Random(seed_value)
+    hot = lessons[:args.hot]
+    mine = {}
+    for _ in range(args.ops):
+        student = rng.choice(students)
+        with client.session_transaction() as session:
+            session["logged_in"] = 1
+            session["person"] = {"id": student, "name": "bench", "admin": False, "type": "student"}
+        leaving = mine.get(student) and rng.random() < args.leave_share
+        started = time.perf_counter()
+        if leaving:
+            lesson = mine[student].pop()
+            response = client.get("/leave_action?lesson_id=%d" % lesson)
+            kind = "leave"
+        else:
+            lesson = rng.choice(hot) if rng.random() < args.hot_share else rng.choice(lessons)
+            response = client.get("/enroll_action?lesson_id=%d" % lesson)
+            kind = "enroll"
+        ok = bool(response.is_json and response.get_json().get("Success"))
+        if ok and kind == "enroll":
+            mine.setdefault(student, []).append(lesson)
+        latencies.append(time.perf_counter() - started)
+        outcomes.append((kind, ok))
+
+
+def check(url, lessons):
+    with dbapi2.connect(url) as connection:
+        cursor = connection.cursor()
+        cursor.execute("""SELECT
+            count(*) FILTER (WHERE l.ENROLLED > l.CAP),
+            count(*) FILTER (WHERE l.ENROLLED <> COALESCE(e.n, 0))
+            FROM LESSONS l
+            LEFT JOIN (SELECT LESSON_ID, count(*) AS n FROM ENROLLMENT GROUP BY LESSON_ID) e
+            ON e.LESSON_ID = l.LESSON_ID
+            WHERE l.LESSON_ID = ANY(%s)""", [lessons])
+        oversubscribed, mismatched = cursor.fetchone()
+        cursor.execute("""SELECT count(*) FROM (SELECT 1 FROM ENROLLMENT WHERE LESSON_ID = ANY(%s)
+            GROUP BY STUDENT_ID, LESSON_ID HAVING count(*) > 1) d""", [lessons])
+        duplicates = cursor.fetchone()[0]
+        cursor.execute("""SELECT count(DISTINCT a.STUDENT_ID) FROM ENROLLMENT a
+            JOIN ENROLLMENT b ON b.STUDENT_ID = a.STUDENT_ID AND b.LESSON_ID > a.LESSON_ID
+            JOIN LESSON_SLOTS sa ON sa.LESSON_ID = a.LESSON_ID
+            JOIN LESSON_SLOTS sb ON sb.LESSON_ID = b.LESSON_ID AND sb.PERIOD && sa.PERIOD
+            WHERE a.LESSON_ID = ANY(%s) AND b.LESSON_ID = ANY(%s)""", [lessons, lessons])
+        clashing = cursor.fetchone()[0]
+        cursor.execute("SELECT sum(ENROLLED), sum(CAP) FROM LESSONS WHERE LESSON_ID = ANY(%s)", [lessons])
+        seats, cap = cursor.fetchone()
+        cursor.close()
+    return oversubscribed, mismatched, duplicates, clashing, seats, cap
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def main():
+    args = parse_args()
+    url = os.getenv("DATABASE_URL")
+    if url is None:
+        print("Usage: DATABASE_URL=url python benchmarks/registration_load.py", file=sys.stderr)
+        sys.exit(1)
+
+    # Every thread needs its own connection.
+    os.environ.setdefault("DB_POOL_MAX", str(args.threads + 2))
+
+    import dbinit
+    dbinit.initialize(url)
+    dbinit.create_indexes(url)
+
+    students, lessons = seed(url, args)
+    print("seeded %d students, %d sections of %d seats" % (len(students), len(lessons), args.cap))
+
+    worker = db_worker if args.mode == "db" else flask_worker
+    latencies = []
+    outcomes = []
+    threads = [threading.Thread(target=worker, args=(students, lessons, args, i, latencies, outcomes))
+               for i in range(args.threads)]
+
+    deadlocks_before = deadlocks(url)
+    monitor = LockMonitor(url)
+    monitor.start()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    monitor.stop()
+    deadlocks_after = deadlocks(url)
+
+    latencies.sort()
+    enrolled = sum(1 for kind, ok in outcomes if kind == "enroll" and ok)
+    rejected = sum(1 for kind, ok in outcomes if kind == "enroll" and not ok)
+    left = sum(1 for kind, ok in outcomes if kind == "leave" and ok)
+    oversubscribed, mismatched, duplicates, clashing, seats, cap = check(url, lessons)
+
+    print("mode:              %s, %d threads x %d ops" % (args.mode, args.threads, args.ops))
+    print("throughput:        %.0f ops/s" % (len(latencies) / elapsed))
+    print("latency p50:       %.2f ms" % (percentile(latencies, 0.50) * 1000))
+    print("latency p99:       %.2f ms" % (percentile(latencies, 0.99) * 1000))
+    print("enrolled/rejected: %d / %d, left: %d" % (enrolled, rejected, left))
+    print("lock waits:        %.1f%% of samples, max %d waiting, %d deadlocks" % (
+        100.0 * monitor.waiting_samples / max(monitor.samples, 1), monitor.max_waiting,
+        deadlocks_after - deadlocks_before))
+    print("seats taken:       %d of %d" % (seats, cap))
+    print("correctness:       %d oversubscribed, %d counter mismatches, %d duplicate enrollments, "
+          "%d students with clashing sections" % (oversubscribed, mismatched, duplicates, clashing))
+
+    if not args.keep:
+        with dbapi2.connect(url) as connection:
+            cursor = connection.cursor()
+            cleanup(cursor)
+            cursor.close()
+
+    if oversubscribed or mismatched or duplicates or clashing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
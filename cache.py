@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after ``ttl`` seconds.
+
+    Entries are stored with tags (table names) so every entry depending on a table can be dropped
+    at once. ``token()`` and the token argument of ``set()`` keep a reader that started before an
+    invalidation from storing what it read.
+    """
+
+    def __init__(self, maxsize=256, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._data = OrderedDict()
+        self._by_tag = {}
+        self._generation = 0
+        self._tag_generation = {}
+        self._lock = threading.Lock()
+
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def _remove(self, key):
+        _, _, tags = self._data.pop(key)
+        for tag in tags:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+    def get(self, key):
+        """
+        :return: (True, value) on a hit, (False, None) on a miss.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return False, None
+            value, expires, _ = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return False, None
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return True, value
+
+    def token(self):
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, tags=(), token=None):
+        """
+        :param token: Value of ``token()`` taken before the value was read. If any of the tags
+            was invalidated since then the value is not stored.
+        """
+        with self._lock:
+            if token is not None and any(self._tag_generation.get(tag, -1) > token for tag in tags):
+                return False
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, time.monotonic() + self.ttl, tuple(tags))
+            for tag in tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+                self._stats["evictions"] += 1
+            return True
+
+    def invalidate(self, *tags):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                self._tag_generation[tag] = self._generation
+                for key in list(self._by_tag.get(tag, ())):
+                    self._remove(key)
+                    self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._by_tag.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._data)
+            stats["maxsize"] = self.maxsize
+            stats["ttl"] = self.ttl
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+# Reference tables change a few times a term, so their readers are shared by all requests of a
+# worker. Other workers only see a change once their copy expires.
+reference_cache = TTLCache(
+    maxsize=int(os.getenv("REFERENCE_CACHE_SIZE", 256)),
+    ttl=float(os.getenv("REFERENCE_CACHE_TTL", 300)),
+)
+
+# Weekly timetables of students, keyed by student ID and tagged with "schedule:<student ID>" so an
+# enrollment change only drops the timetable of the students involved. Entries carry the
+# CACHE_VERSIONS of their tags, which is how writes in other workers are noticed.
+schedule_cache = TTLCache(
+    maxsize=int(os.getenv("SCHEDULE_CACHE_SIZE", 4096)),
+    ttl=float(os.getenv("SCHEDULE_CACHE_TTL", 300)),
+)
+
+# Caches shared by every Database of the process, writes invalidate tags in all of them.
+SHARED_CACHES = {
+    "reference": reference_cache,
+    "schedule": schedule_cache,
+}
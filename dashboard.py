@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import Database
+
+
+# Template variable -> Database reader. Readers listed more than once are only run once.
+ADMIN_DATASETS = {
+    "faculty_list": "get_faculties",
+    "prof_list": "get_instructors",
+    "clubs": "get_clubs_info_astext",
+    "faculties": "get_all_faculties",
+    "departments": "get_departments_text",
+    "buildings": "get_buildings",
+    "rooms": "get_rooms",
+    "instructors": "get_instructors",
+    "classrooms": "get_classrooms",
+    "assistants": "get_assistant_info",
+    "labs": "get_lab_info",
+    "labs2": "get_all_labs",
+    "people": "get_people_picker",
+}
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # Threads do not survive a fork, so every gunicorn worker starts its own executor.
+    global _executor, _executor_pid
+
+    pid = os.getpid()
+    with _executor_lock:
+        if _executor is None or _executor_pid != pid:
+            _executor = ThreadPoolExecutor(max_workers=int(os.getenv("DASHBOARD_WORKERS", 4)))
+            _executor_pid = pid
+    return _executor
+
+
+def _run(reader):
+    started = time.monotonic()
+    result = getattr(Database(), reader)()
+    return result, time.monotonic() - started
+
+
+def load_datasets(datasets):
+    """
+    Runs the readers of a page concurrently. Every reader gets its own Database, so each one
+    borrows a separate connection from the pool and the page waits about as long as its slowest
+    query instead of the sum of all of them.
+
+    :param datasets: Dictionary of name -> Database method name
+    :return: (data, timings) dictionaries keyed by name and by reader, timings are in seconds
+    """
+    executor = _get_executor()
+    futures = {reader: executor.submit(_run, reader) for reader in set(datasets.values())}
+
+    results = {}
+    timings = {}
+    for reader, future in futures.items():
+        results[reader], timings[reader] = future.result()
+
+    data = {name: results[reader] for name, reader in datasets.items()}
+    return data, timings
+
+
+def server_timing(timings):
+    """
+    :return: Value for a Server-Timing header, durations in milliseconds.
+    """
+    return ", ".join("%s;dur=%.1f" % (reader, seconds * 1000) for reader, seconds in sorted(timings.items()))
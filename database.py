@@ -1,8 +1,13 @@
 import os
 import sys
 import copy
+import csv
+import functools
+import io
+from contextlib import contextmanager
 
 import psycopg2 as dbapi2
+from psycopg2.extras import execute_values
 
 from models.room import Room
 from models.classroom import Classroom
@@ -11,12 +16,204 @@ from models.student import Student
 from models.people import People
 from models.lesson import Lesson
 
+from cache import SHARED_CACHES, reference_cache, schedule_cache
+from pool import get_pool
+from rows import decode, decode_one
+from timeslots import INSERT_SLOTS, slot_arrays, weekly_grid
+from updates import TABLES, compile_update, compile_update_many, execute_prepared
+
 import secrets
 
 
+def reads(*tags, shared=None):
+    """
+    Marks a read-only method and the tables its result depends on.
+    Results are memoized per Database instance when it was created with memoize=True.
+
+    :param shared: A cache.TTLCache to read through, shared by every Database of the process.
+        Callers must not modify what they get back.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self._memo is None and shared is None:
+                return method(self, *args, **kwargs)
+
+            key = (method.__name__, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                # Unhashable arguments, nothing to key on.
+                return method(self, *args, **kwargs)
+
+            if self._memo is not None and key in self._memo:
+                return self._memo[key][0]
+
+            # Uncommitted writes of this transaction must not leak into the shared cache.
+            if shared is not None and not self._dirty.intersection(tags):
+                hit, result = shared.get(key)
+                if not hit:
+                    token = shared.token()
+                    result = method(self, *args, **kwargs)
+                    if result is not None and result is not False:
+                        shared.set(key, result, tags, token)
+            else:
+                result = method(self, *args, **kwargs)
+
+            # Failed reads return None or False, do not hold on to them.
+            if self._memo is not None and result is not None and result is not False:
+                self._memo[key] = (result, tags)
+            return result
+        wrapper.reads = tags
+        return wrapper
+    return decorator
+
+
+def schedule_tag(student_id):
+    """
+    :return: Cache tag of the weekly timetable of a student
+    """
+    return "schedule:%s" % student_id
+
+
+class _ImportRows:
+    """
+    File object for COPY FROM that reads a CSV stream through the csv module. Every row gets its
+    number in front and a REASON column at the end. A row that can not be read or has the wrong
+    number of values is passed on without its values and with the reason set, so one bad line
+    does not fail the whole COPY.
+    """
+
+    # Rows encoded per chunk handed to COPY.
+    CHUNK_ROWS = 1000
+
+    def __init__(self, stream, columns):
+        self._chunks = self._encode(stream, columns)
+        self._buffer = ""
+
+    @staticmethod
+    def _encode(stream, columns):
+        text = stream if isinstance(stream, io.TextIOBase) else \
+            io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline="")
+        email = columns.index("email") if "email" in columns else None
+        reader = csv.reader(text)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        number = 0
+        try:
+            while True:
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    break
+                except csv.Error as err:
+                    row, reason = None, "unreadable row: %s" % err
+                else:
+                    reason = None
+                    if not row:
+                        continue
+                    if len(row) != len(columns):
+                        reason = "expected %d values, got %d" % (len(columns), len(row))
+
+                number += 1
+                if reason is None:
+                    writer.writerow([number] + row + [""])
+                else:
+                    values = [""] * len(columns)
+                    if email is not None and row is not None and email < len(row):
+                        values[email] = row[email]
+                    writer.writerow([number] + values + [reason])
+
+                if number % _ImportRows.CHUNK_ROWS == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        finally:
+            if text is not stream:
+                text.detach()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    readline = read
+
+
+def _insert_returning(cursor, statement, rows):
+    """
+    Runs an INSERT ... VALUES %s RETURNING statement for all rows as one statement.
+
+    :return: List of the first returned column, in the order of rows
+    """
+    if not rows:
+        return []
+    return [row[0] for row in execute_values(cursor, statement, rows, page_size=len(rows), fetch=True)]
+
+
+# Tables shown in a timetable besides the student's enrollments. "timetable" is written when the
+# meeting times or places of existing lessons change.
+SCHEDULE_TAGS = ("timetable", "instructors", "people", "classrooms", "rooms", "buildings")
+
+
+def _versioned(tags):
+    """
+    :return: Sorted tags whose version is kept in CACHE_VERSIONS, those the timetables depend on
+    """
+    return sorted(tag for tag in set(tags) if tag in SCHEDULE_TAGS or tag.startswith("schedule:"))
+
+# Keys of the rows of search_lesson_by_crn() and search_lesson_by_instructor(), in select list order.
+LESSON_SEARCH_KEYS = ("ID", "CRN", "Code", "Date", "Lecturer", "Cap", "Enrolled")
+
+# Keys of the rows of the iter_* export generators, in select list order.
+EXPORT_KEYS = {
+    "students": ("ID", "Name", "Email", "Number", "Credits", "Department", "Faculty", "Club", "Lab"),
+    "people": ("ID", "Name", "Email", "Photo", "Type"),
+    "instructors": ("ID", "Name", "Email", "Department", "Room", "Lab", "Bachelors", "Masters", "Doctorates"),
+}
+
+# Rows fetched per round trip by the export generators.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 2000))
+
+# Sort orders of get_students_page(): (sort key, tie breaker). NULLs are folded into the key so
+# that the (key, ID) row comparison of the keyset never meets one. Both match INDEXES of dbinit.
+STUDENT_SORTS = {
+    "number": ("COALESCE(STUDENTS.NUMBER, -1)", "STUDENTS.STU_ID"),
+    "name": ("COALESCE(PEOPLE.NAME, '')", "PEOPLE.P_ID"),
+}
+
+STUDENT_PAGE_SIZE = int(os.getenv("STUDENT_PAGE_SIZE", 50))
+
+# Most choices get_people_picker() returns, not counting the included ones.
+PICKER_LIMIT = int(os.getenv("PICKER_LIMIT", 50))
+
+
+def writes(*tags):
+    """
+    Marks a method that changes the given tables, memoized reads depending on them are dropped.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.invalidate(*tags)
+        wrapper.writes = tags
+        return wrapper
+    return decorator
+
+
 class Database:
 
-    def __init__(self):
+    def __init__(self, scoped=False, memoize=False):
         self.students = {}
         self.people = {}
 
@@ -27,28 +224,273 @@ class Database:
         if not self.url:
             self.url = secrets.DB_URL
 
+        # A scoped database keeps one connection and one transaction until close() is called.
+        self.scoped = scoped
+        self._connection = None
+        self._failed = False
+        # Depth of the nested _connect() blocks, names their savepoints.
+        self._savepoints = 0
+
+        # Results of @reads methods, only kept when memoization was asked for.
+        self._memo = {} if memoize else None
+        # Tables written in the open transaction of a scoped database.
+        self._dirty = set()
+
+    @contextmanager
+    def _connect(self):
+        """
+        Borrows a connection from the worker's pool for one transaction.
+        Commits when the block succeeds, rolls back when it raises.
+
+        A scoped database takes its connection lazily on first use and hands the same one out
+        until close(). Every block runs in a savepoint of the request's transaction: if it raises,
+        only its own changes are rolled back, so a method that catches the error does not lose the
+        writes before or after it. Whether an error that escapes the method spoils the request is up
+        to the caller, close() is told by the teardown. Only when the savepoint itself can not be
+        rolled back is the whole transaction given up.
+        """
+        pool = get_pool(self.url)
+
+        if self.scoped:
+            if self._connection is None:
+                self._connection = pool.getconn()
+            self._savepoints += 1
+            savepoint = "block_%d" % self._savepoints
+            cursor = self._connection.cursor()
+            cursor.execute("SAVEPOINT " + savepoint)
+            try:
+                yield self._connection
+            except Exception:
+                try:
+                    cursor.execute("ROLLBACK TO SAVEPOINT " + savepoint)
+                except Exception as err:
+                    print("Rollback To Savepoint Error: ", err)
+                    self._connection.rollback()
+                    self._failed = True
+                    if self._memo:
+                        self._memo.clear()
+                raise
+            else:
+                cursor.execute("RELEASE SAVEPOINT " + savepoint)
+            finally:
+                self._savepoints -= 1
+                cursor.close()
+            return
+
+        connection = pool.getconn()
+        try:
+            with connection:
+                yield connection
+        finally:
+            pool.putconn(connection)
+
+    def close(self, commit=True):
+        """
+        Ends the transaction of a scoped database and gives its connection back to the pool.
+
+        :param commit: Commit the transaction, it is rolled back otherwise
+        :return: True if the transaction was committed
+        """
+        connection = self._connection
+        if connection is None:
+            return False
+
+        if commit and not self._failed:
+            self._bump_versions(self._dirty)
+        self._connection = None
+        committed = False
+        try:
+            if commit and not self._failed:
+                connection.commit()
+                committed = True
+            else:
+                connection.rollback()
+        except Exception as err:
+            print("Close Database Error: ", err)
+            connection.rollback()
+        finally:
+            self._failed = False
+            get_pool(self.url).putconn(connection)
+            # Readers of other requests may have cached the old rows in the meantime.
+            for cache in SHARED_CACHES.values():
+                cache.invalidate(*self._dirty)
+            self._dirty = set()
+        return committed
+
+    def pool_stats(self):
+        return get_pool(self.url).stats()
+
+    def cache_stats(self):
+        return {name: cache.stats() for name, cache in SHARED_CACHES.items()}
+
+    def invalidate(self, *tags):
+        """
+        Drops memoized and cached results that depend on any of the given tables.
+        """
+        for cache in SHARED_CACHES.values():
+            cache.invalidate(*tags)
+        if self.scoped:
+            # Versions are bumped by close(), in the transaction of the write.
+            if self._connection is not None:
+                self._dirty.update(tags)
+        else:
+            self._bump_versions(tags)
+
+        if not self._memo:
+            return
+        tags = set(tags)
+        for key in [key for key, (_, depends) in self._memo.items() if tags.intersection(depends)]:
+            del self._memo[key]
+
+    def _bump_versions(self, tags):
+        """
+        Tells the other workers that their cached results of the tags are stale.
+        """
+        tags = _versioned(tags)
+        if not tags:
+            return
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                # Sorted, so concurrent bumps of the same tags lock them in the same order.
+                statement = """INSERT INTO CACHE_VERSIONS (TAG, VERSION) SELECT unnest(%s::TEXT[]), 1
+                    ON CONFLICT (TAG) DO UPDATE SET VERSION = CACHE_VERSIONS.VERSION + 1"""
+                cursor.execute(statement, [tags])
+                cursor.close()
+        except Exception as err:
+            print("Bump Cache Versions Error: ", err)
+
+    def _get_versions(self, tags):
+        """
+        :return: Tuple of the versions of the tags, in their order, None on error
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT TAG, VERSION FROM CACHE_VERSIONS WHERE TAG = ANY(%s)", [list(tags)])
+                versions = dict(cursor.fetchall())
+                cursor.close()
+                return tuple(versions.get(tag, 0) for tag in tags)
+        except Exception as err:
+            print("Get Cache Versions Error: ", err)
+
+        return None
+
+    def _update(self, table, key, attrs, values):
+        """
+        Sets attributes of one row with the compiled statement of updates.TABLES.
+
+        :param table: Key of updates.TABLES
+        :param attrs: Attributes to set
+        :param values: Values of the attributes in the same order
+        :return: True if the row was updated, False if there is no row with the key
+        :raise ValueError: If an attribute is not in the table
+        """
+        statement = compile_update(table, tuple(attrs))
+        with self._connect() as connection:
+            cursor = connection.cursor()
+            execute_prepared(cursor, statement, list(values) + [key])
+            updated = cursor.rowcount > 0
+            cursor.close()
+        return updated
+
+    def update_many(self, table, attrs, rows):
+        """
+        Sets the same attributes of many rows of a table with one statement.
+
+        :param table: Key of updates.TABLES, like "rooms"
+        :param attrs: Attributes to set
+        :param rows: List of (key, values) pairs, values in the order of attrs
+        :return: Number of rows updated, None on error
+        """
+        if not rows:
+            return 0
+
+        try:
+            statement = compile_update_many(table, tuple(attrs))
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                columns = [list(column) for column in zip(*[values for _, values in rows])]
+                execute_prepared(cursor, statement, [[key for key, _ in rows]] + columns)
+                updated = cursor.rowcount
+                cursor.close()
+        except Exception as err:
+            print("Update Many Error: ", err)
+            return None
+        finally:
+            if table in TABLES:
+                self.invalidate(*TABLES[table].tags)
+
+        return updated
+
+    def _stream(self, name, statement, keys, batch_size=None):
+        """
+        Runs a SELECT through a named (server-side) cursor and yields its rows as dictionaries.
+        Only batch_size rows are held in memory at a time. The connection stays borrowed until
+        the generator is exhausted or closed.
+
+        :param name: Name of the cursor, unique within the transaction
+        :param keys: Dictionary keys, one for each selected column
+        """
+        with self._connect() as connection:
+            cursor = connection.cursor(name=name)
+            cursor.itersize = batch_size or EXPORT_BATCH_SIZE
+            try:
+                cursor.execute(statement)
+                for row in cursor:
+                    yield dict(zip(keys, row))
+            finally:
+                cursor.close()
+
+    def _delete(self, table, keys):
+        """
+        Deletes the rows of a table of updates.TABLES with one statement.
+
+        :param keys: Primary keys of the rows
+        :return: Keys of the rows that were deleted
+        """
+        definition = TABLES[table]
+        with self._connect() as connection:
+            cursor = connection.cursor()
+            statement = "DELETE FROM {0} WHERE {1} = ANY(%s::{2}[]) RETURNING {1}".format(
+                definition.name, definition.key, definition.key_type)
+            cursor.execute(statement, [list(keys)])
+            deleted = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        return deleted
+
     ############# ROOMS ###############
 
+    @writes("rooms")
     def add_room(self, room):
+        self.add_rooms([room])
+        return room
+
+    @writes("rooms")
+    def add_rooms(self, rooms):
+        """
+        Inserts rooms with one multi-row INSERT and sets their IDs.
+
+        :return: The rooms, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                statement = "INSERT INTO ROOMS (BUILDING, ROOM_NAME, AVAILABLE, CLASS, LAB, ROOM) VALUES (%s, %s, %s, %s, %s, %s)"
-                data = [room.building, room.name, room.availability, room.classroom, room.lab, room.room]
-                cursor.execute(statement, data)
-                statement = "SELECT ROOM_ID FROM ROOMS WHERE ROOM_NAME = %s"
-                data = [room.name]
-                cursor.execute(statement, data)
-                value = cursor.fetchall()
-                room.id = value[0]
+                statement = "INSERT INTO ROOMS (BUILDING, ROOM_NAME, AVAILABLE, CLASS, LAB, ROOM) VALUES %s RETURNING ROOM_ID"
+                data = [(room.building, room.name, room.availability, room.classroom, room.lab, room.room) for room in rooms]
+                for room, value in zip(rooms, _insert_returning(cursor, statement, data)):
+                    room.id = value
                 cursor.close()
         except Exception as err:
-            print("Add Room Error: ", err)
-        return room
+            print("Add Rooms Error: ", err)
+            return None
 
+        return rooms
+
+    @reads("rooms")
     def get_room(self, room_id):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT ROOM_ID, BUILDING, ROOM_NAME, CLASS, LAB, ROOM, AVAILABLE FROM ROOMS WHERE room_id = %s"
                 data = [room_id]
@@ -64,9 +506,10 @@ class Database:
 
         return None
 
+    @reads("rooms", "buildings")
     def get_rooms(self):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT ROOM_ID, BU_NAME, ROOM_NAME FROM ROOMS JOIN BUILDINGS ON(ROOMS.BUILDING = BUILDINGS.BU_ID)"
                 cursor.execute(statement)
@@ -86,69 +529,79 @@ class Database:
 
         return None
 
+    @writes("rooms", "classrooms", "instructors", "labs")
     def delete_room(self, room_id):
+        return bool(self.delete_rooms([room_id]))
+
+    @writes("rooms", "classrooms", "instructors", "labs")
+    def delete_rooms(self, room_ids):
+        """
+        :return: IDs of the deleted rooms, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "DELETE FROM ROOMS WHERE room_id = %s"
-                values = [room_id]
-                cursor.execute(statement, values)
-                cursor.close()
+            return self._delete("rooms", room_ids)
         except Exception as err:
             print("Delete Room Error: ", err)
 
-    def update_room(self, room_id, attrs, values):
-        attrs_lookup_table = {
-            "building": "BUILDING",
-            "room_name": "ROOM_NAME",
-            "class": "CLASS",
-            "lab": "LAB",
-            "room": "ROOM",
-            "available": "AVAILABLE"
-        }
+        return None
 
+    @writes("rooms")
+    def update_room(self, room_id, attrs, values):
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "UPDATE ROOMS SET "
-                for i in range(len(attrs) - 1):
-                    statement += attrs_lookup_table[attrs[i]] + " = %s ,"
-                statement += attrs_lookup_table[attrs[-1]] + " = %s WHERE ROOM_ID = %s"
-                values.append(room_id)
-                cursor.execute(statement, values)
-                cursor.close()
-
+            return self._update("rooms", room_id, attrs, values)
         except Exception as err:
             print("Update Rooms Error: ", err)
 
+        return None
+
     ############# CLASSROOMS ###############
 
+    @writes("classrooms")
     def add_classroom(self, classroom):
+        self.add_classrooms([classroom])
+        return classroom
+
+    @writes("classrooms")
+    def add_classrooms(self, classrooms):
+        """
+        Inserts classrooms with one multi-row INSERT and sets their IDs.
+
+        :return: The classrooms, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                statement = "INSERT INTO CLASSES (CL_ID, TYPE, AIR_CONDITIONER, LAST_RESTORATION, BOARD_TYPE, CAP) VALUES (%s, %s, %s, %s, %s, %s)"
-                data = [classroom.id, classroom.type, classroom.conditioner, classroom.restoration_date, classroom.board_type, classroom.cap]
-                cursor.execute(statement, data)
+                statement = "INSERT INTO CLASSES (CL_ID, TYPE, AIR_CONDITIONER, LAST_RESTORATION, BOARD_TYPE, CAP) VALUES %s RETURNING CL_ID"
+                data = [(classroom.id, classroom.type, classroom.conditioner, classroom.restoration_date, classroom.board_type, classroom.cap) for classroom in classrooms]
+                for classroom, value in zip(classrooms, _insert_returning(cursor, statement, data)):
+                    classroom.id = value
                 cursor.close()
         except Exception as err:
-            print("Add Classroom Error: ", err)
-        return classroom
+            print("Add Classrooms Error: ", err)
+            return None
 
+        return classrooms
+
+    @writes("classrooms")
     def delete_classroom(self, cl_id):
+        return bool(self.delete_classrooms([cl_id]))
+
+    @writes("classrooms")
+    def delete_classrooms(self, cl_ids):
+        """
+        :return: IDs of the deleted classrooms, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "DELETE FROM CLASSES WHERE CL_ID = %s"
-                values = [cl_id]
-                cursor.execute(statement, values)
-                cursor.close()
+            return self._delete("classrooms", cl_ids)
         except Exception as err:
             print("Delete Classroom Error: ", err)
 
+        return None
+
+    @reads("classrooms", "rooms")
     def get_classroom(self, cl_id):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT CL_ID, TYPE, AIR_CONDITIONER, LAST_RESTORATION, BOARD_TYPE, CAP FROM CLASSES WHERE CL_ID = %s"
                 data = [cl_id]
@@ -168,9 +621,10 @@ class Database:
 
         return None
 
+    @reads("classrooms", "rooms", "buildings")
     def get_classrooms(self):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT CLASSES.CL_ID, ROOMS.ROOM_NAME, CLASSES.CAP, CLASSES.TYPE, BUILDINGS.BU_NAME FROM CLASSES JOIN ROOMS ON CL_ID = ROOM_ID JOIN BUILDINGS ON BUILDINGS.BU_ID = ROOMS.BUILDING"
                 cursor.execute(statement)
@@ -192,47 +646,48 @@ class Database:
 
         return None
 
+    @writes("classrooms")
     def update_classroom(self, class_id, attrs, values):
-        attrs_lookup_table = {
-            "type": "TYPE",
-            "air_conditioner": "AIR_CONDITIONER",
-            "last_restoration": "LAST_RESTORATION",
-            "board_type": "BOARD_TYPE",
-            "cap": "CAP"
-        }
-
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "UPDATE CLASSES SET "
-                for i in range(len(attrs) - 1):
-                    statement += attrs_lookup_table[attrs[i]] + " = %s ,"
-                statement += attrs_lookup_table[attrs[-1]] + " = %s WHERE CL_ID = %s"
-                print(statement, values)
-                values.append(class_id)
-                cursor.execute(statement, values)
-                cursor.close()
+            return self._update("classrooms", class_id, attrs, values)
         except Exception as err:
             print("Update Classroom Error: ", err)
 
+        return None
+
     ############# INSTRUCTORS ###############
 
+    @writes("instructors")
     def add_instructor(self, instructor):
+        self.add_instructors([instructor])
+        return instructor
+
+    @writes("instructors")
+    def add_instructors(self, instructors):
+        """
+        Inserts instructors with one multi-row INSERT and sets their IDs.
+
+        :return: The instructors, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                statement = "INSERT INTO INSTRUCTORS (INS_ID, BACHELORS, MASTERS, DOCTORATES, DEPARTMENT, ROOM, LAB) VALUES (%s, %s, %s, %s, %s, %s, %s)"
-                data = [instructor.instructor_id, instructor.bachelors, instructor.masters, instructor.doctorates,
-                        instructor.department, instructor.room, instructor.lab]
-                cursor.execute(statement, data)
+                statement = "INSERT INTO INSTRUCTORS (INS_ID, BACHELORS, MASTERS, DOCTORATES, DEPARTMENT, ROOM, LAB) VALUES %s RETURNING INS_ID"
+                data = [(instructor.instructor_id, instructor.bachelors, instructor.masters, instructor.doctorates,
+                         instructor.department, instructor.room, instructor.lab) for instructor in instructors]
+                for instructor, value in zip(instructors, _insert_returning(cursor, statement, data)):
+                    instructor.instructor_id = value
                 cursor.close()
         except Exception as err:
-            print("Add Instructor Error: ", err)
-        return instructor
+            print("Add Instructors Error: ", err)
+            return None
+
+        return instructors
 
+    @reads("instructors", "people")
     def get_instructor(self, ins_id):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT NAME, BACHELORS,MASTERS, DOCTORATES, DEPARTMENT, ROOM, LAB FROM INSTRUCTORS JOIN PEOPLE ON INS_ID = P_ID WHERE INS_ID = %s"
                 data = [ins_id]
@@ -248,9 +703,10 @@ class Database:
 
         return None
 
+    @reads("instructors", "people", "rooms", "labs")
     def get_instructors(self):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT P_ID, NAME, ROOMS.ROOM_NAME, LABS.LAB_NAME, BACHELORS, MASTERS, DOCTORATES FROM INSTRUCTORS JOIN PEOPLE ON (INSTRUCTORS.INS_ID = PEOPLE.P_ID) JOIN ROOMS ON (INSTRUCTORS.ROOM = ROOMS.ROOM_ID) LEFT JOIN LABS ON (INSTRUCTORS.LAB = LABS.LAB_ID)"
                 cursor.execute(statement)
@@ -274,68 +730,81 @@ class Database:
 
         return None
 
+    def iter_instructors(self, batch_size=None):
+        """
+        Streams every instructor, rooms and labs by name.
+
+        :return: Generator of dictionaries with the keys EXPORT_KEYS["instructors"]
+        """
+        statement = """SELECT PEOPLE.P_ID, PEOPLE.NAME, PEOPLE.EMAIL, DEPARTMENTS.DEP_NAME, ROOMS.ROOM_NAME, LABS.LAB_NAME,
+            INSTRUCTORS.BACHELORS, INSTRUCTORS.MASTERS, INSTRUCTORS.DOCTORATES
+            FROM INSTRUCTORS JOIN PEOPLE ON PEOPLE.P_ID = INSTRUCTORS.INS_ID
+            LEFT JOIN DEPARTMENTS ON DEPARTMENTS.DEP_ID = INSTRUCTORS.DEPARTMENT
+            LEFT JOIN ROOMS ON ROOMS.ROOM_ID = INSTRUCTORS.ROOM
+            LEFT JOIN LABS ON LABS.LAB_ID = INSTRUCTORS.LAB
+            ORDER BY INSTRUCTORS.INS_ID"""
+        return self._stream("export_instructors", statement, EXPORT_KEYS["instructors"], batch_size)
+
+    @writes("instructors")
     def delete_instructor(self, ins_id):
+        return bool(self.delete_instructors([ins_id]))
+
+    @writes("instructors")
+    def delete_instructors(self, ins_ids):
+        """
+        :return: IDs of the deleted instructors, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "DELETE FROM INSTRUCTORS WHERE INS_ID = %s"
-                values = [ins_id]
-                cursor.execute(statement, values)
-                cursor.close()
+            return self._delete("instructors", ins_ids)
         except Exception as err:
             print("Delete Instructor Error: ", err)
 
-    def update_instructor(self, ins_id, attrs, values):
-        attrs_lookup_table = {
-            "department": "DEPARTMENT",
-            "room": "ROOM",
-            "lab": "LAB",
-            "bachelors": "BACHELORS",
-            "masters": "MASTERS",
-            "doctorates": "DOCTORATES"
-        }
+        return None
 
+    @writes("instructors")
+    def update_instructor(self, ins_id, attrs, values):
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "UPDATE INSTRUCTORS SET "
-                for i in range(len(attrs) - 1):
-                    print(attrs_lookup_table[attrs[i]] + " = %s ,")
-                    statement += attrs_lookup_table[attrs[i]] + " = %s ,"
-                statement += attrs_lookup_table[attrs[-1]] + " = %s WHERE INS_ID = %s"
-                values.append(ins_id)
-                cursor.execute(statement, values)
-                cursor.close()
-
+            return self._update("instructors", ins_id, attrs, values)
         except Exception as err:
             print("Update Instructors Error: ", err)
 
+        return None
+
     ############# PEOPLE   ###############
 
+    @writes("people")
     def add_person(self, person):
+        self.add_people([person])
+        return person
+
+    @writes("people")
+    def add_people(self, people):
+        """
+        Inserts people with one multi-row INSERT and sets their IDs.
+
+        :return: The people, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                statement = "INSERT INTO PEOPLE (NAME, EMAIL, PHOTO, PASSWORD, TYPE) VALUES (%s, %s, %s, %s, %s)"
-                data = [person.name, person.mail, person.photo, person.password, person.type]
-                cursor.execute(statement, data)
-                statement = "SELECT P_ID FROM PEOPLE WHERE EMAIL = %s"
-                data = [person.mail]
-                cursor.execute(statement, data)
-                value = cursor.fetchone()
-                person.id = value[0]
+                statement = "INSERT INTO PEOPLE (NAME, EMAIL, PHOTO, PASSWORD, TYPE) VALUES %s RETURNING P_ID"
+                data = [(person.name, person.mail, person.photo, person.password, person.type) for person in people]
+                for person, value in zip(people, _insert_returning(cursor, statement, data)):
+                    person.id = value
                 cursor.close()
         except Exception as err:
-            print("Add Person Error : ", err)
+            print("Add People Error: ", err)
+            return None
 
-        return person
+        return people
 
     def person_exists(self, person):
         return True if self.get_person_by_mail(person.mail) else False
 
+    @reads("people")
     def get_person(self, p_id):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM PEOPLE WHERE P_ID = %s"
                 data = [p_id]
@@ -351,9 +820,10 @@ class Database:
 
         return None
 
+    @reads("people")
     def get_person_by_mail(self, mail):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM PEOPLE WHERE EMAIL = %s"
                 data = [mail]
@@ -369,10 +839,11 @@ class Database:
 
         return None
 
+    @reads("people")
     def get_people(self):
         if not len(self.people):
             try:
-                with dbapi2.connect(self.url) as connection:
+                with self._connect() as connection:
                     cursor = connection.cursor()
                     statement = "SELECT * FROM PEOPLE"
                     cursor.execute(statement)
@@ -384,45 +855,234 @@ class Database:
 
         return None
 
+    @reads("people")
+    def get_people_picker(self, type=None, q=None, limit=PICKER_LIMIT, include=()):
+        """
+        Choices of a person dropdown, without the columns a form does not need.
+
+        :param type: Only people of this type
+        :param q: Only people whose name starts with this, case insensitive
+        :param limit: Most people to return, at most PICKER_LIMIT
+        :param include: IDs returned whatever the filters are, for the current values of a form
+        :return: List of (id, name, type) tuples ordered by name, None on error
+        """
+        conditions = []
+        data = []
+        if type:
+            conditions.append("TYPE = %s")
+            data.append(type)
+        if q:
+            # Matches the lower(NAME) text_pattern_ops index, LIKE wildcards in q are literal.
+            conditions.append("lower(NAME) LIKE %s")
+            data.append(q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        statement = "SELECT P_ID, NAME, TYPE FROM PEOPLE"
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+        statement += " ORDER BY NAME, P_ID LIMIT %s"
+        data.append(max(0, min(int(limit or PICKER_LIMIT), PICKER_LIMIT)))
+
+        include = [int(p_id) for p_id in include if p_id]
+        if include:
+            statement = """(SELECT P_ID, NAME, TYPE FROM PEOPLE WHERE P_ID = ANY(%s::INTEGER[]))
+                UNION ({}) ORDER BY NAME, P_ID""".format(statement)
+            data.insert(0, include)
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(statement, data)
+                datas = cursor.fetchall()
+                cursor.close()
+                return datas
+        except Exception as err:
+            print("Error while getting people: ", err)
+
+        return None
+
+    def iter_people(self, batch_size=None):
+        """
+        Streams every person without the password.
+
+        :return: Generator of dictionaries with the keys EXPORT_KEYS["people"]
+        """
+        statement = "SELECT P_ID, NAME, EMAIL, PHOTO, TYPE FROM PEOPLE ORDER BY P_ID"
+        return self._stream("export_people", statement, EXPORT_KEYS["people"], batch_size)
+
+    @writes("people")
     def update_person(self, person_id, attrs, values):
-        person = self.get_person(person_id)
-        if not person:
-            return False
+        try:
+            return self._update("people", person_id, attrs, values)
+        except Exception as err:
+            print("Update Person Error: ", err)
 
-        if person:
-            try:
-                with dbapi2.connect(self.url) as connection:
-                    cursor = connection.cursor()
-                    statement = "UPDATE PEOPLE SET "
-                    for attr in attrs[:-1]:
-                        statement += attr + " = %s , "
-                    statement += attrs[-1] + " = %s "
-                    statement += " WHERE p_id = %s"
-                    values.append(person_id)
-                    cursor.execute(statement, values)
-                    cursor.close()
-            except Exception as err:
-                print("Update Person Error: ", err)
+        return None
 
     ############# STUDENTS ###############
 
+    @writes("students", "people")
     def add_student(self, student):
-        person = self.add_person(student.get_person_obj())
+        self.add_students([student])
+        return student
+
+    @writes("students", "people")
+    def add_students(self, students):
+        """
+        Inserts the PEOPLE and STUDENTS rows of students with one statement and sets their IDs.
+
+        :return: The students, None on error
+        """
+        if not students:
+            return students
+
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """WITH input (NAME, EMAIL, PHOTO, PASSWORD, NUMBER, EARNED_CREDITS, DEPARTMENT, FACULTY, CLUB, LAB) AS (
+                        VALUES %s
+                    ),
+                    people AS (
+                        INSERT INTO PEOPLE (NAME, EMAIL, PHOTO, PASSWORD, TYPE)
+                        SELECT NAME, EMAIL, PHOTO, PASSWORD, 'student' FROM input
+                        RETURNING P_ID, EMAIL
+                    ),
+                    students AS (
+                        INSERT INTO STUDENTS (STU_ID, NUMBER, EARNED_CREDITS, DEPARTMENT, FACULTY, CLUB, LAB)
+                        SELECT people.P_ID, input.NUMBER, input.EARNED_CREDITS, input.DEPARTMENT, input.FACULTY,
+                        input.CLUB, input.LAB
+                        FROM people JOIN input ON input.EMAIL = people.EMAIL
+                    )
+                    SELECT EMAIL, P_ID FROM people"""
+                template = "(%s, %s, %s, %s, %s::INTEGER, %s::INTEGER, %s::INTEGER, %s::INTEGER, %s::INTEGER, %s::INTEGER)"
+                data = [(student.name, student.mail, student.photo, student.password, student.number, student.cred,
+                         student.depart, student.facu, student.club, student.lab) for student in students]
+                ids = dict(execute_values(cursor, statement, data, template, page_size=len(data), fetch=True))
+                for student in students:
+                    student.id = ids[student.mail]
+                cursor.close()
+        except Exception as err:
+            print("Add Students Error: ", err)
+            return None
+
+        return students
+
+    @writes("students", "people")
+    def import_students(self, columns, stream):
+        """
+        Imports students from CSV in one transaction. The rows are streamed with COPY into a
+        temporary STUDENT_IMPORT table, checked there, and PEOPLE and STUDENTS are upserted from the
+        rows that passed with one statement, matched on EMAIL. Malformed lines are rejected like
+        any other row that does not pass the checks. Passwords are given in plain text
+        and stored as md5.
+
+        :param columns: Columns of the CSV in order, from IMPORT_COLUMNS of student_import
+        :param stream: File object positioned after the header
+        :return: Dictionary with "created" and "updated" counts and "rejected", a list of
+            (row, email, reason) tuples where row 1 is the first row after the header.
+            None on error, nothing is imported then.
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""CREATE TEMP TABLE STUDENT_IMPORT (
+                    ROW_NUMBER INTEGER, NAME TEXT, EMAIL TEXT, NUMBER TEXT, CREDITS TEXT,
+                    DEPARTMENT TEXT, FACULTY TEXT, CLUB TEXT, LAB TEXT, PASSWORD TEXT, PHOTO TEXT,
+                    REASON TEXT
+                ) ON COMMIT DROP""")
+                cursor.copy_expert("COPY STUDENT_IMPORT (ROW_NUMBER, %s, REASON) FROM STDIN WITH (FORMAT csv)" % ", ".join(columns),
+                                   _ImportRows(stream, columns))
+                cursor.execute("ANALYZE STUDENT_IMPORT")
+
+                # Every reason is its own WHEN so that a value is only cast once it is known to be
+                # a number. The lookups go through primary keys and the EMAIL key.
+                statement = r"""UPDATE STUDENT_IMPORT SET REASON = checked.REASON FROM (SELECT s.ROW_NUMBER, CASE
+                        WHEN s.REASON IS NOT NULL THEN s.REASON
+                        WHEN coalesce(trim(s.NAME), '') = '' THEN 'missing name'
+                        WHEN coalesce(trim(s.EMAIL), '') = '' THEN 'missing email'
+                        WHEN s.EMAILS > 1 THEN 'duplicate email'
+                        WHEN coalesce(s.NUMBER, '') !~ '^\s*\d{1,9}\s*$' THEN 'invalid number'
+                        WHEN s.NUMBERS > 1 THEN 'duplicate number'
+                        WHEN coalesce(s.CREDITS, '') !~ '^\s*\d{0,9}\s*$' THEN 'invalid credits'
+                        WHEN coalesce(s.DEPARTMENT, '') !~ '^\s*\d{1,9}\s*$' THEN 'invalid department'
+                        WHEN NOT EXISTS (SELECT 1 FROM DEPARTMENTS WHERE DEP_ID = trim(s.DEPARTMENT)::INTEGER) THEN 'unknown department'
+                        WHEN coalesce(s.FACULTY, '') !~ '^\s*\d{1,9}\s*$' THEN 'invalid faculty'
+                        WHEN NOT EXISTS (SELECT 1 FROM FACULTIES WHERE FAC_ID = trim(s.FACULTY)::INTEGER) THEN 'unknown faculty'
+                        WHEN coalesce(s.CLUB, '') !~ '^\s*\d{0,9}\s*$' THEN 'invalid club'
+                        WHEN trim(s.CLUB) <> '' AND NOT EXISTS (SELECT 1 FROM CLUBS WHERE CLUB_ID = trim(s.CLUB)::INTEGER) THEN 'unknown club'
+                        WHEN coalesce(s.LAB, '') !~ '^\s*\d{0,9}\s*$' THEN 'invalid lab'
+                        WHEN trim(s.LAB) <> '' AND NOT EXISTS (SELECT 1 FROM LABS WHERE LAB_ID = trim(s.LAB)::INTEGER) THEN 'unknown lab'
+                        WHEN EXISTS (SELECT 1 FROM PEOPLE WHERE EMAIL = trim(s.EMAIL) AND TYPE IS DISTINCT FROM 'student') THEN 'email is not a student'
+                        WHEN coalesce(s.PASSWORD, '') = '' AND NOT EXISTS (SELECT 1 FROM PEOPLE WHERE EMAIL = trim(s.EMAIL)) THEN 'missing password'
+                    END AS REASON
+                    FROM (SELECT *, count(*) FILTER (WHERE REASON IS NULL) OVER (PARTITION BY trim(EMAIL)) AS EMAILS,
+                        count(*) FILTER (WHERE REASON IS NULL) OVER (PARTITION BY trim(NUMBER)) AS NUMBERS
+                        FROM STUDENT_IMPORT) s) checked
+                    WHERE checked.REASON IS NOT NULL AND STUDENT_IMPORT.REASON IS NULL
+                    AND STUDENT_IMPORT.ROW_NUMBER = checked.ROW_NUMBER"""
+                cursor.execute(statement)
 
-                statement = "INSERT INTO STUDENTS (STU_ID, NUMBER, EARNED_CREDITS, DEPARTMENT, FACULTY, CLUB, LAB) VALUES (%s, %s, %s, %s, %s, %s, %s)"
-                data = [person.id, student.number, student.cred, student.depart, student.facu, student.club,
-                        student.lab]
-                cursor.execute(statement, data)
+                statement = """UPDATE STUDENT_IMPORT s SET REASON = 'number is taken'
+                    FROM STUDENTS JOIN PEOPLE ON PEOPLE.P_ID = STUDENTS.STU_ID
+                    WHERE s.REASON IS NULL AND STUDENTS.NUMBER = trim(s.NUMBER)::INTEGER
+                    AND PEOPLE.EMAIL <> trim(s.EMAIL)"""
+                cursor.execute(statement)
+
+                # Empty credits, password and photo keep what an existing student has. Rows that
+                # would not change anything are not written, so importing a file again is cheap.
+                statement = """WITH rows AS (
+                        SELECT imported.*, PEOPLE.P_ID,
+                        (PEOPLE.NAME, PEOPLE.PHOTO, PEOPLE.PASSWORD) IS DISTINCT FROM
+                            (imported.NAME, imported.PHOTO, imported.PASSWORD) AS PERSON_CHANGED,
+                        (STUDENTS.NUMBER, STUDENTS.EARNED_CREDITS, STUDENTS.DEPARTMENT, STUDENTS.FACULTY, STUDENTS.CLUB, STUDENTS.LAB)
+                            IS DISTINCT FROM (imported.NUMBER, imported.CREDITS, imported.DEPARTMENT, imported.FACULTY,
+                            imported.CLUB, imported.LAB) AS STUDENT_CHANGED
+                        FROM STUDENT_IMPORT s
+                        LEFT JOIN PEOPLE ON PEOPLE.EMAIL = trim(s.EMAIL)
+                        LEFT JOIN STUDENTS ON STUDENTS.STU_ID = PEOPLE.P_ID
+                        CROSS JOIN LATERAL (SELECT trim(s.NAME) AS NAME, trim(s.EMAIL) AS EMAIL,
+                            trim(s.NUMBER)::INTEGER AS NUMBER,
+                            coalesce(nullif(trim(s.CREDITS), '')::INTEGER, STUDENTS.EARNED_CREDITS, 0) AS CREDITS,
+                            trim(s.DEPARTMENT)::INTEGER AS DEPARTMENT, trim(s.FACULTY)::INTEGER AS FACULTY,
+                            nullif(trim(s.CLUB), '')::INTEGER AS CLUB, nullif(trim(s.LAB), '')::INTEGER AS LAB,
+                            coalesce(md5(nullif(s.PASSWORD, '')), PEOPLE.PASSWORD) AS PASSWORD,
+                            coalesce(nullif(trim(s.PHOTO), ''), PEOPLE.PHOTO, 'defaultpfp.jpg') AS PHOTO) imported
+                        WHERE s.REASON IS NULL
+                    ),
+                    people AS (
+                        INSERT INTO PEOPLE (NAME, EMAIL, PHOTO, PASSWORD, TYPE)
+                        SELECT NAME, EMAIL, PHOTO, PASSWORD, 'student' FROM rows WHERE PERSON_CHANGED
+                        ON CONFLICT (EMAIL) DO UPDATE SET NAME = EXCLUDED.NAME, PHOTO = EXCLUDED.PHOTO,
+                            PASSWORD = EXCLUDED.PASSWORD
+                        WHERE PEOPLE.TYPE = 'student'
+                        RETURNING P_ID, EMAIL
+                    ),
+                    students AS (
+                        INSERT INTO STUDENTS (STU_ID, NUMBER, EARNED_CREDITS, DEPARTMENT, FACULTY, CLUB, LAB)
+                        SELECT coalesce(rows.P_ID, people.P_ID), rows.NUMBER, rows.CREDITS, rows.DEPARTMENT,
+                        rows.FACULTY, rows.CLUB, rows.LAB
+                        FROM rows LEFT JOIN people ON people.EMAIL = rows.EMAIL
+                        WHERE rows.STUDENT_CHANGED
+                        ON CONFLICT (STU_ID) DO UPDATE SET NUMBER = EXCLUDED.NUMBER,
+                            EARNED_CREDITS = EXCLUDED.EARNED_CREDITS, DEPARTMENT = EXCLUDED.DEPARTMENT,
+                            FACULTY = EXCLUDED.FACULTY, CLUB = EXCLUDED.CLUB, LAB = EXCLUDED.LAB
+                    )
+                    SELECT count(*) FILTER (WHERE P_ID IS NULL),
+                    count(*) FILTER (WHERE P_ID IS NOT NULL AND (PERSON_CHANGED OR STUDENT_CHANGED)) FROM rows"""
+                cursor.execute(statement)
+                created, updated = cursor.fetchone()
+
+                statement = "SELECT ROW_NUMBER, EMAIL, REASON FROM STUDENT_IMPORT WHERE REASON IS NOT NULL ORDER BY ROW_NUMBER"
+                cursor.execute(statement)
+                rejected = cursor.fetchall()
                 cursor.close()
         except Exception as err:
-            print("Error: ", err)
+            print("Import Students Error: ", err)
+            return None
+
+        return {"created": created, "updated": updated, "rejected": rejected}
 
+    @reads("students")
     def get_student(self, stu_id):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM STUDENTS WHERE STU_ID = %s"
                 values = [stu_id]
@@ -435,9 +1095,10 @@ class Database:
 
         return None
 
+    @reads("students", "people")
     def get_student_w_join(self, stu_id):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = """
                     SELECT 
@@ -459,9 +1120,10 @@ class Database:
 
         return None
 
+    @reads("students", "people")
     def get_students(self):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM STUDENTS JOIN PEOPLE ON (STUDENTS.STU_ID = PEOPLE.P_ID)"
                 cursor.execute(statement)
@@ -481,68 +1143,157 @@ class Database:
 
         return None
 
+    @reads("students", "people")
+    def get_students_page(self, sort="number", after=None, before=None, limit=STUDENT_PAGE_SIZE):
+        """
+        One page of students in keyset order, the cost of a page does not depend on how many come
+        before it.
+
+        :param sort: Key of STUDENT_SORTS
+        :param after: (sort key, ID) of the last row of the previous page, the page starts after it
+        :param before: (sort key, ID) of the first row of the next page, the page ends before it
+        :param limit: Students per page
+        :return: Dictionary with "students" (list of dictionaries with "ID", "Name" and "Number"),
+            "prev" and "next" ((sort key, ID) to pass as before and after, None on the first and
+            last pages), None on error
+        """
+        key, tie = STUDENT_SORTS[sort]
+        backward = before is not None
+        statement = "SELECT STUDENTS.STU_ID, PEOPLE.NAME, STUDENTS.NUMBER, {} FROM STUDENTS JOIN PEOPLE ON PEOPLE.P_ID = STUDENTS.STU_ID".format(key)
+        data = []
+        if after is not None or backward:
+            statement += " WHERE ({}, {}) {} (%s, %s)".format(key, tie, "<" if backward else ">")
+            data.extend(before if backward else after)
+        # One row more than the page tells whether there is another page in that direction.
+        statement += " ORDER BY {0} {2}, {1} {2} LIMIT %s".format(key, tie, "DESC" if backward else "ASC")
+        data.append(limit + 1)
+
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(statement, data)
+                datas = cursor.fetchall()
+                cursor.close()
+        except Exception as err:
+            print("Get students page Error: ", err)
+            return None
+
+        more = len(datas) > limit
+        datas = datas[:limit]
+        if backward:
+            datas.reverse()
+        page = {
+            "students": [{"ID": data[0], "Name": data[1], "Number": data[2]} for data in datas],
+            "prev": None,
+            "next": None,
+        }
+        if datas:
+            first = (datas[0][3], datas[0][0])
+            last = (datas[-1][3], datas[-1][0])
+            page["prev"] = first if (more if backward else after is not None) else None
+            page["next"] = last if (backward or more) else None
+        return page
+
+    @reads("students")
+    def get_students_estimate(self):
+        """
+        :return: Number of students according to the planner statistics, None if the table has not
+            been analyzed yet or on error
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT reltuples::BIGINT FROM pg_class WHERE oid = 'students'::regclass")
+                data = cursor.fetchone()
+                cursor.close()
+                if data is None or data[0] < 0:
+                    return None
+                return data[0]
+        except Exception as err:
+            print("Get students estimate Error: ", err)
+
+        return None
+
+    def iter_students(self, batch_size=None):
+        """
+        Streams every student, departments, faculties, clubs and labs by name.
+
+        :return: Generator of dictionaries with the keys EXPORT_KEYS["students"]
+        """
+        statement = """SELECT STUDENTS.STU_ID, PEOPLE.NAME, PEOPLE.EMAIL, STUDENTS.NUMBER, STUDENTS.EARNED_CREDITS,
+            DEPARTMENTS.DEP_NAME, FACULTIES.FAC_NAME, CLUBS.NAME, LABS.LAB_NAME
+            FROM STUDENTS JOIN PEOPLE ON PEOPLE.P_ID = STUDENTS.STU_ID
+            LEFT JOIN DEPARTMENTS ON DEPARTMENTS.DEP_ID = STUDENTS.DEPARTMENT
+            LEFT JOIN FACULTIES ON FACULTIES.FAC_ID = STUDENTS.FACULTY
+            LEFT JOIN CLUBS ON CLUBS.CLUB_ID = STUDENTS.CLUB
+            LEFT JOIN LABS ON LABS.LAB_ID = STUDENTS.LAB
+            ORDER BY STUDENTS.STU_ID"""
+        return self._stream("export_students", statement, EXPORT_KEYS["students"], batch_size)
+
+    @writes("students", "enrollment")
     def delete_student(self, student_key):
-        student = self.get_student(student_key)
+        return bool(self.delete_students([student_key]))
 
-        if student:
-            try:
-                with dbapi2.connect(self.url) as connection:
-                    cursor = connection.cursor()
-                    statement = "DELETE FROM STUDENTS WHERE stu_id = %s"
-                    values = [student_key]
-                    cursor.execute(statement, values)
-                    cursor.close()
-            except Exception as err:
-                print("Delete Student Error: ", err)
+    @writes("students", "enrollment")
+    def delete_students(self, student_keys):
+        """
+        :return: IDs of the deleted students, None on error
+        """
+        try:
+            return self._delete("students", student_keys)
+        except Exception as err:
+            print("Delete Student Error: ", err)
+
+        return None
 
+    @writes("students")
     def update_student(self, student_key, attrs, values):
-        student = self.get_student(student_key)
-        if not student:
-            return False
+        try:
+            return self._update("students", student_key, attrs, values)
+        except Exception as err:
+            print("Update Student Error: ", err)
 
-        if student:
-            try:
-                with dbapi2.connect(self.url) as connection:
-                    cursor = connection.cursor()
-                    statement = "UPDATE STUDENTS SET "
-                    for attr in attrs[:-1]:
-                        statement += attr + " = %s , "
-                    statement += attrs[-1] + " = %s "
-                    statement += " WHERE stu_id = %s"
-                    values.append(student_key)
-                    cursor.execute(statement, values)
-                    cursor.close()
-            except Exception as err:
-                print("Update Student Error: ", err)
+        return None
 
 
     ############# FACULTIES ###############
 
 
     # Create
+    @writes("faculties")
     def add_faculty(self, faculty):
+        self.add_faculties([faculty])
+        return faculty
+
+    @writes("faculties")
+    def add_faculties(self, faculties):
+        """
+        Inserts faculties with one multi-row INSERT and sets their IDs.
+
+        :return: The faculties, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                data = [faculty.name, faculty.building, faculty.dean, faculty.assistant_dean_1]
-                if faculty.assistant_dean_2 is not None:
-                    data.append(faculty.assistant_dean_2)
-                    statement = "INSERT INTO FACULTIES (FAC_NAME, FAC_BUILDING, DEAN, DEAN_ASST_1, DEAN_ASST_2) VALUES (%s, %s, %s, %s, %s)"
-                    cursor.execute(statement, data)
-                else:
-                    statement = "INSERT INTO FACULTIES (FAC_NAME, FAC_BUILDING, DEAN, DEAN_ASST_1) VALUES (%s, %s, %s, %s)"
-                    cursor.execute(statement, data)
+                statement = "INSERT INTO FACULTIES (FAC_NAME, FAC_BUILDING, DEAN, DEAN_ASST_1, DEAN_ASST_2) VALUES %s RETURNING FAC_ID"
+                data = [(faculty.name, faculty.building, faculty.dean, faculty.assistant_dean_1, faculty.assistant_dean_2) for faculty in faculties]
+                for faculty, value in zip(faculties, _insert_returning(cursor, statement, data)):
+                    faculty.id = value
                 cursor.close()
         except Exception as err:
-            print("Add faculty Error: ", err)
+            print("Add Faculties Error: ", err)
+            return None
+
+        return faculties
 
     # Read
+    @reads("faculties")
     def get_faculty(self, fac_id):
         """
         Gets faculty id as an input, returns query results.
         By: Uğur Ali Kaplan"""
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM FACULTIES WHERE FAC_ID = %s"
                 data = [fac_id]
@@ -557,6 +1308,7 @@ class Database:
         return None
 
 
+    @reads("faculties", "buildings")
     def get_faculties(self):
         """
         Joins faculty and buildings table, returns relevant columns as a dictionary.
@@ -565,7 +1317,7 @@ class Database:
         By: Uğur Ali Kaplan
         """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM faculties INNER JOIN buildings ON faculties.fac_id = bu_id"
                 cursor.execute(statement)
@@ -585,44 +1337,36 @@ class Database:
             print("Get Faculties DB Error: ", err)
 
     # Delete
+    @writes("faculties")
     def delete_faculty(self, fac_id):
+        return bool(self.delete_faculties([fac_id]))
+
+    @writes("faculties")
+    def delete_faculties(self, fac_ids):
+        """
+        :return: IDs of the deleted faculties, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "DELETE FROM FACULTIES WHERE FAC_ID = %s"
-                values = [fac_id]
-                cursor.execute(statement, values)
-                cursor.close()
+            return self._delete("faculties", fac_ids)
         except Exception as err:
             print("Delete Faculty Error: ", err)
 
+        return None
+
     # Update
+    @writes("faculties")
     def update_faculty(self, fac_id, attrs, values):
-        attrs_lookup_table = {
-            "name": "FAC_NAME",
-            "building": "FAC_BUILDING",
-            "dean": "DEAN",
-            "vdean_1": "DEAN_ASST_1",
-            "vdean_2": "DEAN_ASST_2",
-        }
-
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "UPDATE FACULTIES SET "
-                for i in range(len(attrs) - 1):
-                    statement += attrs_lookup_table[attrs[i]] + " = %s ,"
-                statement += attrs_lookup_table[attrs[-1]] + " = %s WHERE FAC_ID = %s"
-                values.append(fac_id)
-                cursor.execute(statement, values)
-                cursor.close()
-
+            return self._update("faculties", fac_id, attrs, values)
         except Exception as err:
             print("Update Faculty Error: ", err)
 
+        return None
+
+    @reads("faculties", shared=reference_cache)
     def get_all_faculties(self):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM FACULTIES"
                 cursor.execute(statement)
@@ -635,88 +1379,84 @@ class Database:
 
         return None
 
+    @reads("faculties", "buildings", "people")
     def get_faculty_as_text(self):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                statement = "SELECT (f.fac_id, f.fac_name, b.bu_name, p1.name, p2.name, p3.name) FROM faculties f JOIN buildings b ON f.fac_building = b.bu_id JOIN people p1 ON f.dean = p1.p_id JOIN people p2 ON f.dean_asst_1 = p2.p_id LEFT JOIN people p3 ON f.dean_asst_2 = p3.p_id"
+                statement = "SELECT f.fac_id, f.fac_name, b.bu_name, p1.name, p2.name, COALESCE(p3.name, '') FROM faculties f JOIN buildings b ON f.fac_building = b.bu_id JOIN people p1 ON f.dean = p1.p_id JOIN people p2 ON f.dean_asst_1 = p2.p_id LEFT JOIN people p3 ON f.dean_asst_2 = p3.p_id"
                 cursor.execute(statement)
-                data = cursor.fetchall()
+                retval = decode(cursor, ("ID", "Name", "Building", "Dean", "VDean1", "VDean2"))
                 cursor.close()
-                retval = []
-                for datum in data:
-                    datum = datum[0].lstrip("(").rstrip(")").split(",")
-                    val = {
-                        "ID": datum[0],
-                        "Name": datum[1].strip('"'),
-                        "Building": datum[2].strip('"'),
-                        "Dean": datum[3].strip('"'),
-                        "VDean1": datum[4].strip('"'),
-                        "VDean2": datum[5].strip('"')
-                    }
-                    retval.append(val)
                 return retval
         except Exception as err:
-            print("Get Faculty Info(The one with the string parsing) DB Error: ", err)
+            print("Get Faculty Info DB Error: ", err)
 
 
     ############# ASSISTANTS ###############
 
+    @writes("assistants")
     def add_assistant(self, assistant):
+        self.add_assistants([assistant])
+        return assistant
+
+    @writes("assistants")
+    def add_assistants(self, assistants):
+        """
+        Inserts assistants with one multi-row INSERT and sets their IDs.
+
+        :return: The assistants, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                data = [assistant.person, assistant.lab, assistant.degree, assistant.department, assistant.faculty]
-                statement = "INSERT INTO ASSISTANTS (AS_PERSON, LAB, DEGREE, DEPARTMENT, FACULTY) VALUES (%s, %s, %s, %s, %s)"
-                cursor.execute(statement, data)
+                statement = "INSERT INTO ASSISTANTS (AS_PERSON, LAB, DEGREE, DEPARTMENT, FACULTY) VALUES %s RETURNING AS_ID"
+                data = [(assistant.person, assistant.lab, assistant.degree, assistant.department, assistant.faculty) for assistant in assistants]
+                for assistant, value in zip(assistants, _insert_returning(cursor, statement, data)):
+                    assistant.id = value
                 cursor.close()
         except Exception as err:
-            print("Add assistant Error: ", err)
+            print("Add Assistants Error: ", err)
+            return None
+
+        return assistants
 
+    @reads("assistants", "people")
     def get_assistant(self, as_id):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                statement = "SELECT (a.as_id, p.name, p.email, p.photo, a.degree, a.as_person, a.lab, a.department, a.faculty) FROM assistants a JOIN people p ON a.as_person = p.p_id WHERE a.as_id = %s"
+                statement = "SELECT a.as_id, p.name, p.email, p.photo, a.degree, a.as_person, a.lab, a.department, a.faculty FROM assistants a JOIN people p ON a.as_person = p.p_id WHERE a.as_id = %s"
                 data = [as_id]
                 cursor.execute(statement, data)
-                data = cursor.fetchall()
+                retval = decode_one(cursor, ("ID", "Name", "Email", "Photo", "Degree", "Person", "Lab", "Dep", "Fac"))
                 cursor.close()
-                retval = []
-                for datum in data:
-                    datum = datum[0].lstrip("(").rstrip(")").split(",")
-                    val = {
-                        "ID": datum[0],
-                        "Name": datum[1].strip('"'),
-                        "Email": datum[2].strip('"'),
-                        "Photo": datum[3].strip('"'),
-                        "Degree": datum[4].strip('"'),
-                        "Person": int(datum[5]),
-                        "Lab": int(datum[6]),
-                        "Dep": int(datum[7]),
-                        "Fac": int(datum[8])
-                    }
-                    retval.append(val)
-                return retval[0]
+                return retval
         except Exception as err:
             print("Get assistant DB Error: ", err)
 
         return None
 
+    @writes("assistants")
     def delete_assistant(self, as_id):
+        return bool(self.delete_assistants([as_id]))
+
+    @writes("assistants")
+    def delete_assistants(self, as_ids):
+        """
+        :return: IDs of the deleted assistants, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "DELETE FROM ASSISTANTS WHERE AS_ID = %s"
-                values = [as_id]
-                cursor.execute(statement, values)
-                cursor.close()
+            return self._delete("assistants", as_ids)
         except Exception as err:
             print("Delete assistant Error: ", err)
 
+        return None
+
+    @reads("assistants", "people")
     def get_assistants(self):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM ASSISTANTS JOIN PEOPLE ON (ASSISTANTS.as_person = PEOPLE.p_id)"
                 cursor.execute(statement)
@@ -728,68 +1468,60 @@ class Database:
 
         return None
 
+    @writes("assistants")
     def update_assistant(self, as_id, attrs, values):
-        attrs_lookup_table = {
-            "person": "AS_PERSON",
-            "lab": "LAB",
-            "degree": "DEGREE",
-            "department": "DEPARTMENT",
-            "faculty": "FACULTY",
-        }
-
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "UPDATE ASSISTANTS SET "
-                for i in range(len(attrs) - 1):
-                    statement += attrs_lookup_table[attrs[i]] + " = %s ,"
-                statement += attrs_lookup_table[attrs[-1]] + " = %s WHERE AS_ID = %s"
-                values.append(as_id)
-                cursor.execute(statement, values)
-                cursor.close()
-
+            return self._update("assistants", as_id, attrs, values)
         except Exception as err:
             print("Update assistant Error: ", err)
 
+        return None
+
+    @reads("assistants", "people")
     def get_assistant_info(self):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                statement = "SELECT (a.as_id, p.name, p.email, p.photo, a.degree) FROM assistants a JOIN people p ON a.as_person = p.p_id"
+                statement = "SELECT a.as_id, p.name, p.email, p.photo, a.degree FROM assistants a JOIN people p ON a.as_person = p.p_id"
                 cursor.execute(statement)
-                data = cursor.fetchall()
+                retval = decode(cursor, ("ID", "Name", "Email", "Photo", "Degree"))
                 cursor.close()
-                retval = []
-                for datum in data:
-                    datum = datum[0].lstrip("(").rstrip(")").split(",")
-                    val = {
-                        "ID": datum[0],
-                        "Name": datum[1].strip('"'),
-                        "Email": datum[2],
-                        "Photo": datum[3],
-                        "Degree": datum[4]
-                    }
-                    retval.append(val)
                 return retval
         except Exception as err:
-            print("Get Assistant Info(The one with the string parsing) DB Error: ", err)
+            print("Get Assistant Info DB Error: ", err)
 
     ############# LABS ###############
 
+    @writes("labs")
     def add_lab(self, lab):
+        self.add_labs([lab])
+        return lab
+
+    @writes("labs")
+    def add_labs(self, labs):
+        """
+        Inserts labs with one multi-row INSERT and sets their IDs.
+
+        :return: The labs, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                data = [lab.name, lab.department, lab.faculty, lab.building, lab.room, lab.investigator]
-                statement = "INSERT INTO LABS (LAB_NAME, DEPARTMENT, FACULTY, BUILDING, ROOM, INVESTIGATOR) VALUES (%s, %s, %s, %s, %s, %s)"
-                cursor.execute(statement, data)
+                statement = "INSERT INTO LABS (LAB_NAME, DEPARTMENT, FACULTY, BUILDING, ROOM, INVESTIGATOR) VALUES %s RETURNING LAB_ID"
+                data = [(lab.name, lab.department, lab.faculty, lab.building, lab.room, lab.investigator) for lab in labs]
+                for lab, value in zip(labs, _insert_returning(cursor, statement, data)):
+                    lab.id = value
                 cursor.close()
         except Exception as err:
-            print("Add lab Error: ", err)
+            print("Add Labs Error: ", err)
+            return None
+
+        return labs
 
+    @reads("labs")
     def get_lab(self, lab_id):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM LABS WHERE LAB_ID = %s"
                 data = [lab_id]
@@ -802,44 +1534,35 @@ class Database:
 
         return None
 
+    @writes("labs")
     def delete_lab(self, lab_id):
+        return bool(self.delete_labs([lab_id]))
+
+    @writes("labs")
+    def delete_labs(self, lab_ids):
+        """
+        :return: IDs of the deleted labs, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "DELETE FROM LABS WHERE LAB_ID = %s"
-                values = [lab_id]
-                cursor.execute(statement, values)
-                cursor.close()
+            return self._delete("labs", lab_ids)
         except Exception as err:
             print("Delete lab Error: ", err)
 
-    def update_lab(self, lab_id, attrs, values):
-        attrs_lookup_table = {
-            "name": "LAB_NAME",
-            "department": "DEPARTMENT",
-            "faculty": "FACULTY",
-            "building": "BUILDING",
-            "room": "ROOM",
-            "investigator": "INVESTIGATOR"
-        }
+        return None
 
+    @writes("labs")
+    def update_lab(self, lab_id, attrs, values):
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "UPDATE LABS SET "
-                for i in range(len(attrs) - 1):
-                    statement += attrs_lookup_table[attrs[i]] + " = %s ,"
-                statement += attrs_lookup_table[attrs[-1]] + " = %s WHERE LAB_ID = %s"
-                values.append(lab_id)
-                cursor.execute(statement, values)
-                cursor.close()
-
+            return self._update("labs", lab_id, attrs, values)
         except Exception as err:
             print("Update lab Error: ", err)
 
+        return None
+
+    @reads("labs", shared=reference_cache)
     def get_all_labs(self):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM LABS"
                 cursor.execute(statement)
@@ -851,47 +1574,51 @@ class Database:
 
         return None
 
+    @reads("labs", "departments", "faculties", "buildings", "rooms", "people")
     def get_lab_info(self):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                statement = "SELECT (l.lab_id, l.lab_name, d.dep_name, f.fac_name, b.bu_name, r.room_name, p.name) FROM labs l JOIN departments d ON l.department=d.dep_id JOIN faculties f ON l.faculty = f.fac_id JOIN buildings b ON l.building=b.bu_id JOIN rooms r ON l.room = r.room_id JOIN people p ON l.investigator=p.p_id"
+                statement = "SELECT l.lab_id, l.lab_name, d.dep_name, f.fac_name, b.bu_name, r.room_name, p.name FROM labs l JOIN departments d ON l.department=d.dep_id JOIN faculties f ON l.faculty = f.fac_id JOIN buildings b ON l.building=b.bu_id JOIN rooms r ON l.room = r.room_id JOIN people p ON l.investigator=p.p_id"
                 cursor.execute(statement)
-                data = cursor.fetchall()
+                retval = decode(cursor, ("ID", "Name", "Department", "Faculty", "Building", "Room", "Investigator"))
                 cursor.close()
-                retval = []
-                for datum in data:
-                    datum = datum[0].lstrip("(").rstrip(")").split(",")
-                    val = {
-                        "ID": datum[0],
-                        "Name": datum[1].strip('"'),
-                        "Department": datum[2].strip('"'),
-                        "Faculty": datum[3].strip('"'),
-                        "Building": datum[4].strip('"'),
-                        "Room": datum[5].strip('"'),
-                        "Investigator": datum[6].strip('"')
-                    }
-                    retval.append(val)
                 return retval
         except Exception as err:
-            print("Get Lab Info(The one with the string parsing) DB Error: ", err)
+            print("Get Lab Info DB Error: ", err)
 
     ############# DEPARTMENTS ###############
 
+    @writes("departments")
     def add_department(self, department):
+        self.add_departments([department])
+        return department
+
+    @writes("departments")
+    def add_departments(self, departments):
+        """
+        Inserts departments with one multi-row INSERT and sets their IDs.
+
+        :return: The departments, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                data = [department.name, department.faculty, department.building, department.dean]
-                statement = "INSERT INTO DEPARTMENTS (DEP_NAME, FACULTY, BUILDING, DEAN) VALUES (%s, %s, %s, %s)"
-                cursor.execute(statement, data)
+                statement = "INSERT INTO DEPARTMENTS (DEP_NAME, FACULTY, BUILDING, DEAN) VALUES %s RETURNING DEP_ID"
+                data = [(department.name, department.faculty, department.building, department.dean) for department in departments]
+                for department, value in zip(departments, _insert_returning(cursor, statement, data)):
+                    department.id = value
                 cursor.close()
         except Exception as err:
-            print(" Add department Error: ", err)
+            print("Add Departments Error: ", err)
+            return None
+
+        return departments
 
+    @reads("departments")
     def get_department(self, dep_id):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM DEPARTMENTS WHERE DEP_ID = %s"
                 data = [dep_id]
@@ -904,42 +1631,35 @@ class Database:
 
         return None
 
+    @writes("departments")
     def delete_department(self, dep_id):
+        return bool(self.delete_departments([dep_id]))
+
+    @writes("departments")
+    def delete_departments(self, dep_ids):
+        """
+        :return: IDs of the deleted departments, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "DELETE FROM DEPARTMENTS WHERE DEP_ID = %s"
-                values = [dep_id]
-                cursor.execute(statement, values)
-                cursor.close()
+            return self._delete("departments", dep_ids)
         except Exception as err:
             print("Delete Department Error: ", err)
 
-    def update_department(self, dep_id, attrs, values):
-        attrs_lookup_table = {
-            "name": "dep_name",
-            "faculty": "faculty",
-            "building": "building",
-            "dean": "dean"
-        }
+        return None
 
+    @writes("departments")
+    def update_department(self, dep_id, attrs, values):
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "UPDATE DEPARTMENTS SET "
-                for i in range(len(attrs) - 1):
-                    statement += attrs_lookup_table[attrs[i]] + " = %s ,"
-                statement += attrs_lookup_table[attrs[-1]] + " = %s WHERE DEP_ID = %s"
-                values.append(dep_id)
-                cursor.execute(statement, values)
-                cursor.close()
-
+            return self._update("departments", dep_id, attrs, values)
         except Exception as err:
             print("Update Department Error: ", err)
 
+        return None
+
+    @reads("departments", shared=reference_cache)
     def get_all_departments(self):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM DEPARTMENTS"
                 cursor.execute(statement)
@@ -951,13 +1671,14 @@ class Database:
 
         return None
 
+    @reads("departments", "faculties", "buildings", "people")
     def get_departments_text(self):
         """
 
         :return: Information as dictionary.
         """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM departments INNER JOIN faculties ON departments.faculty = faculties.fac_id INNER JOIN buildings ON departments.building = buildings.bu_id INNER JOIN people ON departments.dean = people.p_id"
                 cursor.execute(statement)
@@ -979,8 +1700,9 @@ class Database:
 
     ############# PAPERS ###############
 
+    @reads("papers", "people")
     def get_authors(self):
-        with dbapi2.connect(self.url) as connection:
+        with self._connect() as connection:
             cursor = connection.cursor()
             statement = "SELECT DISTINCT author, name from papers join people on author=p_id;"
             cursor.execute(statement)
@@ -995,20 +1717,36 @@ class Database:
                 retval.append(val)
             return retval
 
+    @writes("papers")
     def add_paper(self, paper):
+        self.add_papers([paper])
+        return paper
+
+    @writes("papers")
+    def add_papers(self, papers):
+        """
+        Inserts papers with one multi-row INSERT and sets their IDs.
+
+        :return: The papers, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                data = [paper.title, paper.platform, paper.citation, paper.author, paper.isConference]
-                statement = "INSERT INTO PAPERS (TITLE, PLAT, CITATION_COUNT, AUTHOR, CONFERENCE) VALUES (%s, %s, %s, %s, %s)"
-                cursor.execute(statement, data)
+                statement = "INSERT INTO PAPERS (TITLE, PLAT, CITATION_COUNT, AUTHOR, CONFERENCE) VALUES %s RETURNING PAPER_ID"
+                data = [(paper.title, paper.platform, paper.citation, paper.author, paper.isConference) for paper in papers]
+                for paper, value in zip(papers, _insert_returning(cursor, statement, data)):
+                    paper.id = value
                 cursor.close()
         except Exception as err:
-            print("Add Paper Error: ", err)
+            print("Add Papers Error: ", err)
+            return None
+
+        return papers
 
+    @reads("papers")
     def get_paper(self, paper_id):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM PAPERS WHERE PAPER_ID = %s"
                 data = [paper_id]
@@ -1021,107 +1759,89 @@ class Database:
 
         return None
 
+    @writes("papers")
     def delete_paper(self, paper_id):
+        return bool(self.delete_papers([paper_id]))
+
+    @writes("papers")
+    def delete_papers(self, paper_ids):
+        """
+        :return: IDs of the deleted papers, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "DELETE FROM PAPERS WHERE PAPER_ID = %s"
-                values = [paper_id]
-                cursor.execute(statement, values)
-                cursor.close()
+            return self._delete("papers", paper_ids)
         except Exception as err:
             print("Delete paper error: ", err)
 
-    def update_paper(self, paper_id, attrs, values):
-        attrs_lookup_table = {
-            "title": "TITLE",
-            "platform": "PLAT",
-            "citation": "CITATION_COUNT",
-            "author": "AUTHOR",
-            "isConference": "CONFERENCE"
-        }
+        return None
 
+    @writes("papers")
+    def update_paper(self, paper_id, attrs, values):
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "UPDATE PAPERS SET "
-                for i in range(len(attrs) - 1):
-                    statement += attrs_lookup_table[attrs[i]] + " = %s ,"
-                statement += attrs_lookup_table[attrs[-1]] + " = %s WHERE PAPER_ID = %s"
-                values.append(paper_id)
-                cursor.execute(statement, values)
-                cursor.close()
-
+            return self._update("papers", paper_id, attrs, values)
         except Exception as err:
             print("Update Paper Error: ", err)
 
+        return None
+
+    @reads("papers", "people")
     def get_paper_by_author(self, person):
+        """
+        Papers of an author, each with the names of everyone who has a paper with the same title.
+        Co-authors are aggregated in the same statement, so this is one round trip regardless of
+        how many papers the author has.
+
+        :param person: ID of the author
+        :return: Information as dictionary.
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                statement = "SELECT (paper_id, title, plat, citation_count, conference) FROM papers WHERE papers.author = %s"
+                statement = """SELECT p.paper_id, p.title, p.plat, p.citation_count, p.conference,
+                    array_agg(DISTINCT people.name)
+                    FROM papers p
+                    JOIN papers co ON co.title = p.title
+                    JOIN people ON people.p_id = co.author
+                    WHERE p.author = %s
+                    GROUP BY p.paper_id
+                    ORDER BY p.paper_id"""
                 data = [person]
                 cursor.execute(statement, data)
-                data = cursor.fetchall()
+                retval = decode(cursor, ("ID", "Title", "Platform", "Citation", "Conference", "Authors"))
                 cursor.close()
-                retval = []
-                for datum in data:
-                    datum = datum[0].lstrip("(").rstrip(")").split(",")
-                    val = {
-                        "ID": datum[0],
-                        "Title": datum[1].strip('"'),
-                        "Platform": datum[2].strip('"'),
-                        "Citation": datum[3],
-                        "Conference": datum[4],
-                        "Authors": []
-                    }
-
-                    if val["Conference"] == "t":
-                        val["Conference"] = True
-                    else:
-                        val["Conference"] = False
-
-                    retval.append(val)
-
-                for val in retval:
-                    cursor = connection.cursor()
-                    statement = "SELECT name FROM papers p1 JOIN papers p2 ON p1.title = p2.title JOIN people p3 ON p3.p_id = p1.author WHERE p1.author <> p2.author AND p1.title = %s"
-                    data = [val["Title"]]
-                    cursor.execute(statement, data)
-                    data = cursor.fetchall()
-                    for datum in data:
-                        val["Authors"].append(datum[0])
-                    val["Authors"] = list(set(val["Authors"]))
-                    if len(val["Authors"]) == 0:
-                        statement = "SELECT name FROM papers p1 JOIN people p2 ON p1.author=p2.p_id WHERE title = %s"
-                        data = [val["Title"]]
-                        cursor.execute(statement, data)
-                        data = cursor.fetchall()
-                        val["Authors"].append(data[0][0])
-                    cursor.close()
-
                 return retval
         except Exception as err:
             print("Get Paper by Author DB Error: ", err)
 
     ############# BUILDINGS ###############
 
+    @writes("buildings")
     def add_building(self, building):
+        self.add_buildings([building])
+        return building
+
+    @writes("buildings")
+    def add_buildings(self, buildings):
         """
+        Inserts buildings with one multi-row INSERT and sets their IDs.
 
-        :param building: A building object
-        :return:
+        :return: The buildings, None on error
         """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                data = [building.name, building.code, building.campus]
-                statement = "INSERT INTO BUILDINGS (BU_NAME, BU_CODE, CAMPUS) VALUES (%s, %s, %s)"
-                cursor.execute(statement, data)
+                statement = "INSERT INTO BUILDINGS (BU_NAME, BU_CODE, CAMPUS) VALUES %s RETURNING BU_ID"
+                data = [(building.name, building.code, building.campus) for building in buildings]
+                for building, value in zip(buildings, _insert_returning(cursor, statement, data)):
+                    building.id = value
                 cursor.close()
         except Exception as err:
-            print("Add Building Error: ", err)
+            print("Add Buildings Error: ", err)
+            return None
 
+        return buildings
+
+    @reads("buildings")
     def get_building(self, bu_id):
         """
 
@@ -1129,7 +1849,7 @@ class Database:
         :return:
         """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT bu_id, bu_name, bu_code, campus FROM BUILDINGS WHERE BU_ID = %s"
                 data = [bu_id]
@@ -1142,13 +1862,14 @@ class Database:
 
         return None
 
+    @reads("buildings", shared=reference_cache)
     def get_buildings(self):
         """
 
         :return: Information as dictionary.
         """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM buildings"
                 cursor.execute(statement)
@@ -1167,54 +1888,63 @@ class Database:
         except Exception as err:
             print("Get Faculties DB Error: ", err)
 
+    @writes("buildings", "rooms", "classrooms")
     def delete_building(self, bu_id):
+        return bool(self.delete_buildings([bu_id]))
+
+    @writes("buildings", "rooms", "classrooms")
+    def delete_buildings(self, bu_ids):
+        """
+        :return: IDs of the deleted buildings, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "DELETE FROM BUILDINGS WHERE BU_ID = %s"
-                values = [bu_id]
-                cursor.execute(statement, values)
-                cursor.close()
+            return self._delete("buildings", bu_ids)
         except Exception as err:
             print("Delete building error: ", err)
 
-    def update_building(self, bu_id, attrs, values):
-        attrs_lookup_table = {
-            "name": "BU_NAME",
-            "code": "BU_CODE",
-            "campus": "CAMPUS"
-        }
+        return None
 
+    @writes("buildings")
+    def update_building(self, bu_id, attrs, values):
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "UPDATE BUILDINGS SET "
-                for i in range(len(attrs) - 1):
-                    statement += attrs_lookup_table[attrs[i]] + " = %s ,"
-                statement += attrs_lookup_table[attrs[-1]] + " = %s WHERE BU_ID = %s"
-                values.append(bu_id)
-                cursor.execute(statement, values)
-                cursor.close()
-
+            return self._update("buildings", bu_id, attrs, values)
         except Exception as err:
-            print("Update Department Error: ", err)
+            print("Update Building Error: ", err)
+
+        return None
 
     ############# CLUBS ###############
 
+    @writes("clubs")
     def add_club(self, club):
+        self.add_clubs([club])
+        return club
+
+    @writes("clubs")
+    def add_clubs(self, clubs):
+        """
+        Inserts clubs with one multi-row INSERT and sets their IDs.
+
+        :return: The clubs, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                data = [club.name, club.faculty, club.advisor, club.chairman, club.vice_1, club.vice_2]
-                statement = "INSERT INTO CLUBS (NAME, FACULTY, ADVISOR, CHAIRMAN, V_CHAIRMAN_1, V_CHAIRMAN_2) VALUES (%s, %s, %s, %s, %s, %s)"
-                cursor.execute(statement, data)
+                statement = "INSERT INTO CLUBS (NAME, FACULTY, ADVISOR, CHAIRMAN, V_CHAIRMAN_1, V_CHAIRMAN_2) VALUES %s RETURNING CLUB_ID"
+                data = [(club.name, club.faculty, club.advisor, club.chairman, club.vice_1, club.vice_2) for club in clubs]
+                for club, value in zip(clubs, _insert_returning(cursor, statement, data)):
+                    club.id = value
                 cursor.close()
         except Exception as err:
-            print("Add Club Error: ", err)
+            print("Add Clubs Error: ", err)
+            return None
 
+        return clubs
+
+    @reads("clubs")
     def get_club(self, club_id):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM CLUBS WHERE CLUB_ID = %s"
                 data = [club_id]
@@ -1228,44 +1958,35 @@ class Database:
 
         return None
 
+    @writes("clubs")
     def delete_club(self, club_id):
+        return bool(self.delete_clubs([club_id]))
+
+    @writes("clubs")
+    def delete_clubs(self, club_ids):
+        """
+        :return: IDs of the deleted clubs, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "DELETE FROM CLUBS WHERE CLUB_ID = %s"
-                values = [club_id]
-                cursor.execute(statement, values)
-                cursor.close()
+            return self._delete("clubs", club_ids)
         except Exception as err:
             print("Delete club error: ", err)
 
-    def update_club(self, club_id, attrs, values):
-        attrs_lookup_table = {
-            "name": "NAME",
-            "faculty": "FACULTY",
-            "advisor": "ADVISOR",
-            "chairman": "CHAIRMAN",
-            "vice_1": "V_CHAIRMAN_1",
-            "vice_2": "V_CHAIRMAN_2"
-        }
+        return None
 
+    @writes("clubs")
+    def update_club(self, club_id, attrs, values):
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
-                statement = "UPDATE CLUBS SET "
-                for i in range(len(attrs) - 1):
-                    statement += attrs_lookup_table[attrs[i]] + " = %s ,"
-                statement += attrs_lookup_table[attrs[-1]] + " = %s WHERE CLUB_ID = %s"
-                values.append(club_id)
-                cursor.execute(statement, values)
-                cursor.close()
-
+            return self._update("clubs", club_id, attrs, values)
         except Exception as err:
             print("Update Club Error: ", err)
 
+        return None
+
+    @reads("clubs")
     def get_all_clubs(self):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM CLUBS"
                 cursor.execute(statement)
@@ -1278,62 +1999,66 @@ class Database:
 
         return None
 
+    @reads("clubs", "faculties", "people", shared=reference_cache)
     def get_clubs_info_astext(self):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                statement = "SELECT (c.club_id, c.name, f.fac_name, p1.name, p2.name, p3.name, p4.name) FROM clubs c JOIN faculties f ON c.faculty=f.fac_id JOIN people p1 ON c.advisor=p1.p_id JOIN people p2 ON c.chairman=p2.p_id JOIN people p3 ON c.v_chairman_1=p3.p_id JOIN people p4 ON c.v_chairman_2=p4.p_id"
+                statement = "SELECT c.club_id, c.name, f.fac_name, p1.name, p2.name, p3.name, p4.name FROM clubs c JOIN faculties f ON c.faculty=f.fac_id JOIN people p1 ON c.advisor=p1.p_id JOIN people p2 ON c.chairman=p2.p_id JOIN people p3 ON c.v_chairman_1=p3.p_id JOIN people p4 ON c.v_chairman_2=p4.p_id"
                 cursor.execute(statement)
-                data = cursor.fetchall()
+                retval = decode(cursor, ("ID", "Name", "Faculty", "Advisor", "Chair", "VChair1", "VChair2"))
                 cursor.close()
-                retval = []
-                for datum in data:
-                    datum = datum[0].lstrip("(").rstrip(")").split(",")
-                    val = {
-                        "ID": datum[0],
-                        "Name": datum[1].strip('"'),
-                        "Faculty": datum[2].strip('"'),
-                        "Advisor": datum[3].strip('"'),
-                        "Chair": datum[4].strip('"'),
-                        "VChair1": datum[5].strip('"'),
-                        "VChair2": datum[6].strip('"')
-                    }
-                    retval.append(val)
                 return retval
         except Exception as err:
             print("Get Clubs(All Text) DB Error: ", err)
 
 #################### LESSONS ######################
 
+    @writes("lessons")
     def create_lesson(self, lesson):
+        return self.add_lessons([lesson]) is not None
+
+    @writes("lessons")
+    def add_lessons(self, lessons):
+        """
+        Inserts lessons and their meeting times with one multi-row INSERT each and sets their IDs.
+
+        :return: The lessons, None on error
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                statement = """INSERT INTO LESSONS (CRN, DATE, CODE, INSTRUCTOR, LOCATION, ASSISTANT, CREDIT, CAP, ENROLLED) 
-                                VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s)"""
-                values = [lesson.crn, lesson.date, lesson.code, lesson.instructor, lesson.location, lesson.assistant, lesson.credit, lesson.cap, lesson.enrolled]
-                cursor.execute(statement, values)
+                statement = "INSERT INTO LESSONS (CRN, DATE, CODE, INSTRUCTOR, LOCATION, ASSISTANT, CREDIT, CAP, ENROLLED, ROOM_TYPE, BOARD_TYPE) VALUES %s RETURNING LESSON_ID"
+                data = [(lesson.crn, lesson.date, lesson.code, lesson.instructor, lesson.location, lesson.assistant, lesson.credit,
+                     lesson.cap, lesson.enrolled, lesson.room_type, lesson.board_type) for lesson in lessons]
+                for lesson, value in zip(lessons, _insert_returning(cursor, statement, data)):
+                    lesson.id = value
+                slots = slot_arrays((lesson.id, lesson.date) for lesson in lessons)
+                if slots[0]:
+                    cursor.execute(INSERT_SLOTS, slots)
                 cursor.close()
-                return True
-
         except Exception as err:
-            print("Create Lesson Error: ", err) 
+            print("Add Lessons Error: ", err)
+            return None
 
-        return False
+        return lessons
 
+    @reads("lessons", "instructors", "people", "classrooms")
     def search_lesson_by_crn(self, crn):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                statement = """SELECT * FROM LESSONS 
+                statement = """SELECT LESSONS.lesson_id, LESSONS.crn, LESSONS.code, LESSONS.date, PEOPLE.name,
+                LESSONS.cap, LESSONS.enrolled
+                FROM LESSONS
                 JOIN INSTRUCTORS ON (LESSONS.instructor = INSTRUCTORS.ins_id) 
                 JOIN PEOPLE ON (INSTRUCTORS.ins_id = PEOPLE.p_id)
-                JOIN CLASSES ON (LESSONS.location = CLASSES.cl_id)
+                LEFT JOIN CLASSES ON (LESSONS.location = CLASSES.cl_id)
                 WHERE LESSONS.crn = %s
                 """
                 values = [crn]
                 cursor.execute(statement, values)
-                data = cursor.fetchall()
+                data = decode(cursor, LESSON_SEARCH_KEYS)
                 cursor.close()
                 return data
 
@@ -1342,20 +2067,22 @@ class Database:
 
         return False
 
+    @reads("lessons", "instructors", "people", "classrooms")
     def search_lesson_by_instructor(self, instructor):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
-                statement = """SELECT * FROM 
-                LESSONS 
+                statement = """SELECT LESSONS.lesson_id, LESSONS.crn, LESSONS.code, LESSONS.date, PEOPLE.name,
+                LESSONS.cap, LESSONS.enrolled
+                FROM LESSONS
                 JOIN INSTRUCTORS ON (LESSONS.instructor = INSTRUCTORS.ins_id) 
                 JOIN PEOPLE ON (INSTRUCTORS.ins_id = PEOPLE.p_id)
-                JOIN CLASSES ON (LESSONS.location = CLASSES.cl_id)
+                LEFT JOIN CLASSES ON (LESSONS.location = CLASSES.cl_id)
                 WHERE PEOPLE.name = %s
                 """
                 values = [instructor]
                 cursor.execute(statement, values)
-                data = cursor.fetchall()
+                data = decode(cursor, LESSON_SEARCH_KEYS)
                 cursor.close()
                 return data
 
@@ -1363,43 +2090,163 @@ class Database:
             print("Search Lesson Error: ", err) 
 
 
+    @writes("enrollment", "lessons")
     def enroll_for_student(self, student_id, lesson_id):
-        try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
+        """
+        Claims a seat and enrolls the student with a single statement. ENROLLED is only
+        incremented while it is below CAP and the enrollment row is only inserted when that
+        increment happened, so concurrent requests can not oversubscribe a lesson. A concurrent
+        duplicate enrollment is rejected by the unique (student_id, lesson_id) index.
+
+        Lessons meeting at the same time as one the student is enrolled in are rejected. The
+        student row is locked first so two concurrent requests can not both pass that check.
 
-                statement = "SELECT ENROLLED, CAP FROM LESSONS WHERE lesson_id = %s"
-                values = [lesson_id]
+        :return: True if the student got a seat
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT 1 FROM STUDENTS WHERE STU_ID = %s FOR NO KEY UPDATE", [student_id])
+                statement = """WITH seat AS (
+                        UPDATE LESSONS SET ENROLLED = ENROLLED + 1
+                        WHERE LESSON_ID = %(lesson)s AND ENROLLED < CAP
+                        AND NOT EXISTS (SELECT 1 FROM ENROLLMENT WHERE STUDENT_ID = %(student)s AND LESSON_ID = %(lesson)s)
+                        AND NOT EXISTS (SELECT 1 FROM ENROLLMENT e
+                            JOIN LESSON_SLOTS mine ON mine.LESSON_ID = e.LESSON_ID
+                            JOIN LESSON_SLOTS new ON new.PERIOD && mine.PERIOD
+                            WHERE e.STUDENT_ID = %(student)s AND new.LESSON_ID = %(lesson)s)
+                        RETURNING LESSON_ID
+                    )
+                    INSERT INTO ENROLLMENT (STUDENT_ID, LESSON_ID)
+                    SELECT %(student)s::INTEGER, LESSON_ID FROM seat
+                    RETURNING ENROLL_ID"""
+                values = {"student": student_id, "lesson": lesson_id}
                 cursor.execute(statement, values)
-                data = cursor.fetchone()
+                enrolled = cursor.fetchone() is not None
+                cursor.close()
 
-                enr, cap = data
+        except dbapi2.IntegrityError:
+            # Lost the race against the same student's other request.
+            return False
+        except Exception as err:
+            print("Insert Enrollment Error: ", err)
+            return False
 
-                if(enr == cap):
-                    cursor.close()
-                    return False
+        if enrolled:
+            self.invalidate(schedule_tag(student_id))
+        return enrolled
 
-                statement = "INSERT INTO ENROLLMENT (student_id, lesson_id) VALUES (%s, %s)"
-                values = [student_id, lesson_id]
+    @writes("enrollment", "lessons")
+    def enroll_many(self, student_id, lesson_ids=(), crns=()):
+        """
+        Enrolls a student in several lessons with one statement in one transaction, claiming every
+        seat that is still available. Lessons are locked in LESSON_ID order so that students
+        registering for overlapping sets of lessons do not deadlock.
+
+        :param lesson_ids: IDs of the lessons
+        :param crns: CRNs of the lessons, can be combined with lesson_ids
+        Lessons that meet at the same time as one the student is enrolled in, or as another
+        lesson of the same request, are not enrolled.
+
+        :return: List of dictionaries with ID, CRN and Status ("enrolled", "already enrolled",
+            "conflict", "full" or "not found"), None if the statement failed
+        """
+        lesson_ids = [int(lesson_id) for lesson_id in lesson_ids]
+        crns = [int(crn) for crn in crns]
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT 1 FROM STUDENTS WHERE STU_ID = %s FOR NO KEY UPDATE", [student_id])
+                statement = """WITH wanted AS (
+                        SELECT LESSON_ID, CRN FROM LESSONS
+                        WHERE LESSON_ID = ANY(%(lessons)s::INTEGER[]) OR CRN = ANY(%(crns)s::INTEGER[])
+                    ),
+                    conflicting AS (
+                        SELECT new.LESSON_ID FROM LESSON_SLOTS new
+                        JOIN LESSON_SLOTS mine ON mine.PERIOD && new.PERIOD AND mine.LESSON_ID <> new.LESSON_ID
+                        WHERE new.LESSON_ID IN (SELECT LESSON_ID FROM wanted)
+                        AND (mine.LESSON_ID IN (SELECT LESSON_ID FROM wanted)
+                            OR mine.LESSON_ID IN (SELECT LESSON_ID FROM ENROLLMENT WHERE STUDENT_ID = %(student)s))
+                    ),
+                    locked AS (
+                        SELECT l.LESSON_ID FROM LESSONS l
+                        WHERE l.LESSON_ID IN (SELECT LESSON_ID FROM wanted) AND l.ENROLLED < l.CAP
+                        AND NOT EXISTS (SELECT 1 FROM ENROLLMENT e WHERE e.STUDENT_ID = %(student)s AND e.LESSON_ID = l.LESSON_ID)
+                        AND l.LESSON_ID NOT IN (SELECT LESSON_ID FROM conflicting)
+                        ORDER BY l.LESSON_ID
+                        FOR UPDATE
+                    ),
+                    seat AS (
+                        UPDATE LESSONS SET ENROLLED = ENROLLED + 1
+                        FROM locked
+                        WHERE LESSONS.LESSON_ID = locked.LESSON_ID AND LESSONS.ENROLLED < LESSONS.CAP
+                        RETURNING LESSONS.LESSON_ID
+                    ),
+                    ins AS (
+                        INSERT INTO ENROLLMENT (STUDENT_ID, LESSON_ID)
+                        SELECT %(student)s::INTEGER, LESSON_ID FROM seat
+                        RETURNING LESSON_ID
+                    )
+                    SELECT w.LESSON_ID, w.CRN,
+                        CASE WHEN ins.LESSON_ID IS NOT NULL THEN 'enrolled'
+                             WHEN EXISTS (SELECT 1 FROM ENROLLMENT e WHERE e.STUDENT_ID = %(student)s AND e.LESSON_ID = w.LESSON_ID) THEN 'already enrolled'
+                             WHEN w.LESSON_ID IN (SELECT LESSON_ID FROM conflicting) THEN 'conflict'
+                             ELSE 'full' END
+                    FROM wanted w LEFT JOIN ins ON ins.LESSON_ID = w.LESSON_ID
+                    ORDER BY w.LESSON_ID"""
+                values = {"student": student_id, "lessons": lesson_ids, "crns": crns}
                 cursor.execute(statement, values)
+                retval = decode(cursor, ("ID", "CRN", "Status"))
+                cursor.close()
 
-                # update the lesson object
+        except dbapi2.IntegrityError:
+            # The same student enrolled in one of the lessons concurrently.
+            return None
+        except Exception as err:
+            print("Bulk Enrollment Error: ", err)
+            return None
 
-                statement = "UPDATE LESSONS SET ENROLLED = ENROLLED + 1 WHERE LESSON_ID = %s"
-                values = [lesson_id, ]
-                cursor.execute(statement,values)
+        if any(val["Status"] == "enrolled" for val in retval):
+            self.invalidate(schedule_tag(student_id))
 
-                cursor.close()
-                return True
+        found_ids = {val["ID"] for val in retval}
+        found_crns = {val["CRN"] for val in retval}
+        for lesson_id in lesson_ids:
+            if lesson_id not in found_ids:
+                retval.append({"ID": lesson_id, "CRN": None, "Status": "not found"})
+        for crn in crns:
+            if crn not in found_crns:
+                retval.append({"ID": None, "CRN": crn, "Status": "not found"})
+        return retval
 
+    @reads("enrollment", "lessons")
+    def get_conflicts(self, student_id, lesson_id):
+        """
+        :return: CRNs of the student's lessons that meet at the same time as the given lesson
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """SELECT DISTINCT LESSONS.CRN FROM ENROLLMENT e
+                    JOIN LESSON_SLOTS mine ON mine.LESSON_ID = e.LESSON_ID
+                    JOIN LESSON_SLOTS new ON new.PERIOD && mine.PERIOD
+                    JOIN LESSONS ON LESSONS.LESSON_ID = e.LESSON_ID
+                    WHERE e.STUDENT_ID = %s AND new.LESSON_ID = %s AND e.LESSON_ID <> new.LESSON_ID
+                    ORDER BY LESSONS.CRN"""
+                values = [student_id, lesson_id]
+                cursor.execute(statement, values)
+                data = [row[0] for row in cursor.fetchall()]
+                cursor.close()
+                return data
         except Exception as err:
-            print("Insert Enrollment Error: ", err) 
+            print("Fetch Conflicts Error: ", err)
 
-        return False
+        return None
 
+    @reads("enrollment")
     def get_enrolled(self, student_id):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = "SELECT * FROM ENROLLMENT WHERE student_id = %s"
                 values = [student_id]
@@ -1413,9 +2260,10 @@ class Database:
 
         return False
 
+    @reads("enrollment", "lessons", "instructors", "classrooms", "people", "rooms", "buildings")
     def get_enrolled_w_join(self, student_id):
         try:
-            with dbapi2.connect(self.url) as connection:
+            with self._connect() as connection:
                 cursor = connection.cursor()
                 statement = """
                 SELECT 
@@ -1427,10 +2275,10 @@ class Database:
                 FROM ENROLLMENT 
                 JOIN LESSONS ON (ENROLLMENT.lesson_id = LESSONS.lesson_id)
                 JOIN INSTRUCTORS ON (LESSONS.instructor = INSTRUCTORS.ins_id)
-                JOIN CLASSES ON (LESSONS.location = CLASSES.cl_id)
+                LEFT JOIN CLASSES ON (LESSONS.location = CLASSES.cl_id)
                 JOIN PEOPLE ON (PEOPLE.p_id = INSTRUCTORS.ins_id)
-                JOIN ROOMS ON (CLASSES.cl_id = ROOMS.room_id)
-                JOIN BUILDINGS ON (ROOMS.building = BUILDINGS.bu_id)
+                LEFT JOIN ROOMS ON (CLASSES.cl_id = ROOMS.room_id)
+                LEFT JOIN BUILDINGS ON (ROOMS.building = BUILDINGS.bu_id)
                 WHERE ENROLLMENT.student_id = %s"""
                 values = [student_id, ]
                 cursor.execute(statement, values)
@@ -1443,32 +2291,563 @@ class Database:
 
         return False
 
+    def get_schedule(self, student_id):
+        """
+        Weekly timetable of a student, built from LESSON_SLOTS. Timetables are shared by every
+        request of the worker until the student's enrollments or one of SCHEDULE_TAGS change. Writes
+        in other workers can not reach this worker's cache, so a cached timetable is only used while
+        the versions of its tags in CACHE_VERSIONS are the ones it was built with.
+
+        :return: Dictionary with "lessons" (one dictionary per enrolled lesson) and the "days" and
+            "rows" of timeslots.weekly_grid, None on error. Callers must not modify it.
+        """
+        tags = SCHEDULE_TAGS + (schedule_tag(student_id),)
+        # Read before the timetable: a write committed in between makes it look stale, not fresh.
+        versions = self._get_versions(tags)
+        # Uncommitted enrollments of this transaction must not leak into the shared cache.
+        shareable = versions is not None and not self._dirty.intersection(tags)
+        if shareable:
+            hit, cached = schedule_cache.get(student_id)
+            if hit and cached[0] == versions:
+                return cached[1]
+
+        token = schedule_cache.token()
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """SELECT LESSONS.LESSON_ID, LESSONS.CRN, LESSONS.CREDIT, LESSONS.CODE, LESSONS.DATE,
+                    PEOPLE.NAME, PEOPLE.EMAIL, BUILDINGS.BU_NAME, ROOMS.ROOM_NAME,
+                    LESSON_SLOTS.WEEKDAY, lower(LESSON_SLOTS.PERIOD) - LESSON_SLOTS.WEEKDAY * 1440,
+                    upper(LESSON_SLOTS.PERIOD) - LESSON_SLOTS.WEEKDAY * 1440
+                    FROM ENROLLMENT
+                    JOIN LESSONS ON LESSONS.LESSON_ID = ENROLLMENT.LESSON_ID
+                    LEFT JOIN PEOPLE ON PEOPLE.P_ID = LESSONS.INSTRUCTOR
+                    LEFT JOIN ROOMS ON ROOMS.ROOM_ID = LESSONS.LOCATION
+                    LEFT JOIN BUILDINGS ON BUILDINGS.BU_ID = ROOMS.BUILDING
+                    LEFT JOIN LESSON_SLOTS ON LESSON_SLOTS.LESSON_ID = LESSONS.LESSON_ID
+                    WHERE ENROLLMENT.STUDENT_ID = %s
+                    ORDER BY LESSONS.CODE, LESSONS.CRN"""
+                cursor.execute(statement, [student_id])
+                rows = cursor.fetchall()
+                cursor.close()
+        except Exception as err:
+            print("Fetch Schedule Error: ", err)
+            return None
+
+        lessons = {}
+        slots = []
+        keys = ("CRN", "Credits", "Code", "Date", "Instructor", "Email", "Building", "Room")
+        for row in rows:
+            lessons.setdefault(row[0], dict(zip(keys, row[1:9])))
+            if row[9] is not None:
+                slots.append((row[9], row[10], row[11], "%s (%s)" % (row[3], row[1])))
+
+        schedule = weekly_grid(slots)
+        schedule["lessons"] = list(lessons.values())
+        if shareable:
+            schedule_cache.set(student_id, (versions, schedule), tags, token)
+        return schedule
+
+    @writes("enrollment", "lessons", "waitlist")
     def leave_for_student(self, student_id, lesson_id):
+        """
+        Removes the enrollment and, in the same statement, either gives the seat to the student at
+        the head of the lesson's waitlist or gives it back to the lesson. Waiting students whose
+        schedule now clashes with the lesson are passed over.
+
+        :return: True if the student was enrolled in the lesson
+        """
         try:
-            with dbapi2.connect(self.url) as connection:
-                cursor = connection.cursor()
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """WITH gone AS (
+                        DELETE FROM ENROLLMENT WHERE STUDENT_ID = %(student)s AND LESSON_ID = %(lesson)s
+                        RETURNING LESSON_ID
+                    ),
+                    head AS (
+                        SELECT w.WAIT_ID FROM WAITLIST w
+                        WHERE w.LESSON_ID = %(lesson)s AND EXISTS (SELECT 1 FROM gone)
+                        AND EXISTS (SELECT 1 FROM LESSONS WHERE LESSON_ID = %(lesson)s AND ENROLLED - 1 < CAP)
+                        AND NOT EXISTS (SELECT 1 FROM ENROLLMENT e
+                            JOIN LESSON_SLOTS mine ON mine.LESSON_ID = e.LESSON_ID
+                            JOIN LESSON_SLOTS new ON new.PERIOD && mine.PERIOD
+                            WHERE e.STUDENT_ID = w.STUDENT_ID AND new.LESSON_ID = %(lesson)s)
+                        ORDER BY w.WAIT_ID
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    ),
+                    promoted AS (
+                        DELETE FROM WAITLIST w USING head WHERE w.WAIT_ID = head.WAIT_ID
+                        RETURNING w.STUDENT_ID
+                    ),
+                    ins AS (
+                        INSERT INTO ENROLLMENT (STUDENT_ID, LESSON_ID)
+                        SELECT STUDENT_ID, %(lesson)s::INTEGER FROM promoted
+                        ON CONFLICT (STUDENT_ID, LESSON_ID) DO NOTHING
+                        RETURNING STUDENT_ID
+                    )
+                    UPDATE LESSONS SET ENROLLED = ENROLLED - gone.n + (SELECT count(*) FROM ins)
+                    FROM (SELECT count(*) AS n FROM gone) gone
+                    WHERE LESSON_ID = %(lesson)s AND gone.n > 0
+                    RETURNING LESSONS.LESSON_ID, (SELECT STUDENT_ID FROM ins)"""
+                values = {"student": student_id, "lesson": lesson_id}
+                cursor.execute(statement, values)
+                row = cursor.fetchone()
+                cursor.close()
 
-                enrolled = self.get_enrolled(student_id)
-                lesson_ids = [enr[2] for enr in enrolled]
-                lesson_id = int(lesson_id)
+        except Exception as err:
+            print("Delete Enrollment Error: ", err)
+            return False
 
-                if lesson_id not in lesson_ids:
-                    cursor.close()
-                    return False
+        if row is None:
+            return False
+        self.invalidate(schedule_tag(student_id))
+        if row[1] is not None:
+            self.invalidate(schedule_tag(row[1]))
+        return True
+
+    ############# WAITLIST ###############
+
+    @writes("waitlist")
+    def join_waitlist(self, student_id, lesson_id):
+        """
+        Puts the student at the end of a full lesson's waitlist.
+
+        :return: Position of the student in the waitlist, None if the lesson is not full, the
+            student is already enrolled or the lesson does not exist
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                # The inserted row is not visible to the rest of the statement, so the position
+                # counts the rows ahead of it. A student already waiting keeps their place.
+                statement = """WITH joined AS (
+                        INSERT INTO WAITLIST (STUDENT_ID, LESSON_ID)
+                        SELECT %(student)s::INTEGER, LESSON_ID FROM LESSONS
+                        WHERE LESSON_ID = %(lesson)s AND ENROLLED >= CAP
+                        AND NOT EXISTS (SELECT 1 FROM ENROLLMENT WHERE STUDENT_ID = %(student)s AND LESSON_ID = %(lesson)s)
+                        ON CONFLICT (STUDENT_ID, LESSON_ID) DO NOTHING
+                        RETURNING WAIT_ID
+                    ), mine AS (
+                        SELECT WAIT_ID FROM joined
+                        UNION ALL
+                        SELECT WAIT_ID FROM WAITLIST WHERE STUDENT_ID = %(student)s AND LESSON_ID = %(lesson)s
+                    )
+                    SELECT 1 + (SELECT count(*) FROM WAITLIST o WHERE o.LESSON_ID = %(lesson)s AND o.WAIT_ID < mine.WAIT_ID)
+                    FROM mine"""
+                values = {"student": student_id, "lesson": lesson_id}
+                cursor.execute(statement, values)
+                data = cursor.fetchone()
+                cursor.close()
+                return data[0] if data else None
+        except Exception as err:
+            print("Join Waitlist Error: ", err)
+
+        return None
 
-                statement = "DELETE FROM ENROLLMENT WHERE student_id = %s AND lesson_id = %s"
+    @writes("waitlist")
+    def leave_waitlist(self, student_id, lesson_id):
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = "DELETE FROM WAITLIST WHERE STUDENT_ID = %s AND LESSON_ID = %s"
                 values = [student_id, lesson_id]
                 cursor.execute(statement, values)
+                left = cursor.rowcount > 0
+                cursor.close()
+                return left
+        except Exception as err:
+            print("Leave Waitlist Error: ", err)
 
-                # update lessons object
-                statement = "UPDATE LESSONS SET ENROLLED = ENROLLED - 1 WHERE LESSON_ID = %s"
-                values = [lesson_id]
-                cursor.execute(statement,values)
+        return False
 
+    @reads("waitlist")
+    def get_waitlist_positions(self, student_id):
+        """
+        :return: Dictionary of lesson ID -> position of the student in that lesson's waitlist
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """SELECT w.LESSON_ID,
+                    (SELECT count(*) FROM WAITLIST o WHERE o.LESSON_ID = w.LESSON_ID AND o.WAIT_ID <= w.WAIT_ID)
+                    FROM WAITLIST w WHERE w.STUDENT_ID = %s"""
+                values = [student_id]
+                cursor.execute(statement, values)
+                data = cursor.fetchall()
+                cursor.close()
+                return dict(data)
+        except Exception as err:
+            print("Fetch Waitlist Error: ", err)
+
+        return None
+
+    ############# PREFERENCES ###############
+
+    @writes("preferences")
+    def set_preferences(self, student_id, code, lesson_ids):
+        """
+        Replaces the student's ranked section choices for a course.
+
+        :param code: Course code, every lesson must be a section of it
+        :param lesson_ids: Lesson IDs, most wanted first
+        :return: True on success
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """DELETE FROM PREFERENCES WHERE STUDENT_ID = %s
+                    AND LESSON_ID IN (SELECT LESSON_ID FROM LESSONS WHERE CODE = %s)"""
+                cursor.execute(statement, [student_id, code])
+                statement = """INSERT INTO PREFERENCES (STUDENT_ID, LESSON_ID, RANK)
+                    SELECT %s, LESSONS.LESSON_ID, choice.RANK
+                    FROM unnest(%s::INTEGER[]) WITH ORDINALITY AS choice (LESSON_ID, RANK)
+                    JOIN LESSONS ON LESSONS.LESSON_ID = choice.LESSON_ID
+                    WHERE LESSONS.CODE = %s"""
+                cursor.execute(statement, [student_id, [int(lesson_id) for lesson_id in lesson_ids], code])
                 cursor.close()
                 return True
+        except Exception as err:
+            print("Set Preferences Error: ", err)
+
+        return False
 
+    @reads("preferences", "lessons")
+    def get_preferences(self, student_id):
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """SELECT LESSONS.CODE, LESSONS.LESSON_ID, LESSONS.CRN, PREFERENCES.RANK
+                    FROM PREFERENCES JOIN LESSONS ON LESSONS.LESSON_ID = PREFERENCES.LESSON_ID
+                    WHERE PREFERENCES.STUDENT_ID = %s ORDER BY LESSONS.CODE, PREFERENCES.RANK"""
+                cursor.execute(statement, [student_id])
+                data = decode(cursor, ("Code", "ID", "CRN", "Rank"))
+                cursor.close()
+                return data
         except Exception as err:
-            print("Insert Enrollment Error: ", err) 
+            print("Fetch Preferences Error: ", err)
+
+        return None
 
-        return False
\ No newline at end of file
+    def get_allocation_input(self):
+        """
+        Locks every lesson that has preferences and reads what the allocator needs. Use a scoped
+        Database so the locks are held until the result is written with write_allocation.
+        Students that already have a section of a course are left out of that course, sections
+        clashing with a student's enrolled lessons are left out of their choices.
+
+        :return: List of (code, lesson ID, free seats, student ID, rank) tuples
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """SELECT l.CODE, l.LESSON_ID, GREATEST(l.CAP - l.ENROLLED, 0), p.STUDENT_ID, p.RANK
+                    FROM PREFERENCES p JOIN LESSONS l ON l.LESSON_ID = p.LESSON_ID
+                    WHERE NOT EXISTS (SELECT 1 FROM ENROLLMENT e JOIN LESSONS el ON el.LESSON_ID = e.LESSON_ID
+                        WHERE e.STUDENT_ID = p.STUDENT_ID AND el.CODE = l.CODE)
+                    AND NOT EXISTS (SELECT 1 FROM ENROLLMENT e
+                        JOIN LESSON_SLOTS mine ON mine.LESSON_ID = e.LESSON_ID
+                        JOIN LESSON_SLOTS new ON new.PERIOD && mine.PERIOD
+                        WHERE e.STUDENT_ID = p.STUDENT_ID AND new.LESSON_ID = l.LESSON_ID)
+                    ORDER BY l.LESSON_ID
+                    FOR UPDATE OF l"""
+                cursor.execute(statement)
+                data = cursor.fetchall()
+                cursor.close()
+                return data
+        except Exception as err:
+            print("Fetch Allocation Input Error: ", err)
+
+        return None
+
+    @reads("lessons", "timetable")
+    def get_allocation_periods(self):
+        """
+        :return: Dictionary of lesson ID -> list of (start, end) minutes since Monday 00:00 of the
+            meetings of lessons that have preferences, None on error
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """SELECT LESSON_ID, array_agg(lower(PERIOD)), array_agg(upper(PERIOD)) FROM LESSON_SLOTS
+                    WHERE LESSON_ID IN (SELECT LESSON_ID FROM PREFERENCES)
+                    GROUP BY LESSON_ID"""
+                cursor.execute(statement)
+                data = {row[0]: list(zip(row[1], row[2])) for row in cursor.fetchall()}
+                cursor.close()
+                return data
+        except Exception as err:
+            print("Fetch Allocation Periods Error: ", err)
+
+        return None
+
+    @writes("enrollment", "lessons")
+    def write_allocation(self, assignments):
+        """
+        Enrolls allocated students and raises ENROLLED of their lessons in one statement.
+
+        :param assignments: List of (student ID, lesson ID) pairs
+        :return: Number of enrollments written, None on error
+        """
+        if not assignments:
+            return 0
+
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """WITH ins AS (
+                        INSERT INTO ENROLLMENT (STUDENT_ID, LESSON_ID)
+                        SELECT * FROM unnest(%s::INTEGER[], %s::INTEGER[])
+                        ON CONFLICT (STUDENT_ID, LESSON_ID) DO NOTHING
+                        RETURNING LESSON_ID
+                    ),
+                    counts AS (SELECT LESSON_ID, count(*) AS n FROM ins GROUP BY LESSON_ID)
+                    UPDATE LESSONS SET ENROLLED = ENROLLED + counts.n FROM counts
+                    WHERE LESSONS.LESSON_ID = counts.LESSON_ID
+                    RETURNING counts.n"""
+                students, lessons = zip(*assignments)
+                cursor.execute(statement, [list(students), list(lessons)])
+                written = sum(row[0] for row in cursor.fetchall())
+                cursor.close()
+        except Exception as err:
+            print("Write Allocation Error: ", err)
+            return None
+
+        self.invalidate(*{schedule_tag(student_id) for student_id in students})
+        return written
+
+    ############# EXAMS ###############
+
+    @reads("lessons")
+    def get_exam_sections(self):
+        """
+        :return: Dictionary of lesson ID -> number of enrolled students, for lessons with students
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = "SELECT LESSON_ID, ENROLLED FROM LESSONS WHERE ENROLLED > 0"
+                cursor.execute(statement)
+                data = dict(cursor.fetchall())
+                cursor.close()
+                return data
+        except Exception as err:
+            print("Fetch Exam Sections Error: ", err)
+
+        return None
+
+    @reads("enrollment")
+    def get_exam_conflicts(self):
+        """
+        Conflict graph of the exams: two lessons are neighbours when at least one student is
+        enrolled in both. ENROLLMENT is read once, as one array of lessons per student with more
+        than one lesson, and every array adds its lessons to the neighbour sets of each other.
+        benchmarks/exam_timetable.py times it on a generated term.
+
+        :return: Dictionary of lesson ID -> set of neighbouring lesson IDs
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """SELECT array_agg(LESSON_ID) FROM ENROLLMENT
+                    GROUP BY STUDENT_ID HAVING count(*) > 1"""
+                cursor.execute(statement)
+                data = {}
+                for (lessons,) in cursor.fetchall():
+                    for lesson in lessons:
+                        data.setdefault(lesson, set()).update(lessons)
+                cursor.close()
+        except Exception as err:
+            print("Fetch Exam Conflicts Error: ", err)
+            return None
+
+        for lesson, neighbours in data.items():
+            neighbours.discard(lesson)
+        return data
+
+    @reads("classrooms", "rooms")
+    def get_exam_rooms(self):
+        """
+        :return: List of (classroom ID, capacity) pairs of available classrooms
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """SELECT CLASSES.CL_ID, CLASSES.CAP FROM CLASSES
+                    JOIN ROOMS ON ROOMS.ROOM_ID = CLASSES.CL_ID
+                    WHERE ROOMS.AVAILABLE AND CLASSES.CAP > 0"""
+                cursor.execute(statement)
+                data = cursor.fetchall()
+                cursor.close()
+                return data
+        except Exception as err:
+            print("Fetch Exam Rooms Error: ", err)
+
+        return None
+
+    @writes("exams")
+    def write_exams(self, exams):
+        """
+        Replaces the exam timetable.
+
+        :param exams: List of (lesson ID, slot, start, room ID, seats) tuples, a lesson split over
+            several rooms has one tuple per room
+        :return: Number of rows written, None on error
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute("DELETE FROM EXAMS")
+                if exams:
+                    statement = """INSERT INTO EXAMS (LESSON_ID, SLOT, STARTS_AT, ROOM, SEATS)
+                        SELECT * FROM unnest(%s::INTEGER[], %s::INTEGER[], %s::TIMESTAMP[], %s::INTEGER[], %s::INTEGER[])"""
+                    cursor.execute(statement, [list(column) for column in zip(*exams)])
+                cursor.close()
+                return len(exams)
+        except Exception as err:
+            print("Write Exams Error: ", err)
+
+        return None
+
+    @reads("exams", "lessons", "enrollment", "classrooms", "rooms", "buildings")
+    def get_exams(self, student_id=None, instructor_id=None):
+        """
+        :param student_id: Only exams of the student's lessons
+        :param instructor_id: Only exams of the lessons the instructor gives
+        :return: List of dictionaries ordered by start, one per lesson and room
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """SELECT LESSONS.CRN, LESSONS.CODE, EXAMS.STARTS_AT, ROOMS.ROOM_NAME, BUILDINGS.BU_NAME, EXAMS.SEATS
+                    FROM EXAMS
+                    JOIN LESSONS ON LESSONS.LESSON_ID = EXAMS.LESSON_ID
+                    LEFT JOIN ROOMS ON ROOMS.ROOM_ID = EXAMS.ROOM
+                    LEFT JOIN BUILDINGS ON BUILDINGS.BU_ID = ROOMS.BUILDING
+                    WHERE (%(student)s::INTEGER IS NULL OR EXAMS.LESSON_ID IN
+                        (SELECT LESSON_ID FROM ENROLLMENT WHERE STUDENT_ID = %(student)s))
+                    AND (%(instructor)s::INTEGER IS NULL OR LESSONS.INSTRUCTOR = %(instructor)s)
+                    ORDER BY EXAMS.STARTS_AT, LESSONS.CODE, LESSONS.CRN, ROOMS.ROOM_NAME"""
+                values = {"student": student_id, "instructor": instructor_id}
+                cursor.execute(statement, values)
+                data = decode(cursor, ("CRN", "Code", "Start", "Room", "Building", "Seats"))
+                cursor.close()
+                return data
+        except Exception as err:
+            print("Fetch Exams Error: ", err)
+
+        return None
+
+    ############# ROOM ALLOCATION ###############
+
+    @reads("lessons")
+    def get_room_allocation_lessons(self):
+        """
+        :return: Dictionary of lesson ID -> (cap, room type, board type, periods, location) for
+            lessons with meeting times, periods are (start, end) minutes since Monday 00:00
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """SELECT LESSONS.LESSON_ID, LESSONS.CAP, LESSONS.ROOM_TYPE, LESSONS.BOARD_TYPE, LESSONS.LOCATION,
+                    array_agg(lower(LESSON_SLOTS.PERIOD)), array_agg(upper(LESSON_SLOTS.PERIOD))
+                    FROM LESSONS JOIN LESSON_SLOTS ON LESSON_SLOTS.LESSON_ID = LESSONS.LESSON_ID
+                    GROUP BY LESSONS.LESSON_ID"""
+                cursor.execute(statement)
+                data = {row[0]: (row[1] or 0, row[2], row[3], list(zip(row[5], row[6])), row[4])
+                        for row in cursor.fetchall()}
+                cursor.close()
+                return data
+        except Exception as err:
+            print("Fetch Room Allocation Lessons Error: ", err)
+
+        return None
+
+    @reads("classrooms", "rooms")
+    def get_allocatable_classrooms(self):
+        """
+        :return: Dictionary of classroom ID -> (cap, type, board type) of available classrooms
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """SELECT CLASSES.CL_ID, CLASSES.CAP, CLASSES.TYPE, CLASSES.BOARD_TYPE FROM CLASSES
+                    JOIN ROOMS ON ROOMS.ROOM_ID = CLASSES.CL_ID
+                    WHERE ROOMS.AVAILABLE"""
+                cursor.execute(statement)
+                data = {row[0]: row[1:] for row in cursor.fetchall()}
+                cursor.close()
+                return data
+        except Exception as err:
+            print("Fetch Classrooms Error: ", err)
+
+        return None
+
+    @writes("lessons", "timetable")
+    def write_room_allocation(self, assignments):
+        """
+        Sets the location of many lessons with one statement. Lessons that are not listed keep
+        their location.
+
+        :param assignments: List of (lesson ID, classroom ID or None to clear it) pairs
+        :return: Number of lessons updated, None on error
+        """
+        if not assignments:
+            return 0
+
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """UPDATE LESSONS SET LOCATION = a.ROOM
+                    FROM unnest(%s::INTEGER[], %s::INTEGER[]) AS a (LESSON_ID, ROOM)
+                    WHERE LESSONS.LESSON_ID = a.LESSON_ID AND LESSONS.LOCATION IS DISTINCT FROM a.ROOM"""
+                lessons, rooms = zip(*assignments)
+                cursor.execute(statement, [list(lessons), list(rooms)])
+                updated = cursor.rowcount
+                cursor.close()
+                return updated
+        except Exception as err:
+            print("Write Room Allocation Error: ", err)
+
+        return None
+
+    @reads("classrooms", "rooms", "buildings", "lessons", "timetable")
+    def find_free_classrooms(self, weekday, start, end, seats=0, room_type=None, board_type=None):
+        """
+        Available classrooms that seat enough people and that no lesson uses at any time between
+        start and end. Lessons meeting then are found with the GiST index on LESSON_SLOTS.PERIOD.
+
+        :param weekday: 0 is Monday
+        :param start: Minutes after midnight
+        :param end: Minutes after midnight
+        :param board_type: A Mixed board is accepted for any board type
+        :return: List of dictionaries ordered by capacity
+        """
+        try:
+            with self._connect() as connection:
+                cursor = connection.cursor()
+                statement = """WITH busy AS (
+                        SELECT LESSONS.LOCATION FROM LESSON_SLOTS
+                        JOIN LESSONS ON LESSONS.LESSON_ID = LESSON_SLOTS.LESSON_ID
+                        WHERE LESSON_SLOTS.PERIOD && int4range(%(day)s * 1440 + %(start)s, %(day)s * 1440 + %(end)s)
+                        AND LESSONS.LOCATION IS NOT NULL
+                    )
+                    SELECT CLASSES.CL_ID, ROOMS.ROOM_NAME, BUILDINGS.BU_NAME, CLASSES.CAP, CLASSES.TYPE, CLASSES.BOARD_TYPE
+                    FROM CLASSES
+                    JOIN ROOMS ON ROOMS.ROOM_ID = CLASSES.CL_ID
+                    LEFT JOIN BUILDINGS ON BUILDINGS.BU_ID = ROOMS.BUILDING
+                    WHERE ROOMS.AVAILABLE AND CLASSES.CAP >= %(seats)s
+                    AND (%(type)s::VARCHAR IS NULL OR CLASSES.TYPE = %(type)s)
+                    AND (%(board)s::VARCHAR IS NULL OR CLASSES.BOARD_TYPE IN (%(board)s, 'Mixed'))
+                    AND CLASSES.CL_ID NOT IN (SELECT LOCATION FROM busy)
+                    ORDER BY CLASSES.CAP, ROOMS.ROOM_NAME"""
+                values = {"day": weekday, "start": start, "end": end, "seats": seats,
+                          "type": room_type, "board": board_type}
+                cursor.execute(statement, values)
+                data = decode(cursor, ("ID", "Name", "Building", "Capacity", "Type", "Board"))
+                cursor.close()
+                return data
+        except Exception as err:
+            print("Find Free Classrooms Error: ", err)
+
+        return None
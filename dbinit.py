@@ -3,6 +3,8 @@ import sys
 
 import psycopg2 as dbapi2
 
+from timeslots import INSERT_SLOTS, slot_arrays
+
 
 INIT_STATEMENTS = [
     """CREATE TABLE IF NOT EXISTS PEOPLE (
@@ -148,6 +150,10 @@ INIT_STATEMENTS = [
     FOREIGN KEY (ASSISTANT) REFERENCES ASSISTANTS(AS_ID),
     FOREIGN KEY (LOCATION) REFERENCES CLASSES(CL_ID)
     )""",
+
+    # Classroom requirements of a lesson for room_allocation.py, NULL means any.
+    "ALTER TABLE LESSONS ADD COLUMN IF NOT EXISTS ROOM_TYPE VARCHAR(15)",
+    "ALTER TABLE LESSONS ADD COLUMN IF NOT EXISTS BOARD_TYPE VARCHAR(5)",
     """CREATE TABLE IF NOT EXISTS STUDENTS (
     STU_ID INTEGER PRIMARY KEY ,
     NUMBER INTEGER,
@@ -170,9 +176,187 @@ INIT_STATEMENTS = [
     FOREIGN KEY (STUDENT_ID) REFERENCES STUDENTS ON DELETE CASCADE,
     FOREIGN KEY (LESSON_ID) REFERENCES LESSONS ON DELETE CASCADE
     )""",
+
+    """CREATE TABLE IF NOT EXISTS WAITLIST(
+    WAIT_ID SERIAL PRIMARY KEY,
+    STUDENT_ID INTEGER NOT NULL,
+    LESSON_ID INTEGER NOT NULL,
+    ADDED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (STUDENT_ID, LESSON_ID),
+    FOREIGN KEY (STUDENT_ID) REFERENCES STUDENTS ON DELETE CASCADE,
+    FOREIGN KEY (LESSON_ID) REFERENCES LESSONS ON DELETE CASCADE
+    )""",
+
+    """CREATE TABLE IF NOT EXISTS LESSON_SLOTS(
+    SLOT_ID SERIAL PRIMARY KEY,
+    LESSON_ID INTEGER NOT NULL,
+    WEEKDAY SMALLINT NOT NULL CHECK (WEEKDAY BETWEEN 0 AND 6),
+    START_TIME TIME NOT NULL,
+    END_TIME TIME NOT NULL,
+    PERIOD INT4RANGE NOT NULL,
+    FOREIGN KEY (LESSON_ID) REFERENCES LESSONS ON DELETE CASCADE
+    )""",
+
+    """CREATE TABLE IF NOT EXISTS EXAMS(
+    EXAM_ID SERIAL PRIMARY KEY,
+    LESSON_ID INTEGER NOT NULL,
+    SLOT INTEGER NOT NULL,
+    STARTS_AT TIMESTAMP NOT NULL,
+    ROOM INTEGER,
+    SEATS INTEGER NOT NULL,
+    FOREIGN KEY (LESSON_ID) REFERENCES LESSONS ON DELETE CASCADE,
+    FOREIGN KEY (ROOM) REFERENCES CLASSES(CL_ID) ON DELETE SET NULL
+    )""",
+
+    """CREATE TABLE IF NOT EXISTS PREFERENCES(
+    STUDENT_ID INTEGER NOT NULL,
+    LESSON_ID INTEGER NOT NULL,
+    RANK SMALLINT NOT NULL CHECK (RANK > 0),
+    PRIMARY KEY (STUDENT_ID, LESSON_ID),
+    FOREIGN KEY (STUDENT_ID) REFERENCES STUDENTS ON DELETE CASCADE,
+    FOREIGN KEY (LESSON_ID) REFERENCES LESSONS ON DELETE CASCADE
+    )""",
+
+    # Versions of cache tags shared by all workers, see Database.get_schedule().
+    """CREATE TABLE IF NOT EXISTS CACHE_VERSIONS(
+    TAG VARCHAR(40) PRIMARY KEY,
+    VERSION BIGINT NOT NULL
+    )""",
+]
+
+
+# (name, table, columns, unique). Created with CREATE INDEX CONCURRENTLY so that running
+# dbinit.py against a live database does not block writes.
+INDEXES = [
+    ("enrollment_student_lesson_key", "ENROLLMENT", "STUDENT_ID, LESSON_ID", True),
+    ("enrollment_lesson_idx", "ENROLLMENT", "LESSON_ID", False),
+    ("lessons_instructor_idx", "LESSONS", "INSTRUCTOR", False),
+    ("lessons_location_idx", "LESSONS", "LOCATION", False),
+    ("papers_author_idx", "PAPERS", "AUTHOR", False),
+    ("papers_title_idx", "PAPERS", "TITLE", False),
+    ("people_name_idx", "PEOPLE", "NAME", False),
+    # Name prefix search of the person dropdowns, lower(NAME) LIKE 'q%'.
+    ("people_name_prefix_idx", "PEOPLE", "lower(NAME) text_pattern_ops", False),
+    # Keyset pagination of the student list, see STUDENT_SORTS of database.py.
+    ("students_number_order_idx", "STUDENTS", "COALESCE(NUMBER, -1), STU_ID", False),
+    ("people_name_order_idx", "PEOPLE", "COALESCE(NAME, ''), P_ID", False),
+    ("waitlist_lesson_idx", "WAITLIST", "LESSON_ID, WAIT_ID", False),
+    ("preferences_lesson_idx", "PREFERENCES", "LESSON_ID", False),
+    ("lesson_slots_lesson_idx", "LESSON_SLOTS", "LESSON_ID", False),
+    ("exams_lesson_idx", "EXAMS", "LESSON_ID", False),
+    # PERIOD is minutes since Monday 00:00, overlapping meetings are found with &&.
+    ("lesson_slots_period_idx", "LESSON_SLOTS USING GIST", "PERIOD", False),
+]
+
+# Statements on hot paths of database.py, with sample parameters for EXPLAIN.
+HOT_QUERIES = [
+    ("get_enrolled", "SELECT * FROM ENROLLMENT WHERE student_id = %s", [1]),
+    ("get_enrolled_w_join", """SELECT LESSONS.crn FROM ENROLLMENT
+        JOIN LESSONS ON (ENROLLMENT.lesson_id = LESSONS.lesson_id)
+        WHERE ENROLLMENT.student_id = %s""", [1]),
+    ("lessons by instructor", "SELECT * FROM LESSONS WHERE instructor = %s", [1]),
+    ("lessons by location", "SELECT * FROM LESSONS WHERE location = %s", [1]),
+    ("get_paper_by_author", "SELECT paper_id FROM PAPERS WHERE author = %s", [1]),
+    ("co-authors by title", "SELECT author FROM PAPERS WHERE title = %s", ["title"]),
+    ("search_lesson_by_instructor", "SELECT p_id FROM PEOPLE WHERE name = %s", ["name"]),
+    ("people picker search", """SELECT p_id, name, type FROM PEOPLE WHERE lower(name) LIKE %s
+        ORDER BY name, p_id LIMIT %s""", ["ali%", 50]),
+    ("student page by number", """SELECT s.stu_id, p.name, s.number FROM STUDENTS s JOIN PEOPLE p ON p.p_id = s.stu_id
+        WHERE (COALESCE(s.number, -1), s.stu_id) > (%s, %s) ORDER BY COALESCE(s.number, -1), s.stu_id LIMIT %s""",
+     [100, 1, 51]),
+    ("student page by name", """SELECT s.stu_id, p.name, s.number FROM STUDENTS s JOIN PEOPLE p ON p.p_id = s.stu_id
+        WHERE (COALESCE(p.name, ''), p.p_id) > (%s, %s) ORDER BY COALESCE(p.name, ''), p.p_id LIMIT %s""",
+     ["M", 1, 51]),
+    ("overlapping slots", "SELECT lesson_id FROM LESSON_SLOTS WHERE period && int4range(%s, %s)", [510, 630]),
 ]
 
 
+def _deduplicate_enrollment(cursor):
+    """
+    The unique enrollment index can not be built while duplicates exist. Keeps the oldest row of
+    every (student, lesson) pair and recounts ENROLLED for the lessons that had duplicates.
+    """
+    cursor.execute("""DELETE FROM ENROLLMENT e USING ENROLLMENT d
+        WHERE e.student_id = d.student_id AND e.lesson_id = d.lesson_id AND e.enroll_id > d.enroll_id
+        RETURNING e.lesson_id""")
+    lesson_ids = list({row[0] for row in cursor.fetchall()})
+    if lesson_ids:
+        cursor.execute("""UPDATE LESSONS SET ENROLLED =
+            (SELECT count(*) FROM ENROLLMENT WHERE ENROLLMENT.lesson_id = LESSONS.lesson_id)
+            WHERE LESSON_ID = ANY(%s)""", [lesson_ids])
+        print("Removed duplicate enrollments for lessons:", sorted(lesson_ids))
+
+
+def create_indexes(url):
+    """
+    Creates the indexes in INDEXES that do not exist yet. Indexes left invalid by an interrupted
+    concurrent build are dropped and built again.
+    """
+    try:
+        connection = dbapi2.connect(url)
+    except Exception as err:
+        print("Error: ", err)
+        return
+
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction block.
+    connection.autocommit = True
+    try:
+        cursor = connection.cursor()
+        for name, table, columns, unique in INDEXES:
+            cursor.execute("""SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = %s""", [name])
+            row = cursor.fetchone()
+            if row and row[0]:
+                continue
+            if row:
+                print("Rebuilding invalid index", name)
+                cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS " + name)
+            if unique and table == "ENROLLMENT":
+                connection.autocommit = False
+                with connection:
+                    _deduplicate_enrollment(connection.cursor())
+                connection.autocommit = True
+
+            statement = "CREATE {}INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})".format(
+                "UNIQUE " if unique else "", name, table, columns)
+            try:
+                cursor.execute(statement)
+            except Exception as err:
+                print("Create Index Error ({}): ".format(name), err)
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def _plan_indexes(plan):
+    found = []
+    if "Index Name" in plan:
+        found.append(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        found.extend(_plan_indexes(child))
+    return found
+
+
+def index_report(url):
+    """
+    Prints which index the planner picks for each of the HOT_QUERIES.
+    Small tables are scanned sequentially no matter which indexes exist.
+    """
+    declared = {index[0] for index in INDEXES}
+    with dbapi2.connect(url) as connection:
+        cursor = connection.cursor()
+        for name, statement, params in HOT_QUERIES:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + statement, params)
+            plan = cursor.fetchone()[0][0]["Plan"]
+            used = _plan_indexes(plan)
+            if not used:
+                status = "no index ({})".format(plan["Node Type"])
+            else:
+                status = ", ".join(index + ("" if index in declared else " (not declared)") for index in used)
+            print("{:<30} {}".format(name, status))
+        cursor.close()
+
+
 def initialize(url):
     try:
         with dbapi2.connect(url) as connection:
@@ -184,9 +368,38 @@ def initialize(url):
         print("Error: ", err)
 
 
+def migrate_lesson_slots(url):
+    """
+    Fills LESSON_SLOTS for lessons that have none from their DATE text. Lessons whose DATE can
+    not be read are listed and are left without slots, they never conflict with anything.
+    """
+    try:
+        with dbapi2.connect(url) as connection:
+            cursor = connection.cursor()
+            cursor.execute("""SELECT LESSON_ID, DATE FROM LESSONS l
+                WHERE NOT EXISTS (SELECT 1 FROM LESSON_SLOTS s WHERE s.LESSON_ID = l.LESSON_ID)
+                ORDER BY LESSON_ID""")
+            lessons = cursor.fetchall()
+            slots = slot_arrays(lessons)
+            if slots[0]:
+                cursor.execute(INSERT_SLOTS, slots)
+            read = set(slots[0])
+            unreadable = [(lesson_id, date) for lesson_id, date in lessons if lesson_id not in read]
+            cursor.close()
+        for lesson_id, date in unreadable:
+            print("Could not read the meeting times of lesson {}: {!r}".format(lesson_id, date))
+    except Exception as err:
+        print("Error: ", err)
+
+
 if __name__ == "__main__":
     url = os.getenv("DATABASE_URL")
     if url is None:
-        print("Usage: DATABASE_URL=url python dbinit.py", file=sys.stderr)
+        print("Usage: DATABASE_URL=url python dbinit.py [--index-report]", file=sys.stderr)
         sys.exit(1)
+    if "--index-report" in sys.argv[1:]:
+        index_report(url)
+        sys.exit(0)
     initialize(url)
+    migrate_lesson_slots(url)
+    create_indexes(url)
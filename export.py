@@ -0,0 +1,75 @@
+"""
+Streaming export of large tables.
+
+Rows come from the iter_* generators of Database, which read through a server-side cursor, and are
+written out a chunk at a time, so memory use does not grow with the table.
+"""
+import csv
+import io
+import json
+
+from database import EXPORT_KEYS
+
+TABLES = {
+    "students": "iter_students",
+    "people": "iter_people",
+    "instructors": "iter_instructors",
+}
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+# Rows written per chunk of the response.
+CHUNK_ROWS = 500
+
+
+def csv_chunks(rows, keys):
+    """
+    :param rows: Iterable of dictionaries
+    :param keys: Columns in order, written as the header line
+    :return: Generator of CSV text chunks
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(keys)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([row[key] for key in keys])
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(rows, keys):
+    """
+    :return: Generator of chunks with one JSON object per line
+    """
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, default=str))
+        if len(lines) == CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def chunks(db, table, fmt):
+    """
+    :param db: Database to read from, its connection is held until the generator ends
+    :param table: Key of TABLES
+    :param fmt: Key of FORMATS
+    :return: Generator of text chunks of the export
+    """
+    rows = getattr(db, TABLES[table])()
+    write = csv_chunks if fmt == "csv" else ndjson_chunks
+    try:
+        yield from write(rows, EXPORT_KEYS[table])
+    except Exception as err:
+        # The response has started already, the client gets a truncated file.
+        print("Export Error: ", err)
+    finally:
+        rows.close()
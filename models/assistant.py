@@ -1,5 +1,6 @@
 class Assistant:
-    def __init__(self, person, lab, degree, department, faculty):
+    def __init__(self, person, lab, degree, department, faculty, id=None):
+        self.id = id
         self.person = person
         self.lab = lab
         self.degree = degree
@@ -1,5 +1,6 @@
 class Building:
-    def __init__(self, name, code, campus):
+    def __init__(self, name, code, campus, id=None):
+        self.id = id
         self.name = name
         self.code = code
         self.campus = campus
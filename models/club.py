@@ -1,5 +1,6 @@
 class Club:
-    def __init__(self, name, faculty, advisor, chairman, vice_1, vice_2):
+    def __init__(self, name, faculty, advisor, chairman, vice_1, vice_2, id=None):
+        self.id = id
         self.name = name
         self.faculty = faculty
         self.advisor = advisor
@@ -1,5 +1,6 @@
 class Department:
-    def __init__(self, name, faculty, building, dean):
+    def __init__(self, name, faculty, building, dean, id=None):
+        self.id = id
         self.name = name
         self.faculty = faculty
         self.building = building
@@ -1,6 +1,7 @@
 class Faculty:
 
-    def __init__(self, name, building, dean, assistant_dean_1, assistant_dean_2):
+    def __init__(self, name, building, dean, assistant_dean_1, assistant_dean_2, id=None):
+        self.id = id
         self.name = name
         self.building = building
         self.dean = dean
@@ -1,5 +1,6 @@
 class Lab:
-    def __init__(self, name, department, faculty, room, investigator, building):
+    def __init__(self, name, department, faculty, room, investigator, building, id=None):
+        self.id = id
         self.name = name
         self.department = department
         self.faculty = faculty
@@ -1,5 +1,5 @@
 class Lesson:
-	def __init__(self, crn, date, code, instructor, location, assistant, credit, cap=0, enrolled=0, id=None):
+	def __init__(self, crn, date, code, instructor, location, assistant, credit, cap=0, enrolled=0, id=None, room_type=None, board_type=None):
 		self.id = id
 		self.crn = crn
 		self.date = date
@@ -10,3 +10,5 @@ class Lesson:
 		self.credit = credit
 		self.cap = cap
 		self.enrolled = enrolled
+		self.room_type = room_type
+		self.board_type = board_type
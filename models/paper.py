@@ -1,5 +1,6 @@
 class Paper:
-    def __init__(self, title, platform, citation, author, isConference):
+    def __init__(self, title, platform, citation, author, isConference, id=None):
+        self.id = id
         self.title = title
         self.platform = platform
         self.citation = citation
@@ -2,7 +2,8 @@ from .people import People
 
 
 class Student(People):
-    def __init__(self, name, number, mail, cred, depart, facu, club=None, lab=None, password=None, photo=None):
+    def __init__(self, name, number, mail, cred, depart, facu, club=None, lab=None, password=None, photo=None, id=None):
+        self.id = id
         self.name = name
         self.number = number
         self.mail = mail
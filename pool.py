@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+
+import psycopg2 as dbapi2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of psycopg2 connections.
+
+    Connections are checked for health when they are handed out: closed connections are always
+    replaced and connections that sat idle for longer than ``ping_after`` seconds get a ``SELECT 1``.
+    """
+
+    def __init__(self, url, minconn=1, maxconn=10, timeout=30.0, ping_after=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: min=%s max=%s" % (minconn, maxconn))
+
+        self.url = url
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._stats = {
+            "checkouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "wait_time": 0.0,
+            "max_wait_time": 0.0,
+        }
+
+        for _ in range(minconn):
+            self._idle.append((self._new_connection(), time.monotonic()))
+            self._size += 1
+
+    def _new_connection(self):
+        connection = dbapi2.connect(self.url)
+        self._stats["created"] += 1
+        return connection
+
+    def _is_healthy(self, connection, idle_since):
+        if connection.closed:
+            return False
+        if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - idle_since < self.ping_after:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            connection.rollback()
+            return True
+        except dbapi2.Error:
+            return False
+
+    def _discard(self, connection):
+        self._stats["discarded"] += 1
+        try:
+            connection.close()
+        except dbapi2.Error:
+            pass
+
+    def getconn(self):
+        """
+        Takes a connection out of the pool, waiting up to ``timeout`` seconds when all
+        ``maxconn`` connections are in use.
+
+        :return: An open psycopg2 connection
+        """
+        started = time.monotonic()
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle or self._size < self.maxconn:
+                    break
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout("No connection available after %.1f seconds" % self.timeout)
+                waited = True
+                self._cond.wait(remaining)
+
+            if waited:
+                wait_time = time.monotonic() - started
+                self._stats["waits"] += 1
+                self._stats["wait_time"] += wait_time
+                self._stats["max_wait_time"] = max(self._stats["max_wait_time"], wait_time)
+            self._stats["checkouts"] += 1
+
+            if self._idle:
+                connection, idle_since = self._idle.pop()
+            else:
+                connection, idle_since = None, None
+            # Reserve the slot before leaving the lock, connecting happens outside of it.
+            if connection is None:
+                self._size += 1
+
+        if connection is not None:
+            if self._is_healthy(connection, idle_since):
+                return connection
+            self._discard(connection)
+
+        try:
+            return self._new_connection()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, connection, close=False):
+        """
+        Gives a connection back to the pool. Any open transaction is rolled back.
+
+        :param connection: A connection obtained from ``getconn``
+        :param close: Close the connection instead of keeping it around
+        """
+        if not close and not connection.closed:
+            try:
+                if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except dbapi2.Error:
+                close = True
+
+        with self._cond:
+            if close or connection.closed or self._closed:
+                self._size -= 1
+                self._discard(connection)
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for connection, _ in self._idle:
+                self._size -= 1
+                self._discard(connection)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        :return: Counters as dictionary, wait times are in seconds.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+            stats["minconn"] = self.minconn
+            stats["maxconn"] = self.maxconn
+        stats["avg_wait_time"] = stats["wait_time"] / stats["waits"] if stats["waits"] else 0.0
+        return stats
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(url):
+    """
+    Returns the pool of the current process, creating it on first use.
+
+    gunicorn forks its workers after importing the app, so the pool is keyed by pid and every
+    worker builds its own instead of sharing sockets with the master.
+    Sizes can be tuned with DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT and DB_POOL_PING_AFTER.
+    """
+    global _pool, _pool_pid
+
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = ConnectionPool(
+                url,
+                minconn=int(os.getenv("DB_POOL_MIN", 1)),
+                maxconn=int(os.getenv("DB_POOL_MAX", 10)),
+                timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)),
+                ping_after=float(os.getenv("DB_POOL_PING_AFTER", 30)),
+            )
+            _pool_pid = pid
+    return _pool
@@ -0,0 +1,246 @@
+"""
+Classroom allocation for lessons.
+
+Every lesson with meeting times in LESSON_SLOTS gets a classroom that seats its CAP, has the
+classroom TYPE and board the lesson asks for (LESSONS.ROOM_TYPE and LESSONS.BOARD_TYPE, NULL means
+any) and is not used by another lesson at the same time.
+
+Lessons are placed greedily, hardest first: the ones with the fewest suitable rooms, then the
+biggest. Each takes the smallest suitable room that is free at all of its meetings. When there is
+none, one level of repair is tried: if a suitable room is blocked by a single lesson that can move
+to another free room, that lesson is moved. Bookings of a room are kept sorted, so checking a
+meeting costs a binary search.
+
+    $ DATABASE_URL=postgres://... python room_allocation.py
+"""
+import argparse
+import bisect
+import os
+import sys
+import time
+from collections import defaultdict
+
+from database import Database
+
+# Lesson board requirement -> boards of rooms that satisfy it.
+BOARDS = {
+    "Black": ("Black", "Mixed"),
+    "White": ("White", "Mixed"),
+    "Mixed": ("Mixed",),
+}
+
+# Rooms a lesson that does not fit anywhere tries to free by moving their single blocking lesson.
+# Keeps an overbooked term from spending its time on repairs that can not succeed.
+REPAIR_ATTEMPTS = 20
+
+
+class _Bookings:
+    """
+    Non-overlapping meetings of one room, sorted by start.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.meetings = []
+
+    def blockers(self, periods):
+        """
+        :return: Set of lessons having a meeting that overlaps one of the periods
+        """
+        found = set()
+        for start, end in periods:
+            index = bisect.bisect_left(self.starts, end)
+            while index > 0 and self.meetings[index - 1][1] > start:
+                index -= 1
+                found.add(self.meetings[index][2])
+        return found
+
+    def free(self, periods):
+        for start, end in periods:
+            index = bisect.bisect_left(self.starts, end)
+            if index > 0 and self.meetings[index - 1][1] > start:
+                return False
+        return True
+
+    def add(self, lesson, periods):
+        for start, end in periods:
+            index = bisect.bisect_left(self.starts, start)
+            self.starts.insert(index, start)
+            self.meetings.insert(index, (start, end, lesson))
+
+    def remove(self, lesson):
+        kept = [meeting for meeting in self.meetings if meeting[2] != lesson]
+        self.meetings = kept
+        self.starts = [meeting[0] for meeting in kept]
+
+
+def suitable(lesson, room):
+    """
+    :param lesson: (cap, room type, board type) of a lesson
+    :param room: (cap, type, board type) of a classroom
+    """
+    cap, room_type, board_type = lesson
+    if room[0] < cap:
+        return False
+    if room_type is not None and room[1] != room_type:
+        return False
+    return board_type is None or room[2] in BOARDS.get(board_type, (board_type,))
+
+
+def allocate_rooms(lessons, rooms, fixed=None):
+    """
+    :param lessons: Dictionary of lesson ID -> (cap, room type, board type, periods), periods are
+        (start, end) minutes since Monday 00:00
+    :param rooms: Dictionary of classroom ID -> (cap, type, board type)
+    :param fixed: Dictionary of lesson ID -> (classroom ID, periods) of bookings that stay as they
+        are, the lessons must not be in lessons
+    :return: (assigned, unplaced) where assigned maps lesson ID -> classroom ID and unplaced is
+        the list of lessons no room could take
+    """
+    # Rooms sorted by capacity, grouped by (type, board) so a lesson only looks at rooms of the
+    # kinds it accepts and starts at the first one big enough.
+    kinds = defaultdict(list)
+    for room, (cap, room_type, board_type) in rooms.items():
+        kinds[room_type, board_type].append((cap, room))
+    for members in kinds.values():
+        members.sort()
+
+    def candidates(lesson):
+        cap, room_type, board_type = lessons[lesson][:3]
+        found = []
+        for (kind_type, kind_board), members in kinds.items():
+            if suitable((0, room_type, board_type), (0, kind_type, kind_board)):
+                found.extend(members[bisect.bisect_left(members, (cap, -1)):])
+        found.sort()
+        return [room for _, room in found]
+
+    options = {lesson: candidates(lesson) for lesson in lessons}
+    bookings = defaultdict(_Bookings)
+    for lesson, (room, periods) in (fixed or {}).items():
+        bookings[room].add(lesson, periods)
+    assigned = {}
+    unplaced = []
+
+    def place(lesson, skip=None):
+        periods = lessons[lesson][3]
+        for room in options[lesson]:
+            if room != skip and bookings[room].free(periods):
+                bookings[room].add(lesson, periods)
+                assigned[lesson] = room
+                return True
+        return False
+
+    order = sorted(lessons, key=lambda lesson: (len(options[lesson]), -lessons[lesson][0], lesson))
+    for lesson in order:
+        if place(lesson):
+            continue
+
+        periods = lessons[lesson][3]
+        attempts = REPAIR_ATTEMPTS
+        for room in options[lesson]:
+            blockers = bookings[room].blockers(periods)
+            if len(blockers) != 1 or not blockers <= assigned.keys():
+                continue
+            attempts -= 1
+            if attempts < 0:
+                unplaced.append(lesson)
+                break
+            blocker = blockers.pop()
+            bookings[room].remove(blocker)
+            if place(blocker, skip=room):
+                bookings[room].add(lesson, periods)
+                assigned[lesson] = room
+                break
+            bookings[room].add(blocker, lessons[blocker][3])
+        else:
+            unplaced.append(lesson)
+
+    return assigned, unplaced
+
+
+def release_clashes(lessons, assigned, unplaced, fixed=None):
+    """
+    Unplaced lessons keep the room they had as long as it is still free at their meetings,
+    otherwise they have to give it up so no room is double booked.
+
+    :param lessons: Dictionary of lesson ID -> (cap, room type, board type, periods, location)
+    :param assigned: Lesson ID -> classroom ID, as returned by allocate_rooms()
+    :param unplaced: Lessons allocate_rooms() could not place
+    :param fixed: The fixed bookings given to allocate_rooms()
+    :return: Sorted list of unplaced lessons whose location has to be cleared
+    """
+    bookings = defaultdict(_Bookings)
+    for lesson, room in assigned.items():
+        bookings[room].add(lesson, lessons[lesson][3])
+    for lesson, (room, periods) in (fixed or {}).items():
+        bookings[room].add(lesson, periods)
+
+    cleared = []
+    for lesson in sorted(unplaced):
+        room, periods = lessons[lesson][4], lessons[lesson][3]
+        if room is None:
+            continue
+        if bookings[room].free(periods):
+            bookings[room].add(lesson, periods)
+        else:
+            cleared.append(lesson)
+    return cleared
+
+
+def run(only_unassigned=False, dry_run=False):
+    """
+    Assigns classrooms to lessons with meeting times and writes LESSONS.LOCATION in one statement.
+    Lessons that could not be placed keep the location they had while it does not clash with a
+    placed lesson, otherwise it is cleared. Both are listed in the summary to be sorted out by hand.
+
+    :param only_unassigned: Keep the rooms of lessons that have one and only place the others
+    :return: Summary dictionary, None if the input could not be read
+    """
+    started = time.monotonic()
+    db = Database(scoped=True)
+    lessons = db.get_room_allocation_lessons()
+    rooms = db.get_allocatable_classrooms()
+    if lessons is None or rooms is None:
+        db.close(commit=False)
+        return None
+
+    fixed = {}
+    if only_unassigned:
+        fixed = {lesson: (row[4], row[3]) for lesson, row in lessons.items() if row[4] is not None}
+    todo = {lesson: row[:4] for lesson, row in lessons.items() if lesson not in fixed}
+    assigned, unplaced = allocate_rooms(todo, rooms, fixed)
+    solved = time.monotonic()
+
+    cleared = release_clashes(lessons, assigned, unplaced, fixed)
+    assignments = sorted(assigned.items()) + [(lesson, None) for lesson in cleared]
+    written = 0 if dry_run else db.write_room_allocation(assignments)
+    committed = db.close(commit=not dry_run and written is not None)
+
+    return {
+        "lessons": len(lessons),
+        "rooms": len(rooms),
+        "kept": len(fixed),
+        "assigned": len(assigned),
+        "unplaced": unplaced,
+        "cleared": cleared,
+        "committed": committed,
+        "seconds": round(solved - started, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Assigns classrooms to lessons.")
+    parser.add_argument("--only-unassigned", action="store_true",
+                        help="keep the rooms of lessons that have one")
+    parser.add_argument("--dry-run", action="store_true", help="allocate without writing LESSONS")
+    args = parser.parse_args()
+
+    if os.getenv("DATABASE_URL") is None:
+        print("Usage: DATABASE_URL=url python room_allocation.py [--only-unassigned] [--dry-run]", file=sys.stderr)
+        sys.exit(1)
+
+    summary = run(args.only_unassigned, args.dry_run)
+    if summary is None:
+        sys.exit(1)
+    for key, value in summary.items():
+        print("%-10s %s" % (key + ":", value))
@@ -0,0 +1,20 @@
+def decode(cursor, keys):
+    """
+    Maps every remaining row of the cursor to a dictionary in one pass.
+    The select list of the statement has to be in the same order as the keys.
+
+    :param cursor: A cursor that has executed a SELECT with plain columns
+    :param keys: Dictionary keys, one for each selected column
+    :return: List of dictionaries
+    """
+    return [dict(zip(keys, row)) for row in cursor.fetchall()]
+
+
+def decode_one(cursor, keys):
+    """
+    :return: The next row of the cursor as a dictionary, None if there are no rows left.
+    """
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip(keys, row))
@@ -1,9 +1,16 @@
-from flask import Flask, render_template, request, redirect, url_for, current_app, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, current_app, session, jsonify, g, make_response, Response, stream_with_context
 from datetime import datetime
 from werkzeug.utils import secure_filename
 
 
-from database import Database, Instructor
+import allocation
+import export
+import room_allocation
+import student_import
+import timeslots
+import timetabling
+from database import Database, Instructor, PICKER_LIMIT, STUDENT_SORTS
+from dashboard import ADMIN_DATASETS, load_datasets, server_timing
 from models.student import Student
 from models.room import Room
 from models.classroom import Classroom
@@ -30,6 +37,24 @@ app.config['BASE_DIR'] = os.path.dirname(__file__)
 app.config['UPLOAD_FOLDER'] = app.config['BASE_DIR'] + UPLOAD_FOLDER
 
 
+def get_db():
+    """
+    Returns the Database of the current request. It takes a single pooled connection the first
+    time it is used and all calls made during the request share that connection and transaction.
+    Reads are memoized until a write to the same table happens in the request.
+    """
+    if "db" not in g:
+        g.db = Database(scoped=True, memoize=True)
+    return g.db
+
+
+@app.teardown_appcontext
+def close_db(exc):
+    db = g.pop("db", None)
+    if db is not None:
+        db.close(commit=exc is None)
+
+
 @app.route("/")
 def home_page():
     """
@@ -89,18 +114,44 @@ def user_settings():
     return render_template("settings.html")
 
 
-@app.route("/exams")
+@app.route("/exams", methods = ["GET", "POST"])
 def exams():
     """
-    In this page we will show the exam dates for students.
-    Same for assistants.
-
-    Professors will see exam dates of their courses and they will be able to update the exam date if it is not
-    colliding with another exam date.
+    Students see the exams of their lessons, instructors the exams of the lessons they give and
+    admins every exam. Admins can build the timetable again with a POST.
 
     :return:
     """
-    return render_template("exams.html")
+    if not session.get("logged_in"):
+        return redirect(url_for("login_page"))
+
+    person = session.get("person")
+    summary = None
+    if request.method == "POST":
+        if not person["admin"]:
+            return redirect(url_for("home_page"))
+        try:
+            start = datetime.strptime(request.form["start"], "%Y-%m-%d").date()
+            days = int(request.form.get("days") or 10)
+        except (KeyError, ValueError):
+            return redirect(url_for("exams"))
+        summary = timetabling.run(start, days)
+
+    db = get_db()
+    if person["admin"]:
+        exam_list = db.get_exams()
+    elif person["type"] == "student":
+        exam_list = db.get_exams(student_id = person["id"])
+    else:
+        exam_list = db.get_exams(instructor_id = person["id"])
+
+    return render_template("exams.html",
+        authenticated = session.get("logged_in"),
+        username = person["name"],
+        person = person,
+        exams = exam_list,
+        summary = summary
+        )
 
 
 @app.route("/su", methods = ["GET", "POST"])
@@ -109,36 +160,84 @@ def admin_page():
     God mode.
     :return:
     """
-    db = Database()
-
     if request.method == "GET":
         #print(session.get("person").get("admin"), "asdadsd")
         if session.get("person")["admin"]:
-            return render_template("admin_page.html", 
-                                    faculty_list=db.get_faculties(),
-                                    prof_list=db.get_instructors(),
-                                    student_list=db.get_students(),
-                                    datetime=datetime.now(),
-                                    clubs=db.get_clubs_info_astext(),
-                                    faculties=db.get_all_faculties(),
-                                    departments=db.get_departments_text(),
-                                    buildings = db.get_buildings(),
-                                    rooms=db.get_rooms(),
-                                    instructors=db.get_instructors(),
-                                    classrooms=db.get_classrooms(),
-                                    assistants=db.get_assistant_info(),
-                                    labs = db.get_lab_info(),
-                                    labs2 = db.get_all_labs(),
-                                    people=db.get_people()
-                )
+            data, timings = load_datasets(ADMIN_DATASETS)
+            response = make_response(render_template("admin_page.html",
+                                                     datetime=datetime.now(),
+                                                     **data))
+            response.headers["Server-Timing"] = server_timing(timings)
+            return response
         else:
             return redirect(url_for("home_page"))
     return render_template("admin_page.html")
 
 
+@app.route("/su/pool_stats", methods=["GET"])
+def pool_stats():
+    if not session.get("logged_in") or not session.get("person")["admin"]:
+        return redirect(url_for("home_page"))
+
+    db = get_db()
+    return jsonify(db.pool_stats())
+
+
+@app.route("/su/cache_stats", methods=["GET"])
+def cache_stats():
+    if not session.get("logged_in") or not session.get("person")["admin"]:
+        return redirect(url_for("home_page"))
+
+    db = get_db()
+    return jsonify(db.cache_stats())
+
+
+@app.route("/su/allocate", methods=["POST"])
+def allocate_seats():
+    """
+    Runs the seat allocator over all submitted preferences and enrolls the students.
+    :return: Summary of the run as JSON
+    """
+    if not session.get("logged_in") or not session.get("person")["admin"]:
+        return redirect(url_for("home_page"))
+
+    seed = request.form.get("seed")
+    try:
+        seed = int(seed) if seed else None
+    except ValueError:
+        return jsonify({"Success": False}), 400
+
+    summary = allocation.run(seed=seed, dry_run=request.form.get("dry_run") == "1")
+    if summary is None:
+        return jsonify({"Success": False})
+
+    summary["Success"] = True
+    return jsonify(summary)
+
+
+@app.route("/people_search", methods=["GET"])
+def people_search():
+    """
+    Typeahead of the person dropdowns, ?q=name prefix&type=person type&limit=n
+    :return: JSON list of {"ID", "Name", "Type"}
+    """
+    if not session.get("logged_in") or not session.get("person")["admin"]:
+        return jsonify([]), 403
+
+    try:
+        limit = int(request.args.get("limit", PICKER_LIMIT))
+    except ValueError:
+        limit = PICKER_LIMIT
+    people = get_db().get_people_picker(request.args.get("type") or None,
+                                        request.args.get("q", "").strip() or None, limit)
+    if people is None:
+        return jsonify([]), 500
+    return jsonify([{"ID": p_id, "Name": name, "Type": type} for p_id, name, type in people])
+
+
 @app.route("/assistants", methods=["POST", "GET"])
 def as_page():
-    db = Database()
+    db = get_db()
     assistants = db.get_assistant_info()
     return render_template("assistants.html", assistants=assistants)
 
@@ -148,16 +247,15 @@ def assistant_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("as_page"))
 
-    db = Database()
+    db = get_db()
     data = request.form
     if data["button"] == "delete":
         as_keys = request.form.getlist("as_id")
-        for as_key in as_keys:
-            db.delete_assistant(int(as_key))
+        db.delete_assistants([int(key) for key in as_keys])
     elif data["button"] == "update":
         try:
             assistant = db.get_assistant(request.form.getlist("as_id")[0])
-            people = db.get_people()
+            people = db.get_people_picker(include=(assistant["Person"],))
             labs = db.get_all_labs()
             deps = db.get_all_departments()
             facs = db.get_faculties()
@@ -179,7 +277,7 @@ def assistant_edit():
 def as_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("as_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     attrs = ["person", "lab", "degree", "department", "faculty"]
     values = [data["p_id"], data["lab_id"], data["deg"], data["dep_id"], data["fac_id"]]
@@ -192,7 +290,7 @@ def as_edit():
 def as_cr():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("as_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     assistant = Assistant(data["p_id"], data["lab_id"], data["deg"], data["dep_id"], data["fac_id"])
     db.add_assistant(assistant)
@@ -201,7 +299,7 @@ def as_cr():
 
 @app.route("/buildings", methods=["POST", "GET"])
 def bu_page():
-    db = Database()
+    db = get_db()
     buildings = db.get_buildings()
     return render_template("buildings.html", buildings=buildings)
 
@@ -211,12 +309,11 @@ def building_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("bu_page"))
 
-    db = Database()
+    db = get_db()
     data = request.form
     if data["button"] == "delete":
         bu_keys = request.form.getlist("bu_id")
-        for bu_key in bu_keys:
-            db.delete_building(int(bu_key))
+        db.delete_buildings([int(key) for key in bu_keys])
     elif data["button"] == "update":
         try:
             building = db.get_building(request.form.getlist("bu_id")[0])
@@ -235,7 +332,7 @@ def building_edit():
 def bu_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("bu_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     attrs = ["name", "code", "campus"]
     values = [data["name"], data["code"], data["campus"]]
@@ -247,7 +344,7 @@ def bu_edit():
 def bu_cr():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("bu_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     building = Building(data["name"], data["code"], data["campus"])
     db.add_building(building)
@@ -258,7 +355,7 @@ def bu_cr():
 def club_create():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("cl_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     club = Club(data["name"], data["fac_id"], data["adv_id"], data["ch_id"], data["v1_id"], data["v2_id"])
     db.add_club(club)
@@ -267,7 +364,7 @@ def club_create():
 
 @app.route("/clubs", methods=["POST", "GET"])
 def cl_page():
-    db = Database()
+    db = get_db()
     clubs = db.get_clubs_info_astext()
     return render_template("clubs.html", clubs=clubs)
 
@@ -277,17 +374,16 @@ def club_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("cl_page"))
 
-    db = Database()
+    db = get_db()
     data = request.form
     if data["button"] == "delete":
         cl_keys = request.form.getlist("cl_id")
-        for cl_key in cl_keys:
-            db.delete_club(int(cl_key))
+        db.delete_clubs([int(key) for key in cl_keys])
     elif data["button"] == "update":
         try:
-            people = db.get_people()
             faculty = db.get_all_faculties()
             club = db.get_club(request.form.getlist("cl_id")[0])[0]
+            people = db.get_people_picker(include=tuple(club[3:7]))
             return render_template("club_edit.html",
                                    faculties=faculty,
                                    club=club,
@@ -304,7 +400,7 @@ def club_edit():
 def cl_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("cl_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     attrs = ["name", "faculty", "advisor", "chairman", "vice_1", "vice_2"]
     values = [data["name"], data["fac_id"], data["adv_id"], data["ch_id"], data["v1_id"], data["v2_id"]]
@@ -316,7 +412,7 @@ def cl_edit():
 def dep_create():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("dep_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     dep= Department(data["name"], data["fac_id"], data["bu_id"], data["ch_id"])
     db.add_department(dep)
@@ -325,7 +421,7 @@ def dep_create():
 
 @app.route("/departments", methods=["POST", "GET"])
 def dep_page():
-    db = Database()
+    db = get_db()
     departments = db.get_departments_text()
     return render_template("departments.html", departments=departments)
 
@@ -335,17 +431,16 @@ def department_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("dep_page"))
 
-    db = Database()
+    db = get_db()
     data = request.form
     if data["button"] == "delete":
         dep_keys = request.form.getlist("dep_id")
-        for dep_key in dep_keys:
-            db.delete_department(int(dep_key))
+        db.delete_departments([int(key) for key in dep_keys])
     elif data["button"] == "update":
         try:
-            people = db.get_people()
             faculties = db.get_all_faculties()
             department = db.get_department(request.form.getlist("dep_id")[0])[0]
+            people = db.get_people_picker(include=(department[4],))
             return render_template("department_edit.html",
                                    faculties=faculties,
                                    people=people,
@@ -363,7 +458,7 @@ def department_edit():
 def dep_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("dep_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     attrs = ["name", "faculty", "building", "dean"]
     values = [data["name"], data["fac_id"], data["bu_id"], data["ch_id"]]
@@ -373,7 +468,7 @@ def dep_edit():
 
 @app.route("/faculties", methods=["POST", "GET"])
 def fac_page():
-    db = Database()
+    db = get_db()
     faculties = db.get_faculty_as_text()
     return render_template("faculties.html", faculties=faculties)
 
@@ -383,17 +478,16 @@ def faculty_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("fac_page"))
 
-    db = Database()
+    db = get_db()
     data = request.form
     if data["button"] == "delete":
         fac_keys = request.form.getlist("fac_id")
-        for fac_key in fac_keys:
-            db.delete_faculty(int(fac_key))
+        db.delete_faculties([int(key) for key in fac_keys])
     elif data["button"] == "update":
         try:
-            people = db.get_people()
             buildings = db.get_buildings()
             faculty = db.get_faculty(request.form.getlist("fac_id")[0])[0]
+            people = db.get_people_picker(include=tuple(faculty[3:6]))
             return render_template("faculty_edit.html",
                                    faculty=faculty,
                                    buildings=buildings,
@@ -410,7 +504,7 @@ def faculty_edit():
 def fac_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("fac_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     attrs = ["name", "building", "dean", "vdean_1", "vdean_2"]
     values = [data["name"], data["b_id"], data["dean_id"], data["vdean1_id"]]
@@ -429,7 +523,7 @@ def fac_edit():
 def fac_cr():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("fac_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     a = None
     if data["vdean2_id"] != "0":
@@ -443,7 +537,7 @@ def fac_cr():
 def lab_create():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("lab_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     lab = Lab(data["name"], data["dep_id"], data["fac_id"], data["r_id"], data["p_id"], data["bu_id"])
     db.add_lab(lab)
@@ -451,7 +545,7 @@ def lab_create():
 
 @app.route("/labs", methods=["POST", "GET"])
 def lab_page():
-    db = Database()
+    db = get_db()
     labs = db.get_lab_info()
     return render_template("labs.html", labs=labs)
 
@@ -461,21 +555,21 @@ def lab_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("lab_page"))
 
-    db = Database()
+    db = get_db()
     data = request.form
     if data["button"] == "delete":
         lab_keys = request.form.getlist("lab_id")
-        for lab_key in lab_keys:
-            db.delete_lab(int(lab_key))
+        db.delete_labs([int(key) for key in lab_keys])
     elif data["button"] == "update":
         try:
+            lab = db.get_lab(request.form.getlist("lab_id")[0])[0]
             return render_template("lab_edit.html",
-                                   people = db.get_people(),
+                                   people = db.get_people_picker(include=(lab[6],)),
                                    deps=db.get_all_departments(),
                                    faculties = db.get_all_faculties(),
                                    buildings = db.get_buildings(),
                                    rooms = db.get_rooms(),
-                                   lab = db.get_lab(request.form.getlist("lab_id")[0])[0])
+                                   lab = lab)
         except:
             return redirect(url_for("lab_page"))
     else:
@@ -488,7 +582,7 @@ def lab_edit():
 def l_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("lab_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     attrs = ["name", "department", "faculty", "building", "room", "investigator"]
     values = [data["name"], data["dep_id"], data["fac_id"], data["bu_id"], data["r_id"], data["p_id"]]
@@ -498,7 +592,7 @@ def l_edit():
 
 @app.route("/papers", methods=["POST", "GET"])
 def paper_page():
-    db = Database()
+    db = get_db()
     authors = db.get_authors()
     if request.method == "GET":
         return render_template("papers.html", authors=authors)
@@ -516,17 +610,17 @@ def paper_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("paper_page"))
 
-    db = Database()
+    db = get_db()
     data = request.form
     if data["button"] == "delete":
         p_keys = request.form.getlist("paper_id")
-        for p_key in p_keys:
-            db.delete_paper(int(p_key))
+        db.delete_papers([int(key) for key in p_keys])
     elif data["button"] == "update":
         try:
+            paper = db.get_paper(request.form.getlist("paper_id")[0])[0]
             return render_template("paper_edit.html",
-                                   people = db.get_people(),
-                                   paper = db.get_paper(request.form.getlist("paper_id")[0])[0])
+                                   people = db.get_people_picker(include=(paper[4],)),
+                                   paper = paper)
         except:
             return redirect(url_for("paper_page"))
     else:
@@ -539,7 +633,7 @@ def paper_edit():
 def p_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("paper_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     attrs = ["title", "platform", "citation", "author", "isConference"]
     values = [data["name"], data["pl"], data["cc"], data["a_id"]]
@@ -554,7 +648,7 @@ def p_edit():
 def paper_create():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("paper_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     h = False
     if data["conf"] == "t":
@@ -569,14 +663,14 @@ def rooms_page():
     In this page we will show the rooms
     :return:
     '''
-    db = Database()
+    db = get_db()
     rooms = db.get_rooms()
     return render_template("rooms_list.html", rooms = rooms)
 
 
 @app.route("/room_create", methods= ["POST", "GET"])
 def room_create():
-    db = Database()
+    db = get_db()
     data = request.form
     is_class = 'FALSE'
     is_room = 'FALSE'
@@ -597,12 +691,11 @@ def room_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("home_page"))
 
-    db = Database()
+    db = get_db()
     data = request.form
     if data["button"] == "delete":
         room_keys = request.form.getlist("room_keys")
-        for room_key in room_keys:
-            db.delete_classroom(int(room_key))
+        db.delete_classrooms([int(key) for key in room_keys])
     elif data["button"] == "update":
         room = db.get_room(request.form.getlist("room_keys")[0])
         return render_template("room_update.html", room=room, buildings=db.get_buildings())
@@ -616,7 +709,7 @@ def room_update():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("home_page"))
 
-    db = Database()
+    db = get_db()
     data = request.form
     attrs = ["room_name","building","class", "lab" ,"room" ,"available"]
     classFlag = labFlag = roomFlag = "FALSE"
@@ -637,13 +730,56 @@ def classrooms_page():
     In this page we will show the classrooms
     :return:
     '''
-    db = Database()
+    db = get_db()
     classrooms = db.get_classrooms()
     return render_template("classrooms_list.html", classrooms = classrooms)
 
+@app.route("/free_rooms", methods = ["GET", ])
+def free_rooms_page():
+    """
+    Classrooms that are free on a weekday between two times and seat at least the given number.
+    :return:
+    """
+    if not session.get("logged_in") or not session.get("person")["admin"]:
+        return redirect(url_for("home_page"))
+
+    search = {
+        "day": request.args.get("day", "0"),
+        "start": request.args.get("start", ""),
+        "end": request.args.get("end", ""),
+        "seats": request.args.get("seats", ""),
+        "type": request.args.get("type", ""),
+        "board": request.args.get("board", ""),
+    }
+    rooms = None
+    error = None
+    if search["start"] or search["end"]:
+        start = timeslots.minutes(search["start"])
+        end = timeslots.minutes(search["end"])
+        try:
+            day = int(search["day"])
+            seats = int(search["seats"] or 0)
+        except ValueError:
+            day = seats = None
+        if start is None or end is None or end <= start or day not in range(7) or seats is None:
+            error = "Please give a day, a start time before the end time and a number of seats."
+        else:
+            db = get_db()
+            rooms = db.find_free_classrooms(day, start, end, seats, search["type"] or None, search["board"] or None)
+
+    return render_template("free_rooms.html",
+        authenticated = session.get("logged_in"),
+        username = session["person"]["name"],
+        person = session.get("person"),
+        days = timeslots.DAY_NAMES,
+        search = search,
+        rooms = rooms,
+        error = error
+        )
+
 @app.route("/classroom_create", methods= ["POST", "GET"])
 def classroom_create():
-    db = Database()
+    db = get_db()
     data = request.form
     newroom = Room(data["building"], data["name"], data["availability"], classroom="TRUE",lab="FALSE",room="FALSE")
     room = db.add_room(newroom)
@@ -657,12 +793,11 @@ def classroom_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("home_page"))
 
-    db = Database()
+    db = get_db()
     data = request.form
     if data["button"] == "delete":
         classroom_keys = request.form.getlist("classroom_keys")
-        for classroom_key in classroom_keys:
-            db.delete_classroom(int(classroom_key))
+        db.delete_classrooms([int(key) for key in classroom_keys])
     elif data["button"] == "update":
         classroom = db.get_classroom(request.form.getlist("classroom_keys")[0])
         return render_template("classroom_update.html", classroom=classroom, datetime=datetime.now())
@@ -675,7 +810,7 @@ def classroom_update():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("home_page"))
 
-    db = Database()
+    db = get_db()
     data = request.form
     attrs = ["type","air_conditioner","last_restoration" ,"board_type" ,"cap"]
     values = [data["type"], data["conditioner"], data["restoration_date"], data["board_type"], data["capacity"]]
@@ -688,14 +823,14 @@ def instructors_page():
     In this page we will show the instructors
     :return:
     '''
-    db = Database()
+    db = get_db()
     instructors = db.get_instructors()
 
     return render_template("instructors.html", instructors = instructors)
 
 @app.route("/instructor_create", methods= ["POST", "GET"])
 def instructor_create():
-    db = Database()
+    db = get_db()
     data = request.form
     password = hashlib.md5(data["password"].encode())
     person = People(name=data["name"], password=password.hexdigest(), mail=data["mail"])
@@ -708,12 +843,11 @@ def instructor_create():
 def instructor_edit():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("home_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     if data["button"] == "delete":
         instructor_keys = request.form.getlist("instructor_keys")
-        for ins_key in instructor_keys:
-            db.delete_instructor(int(ins_key))
+        db.delete_instructors([int(key) for key in instructor_keys])
     elif data["button"] == "update":
         instructor = db.get_instructor(request.form.getlist("instructor_keys")[0])
         return render_template("instructor_update.html", instructor=instructor, rooms=db.get_rooms(), departments=db.get_all_departments(), labs=db.get_all_labs())
@@ -725,7 +859,7 @@ def instructor_edit():
 def instructor_update():
     if not session["logged_in"] or not session.get("person")["admin"]:
         return redirect(url_for("home_page"))
-    db = Database()
+    db = get_db()
     data = request.form
     attrs = ["department", "room", "lab", "bachelors", "masters", "doctorates"]
     lab = data["lab"]
@@ -737,7 +871,7 @@ def instructor_update():
 
 @app.route("/student_create", methods= ["POST", ])
 def student_create():
-    db = Database()
+    db = get_db()
     data = request.form
 
     password = hashlib.md5(data["password"].encode()).hexdigest()
@@ -756,16 +890,77 @@ def student_create():
     db.add_student(student)
     return redirect(url_for("admin_page"))
 
+@app.route("/su/import_students", methods=["POST"])
+def import_students():
+    """
+    Imports the students of an uploaded CSV file, see student_import for the columns.
+    :return: Counts of created and updated students and the rejected rows as JSON
+    """
+    if not session.get("logged_in") or not session.get("person")["admin"]:
+        return redirect(url_for("home_page"))
+
+    file = request.files.get("csv")
+    if not file:
+        return jsonify({"Success": False, "Error": "no file"}), 400
+
+    try:
+        summary = student_import.run(file.stream, dry_run=request.form.get("dry_run") == "1")
+    except ValueError as err:
+        return jsonify({"Success": False, "Error": str(err)}), 400
+    if summary is None:
+        return jsonify({"Success": False})
+
+    summary["rejected"] = [{"Row": row, "Email": email, "Reason": reason}
+                           for row, email, reason in summary["rejected"]]
+    summary["Success"] = True
+    return jsonify(summary)
+
+@app.route("/export/<table>.<fmt>", methods=["GET"])
+def export_table(table, fmt):
+    """
+    Streams a whole table as a CSV or NDJSON download, see export.TABLES and export.FORMATS.
+    """
+    if not session.get("logged_in") or not session.get("person")["admin"]:
+        return redirect(url_for("home_page"))
+    if table not in export.TABLES or fmt not in export.FORMATS:
+        return "Unknown export", 404
+
+    # Rows are read while the response is sent, after this view has returned, so the export
+    # takes its own connection instead of the request's transaction.
+    db = Database()
+    response = Response(stream_with_context(export.chunks(db, table, fmt)), mimetype=export.FORMATS[fmt])
+    response.headers["Content-Disposition"] = "attachment; filename=%s.%s" % (table, fmt)
+    return response
+
 @app.route("/student_list", methods = ["GET", ])
 def students_list():
     if not session["logged_in"]:
         return redirect(url_for("home_page"))
 
-    db = Database()
-    students = db.get_students()
+    sort = request.args.get("sort", "number")
+    if sort not in STUDENT_SORTS:
+        sort = "number"
+
+    # ?after=key&after_id=id or ?before=key&before_id=id, the (sort key, ID) of a row of the
+    # neighbouring page.
+    cursors = {}
+    for direction in ("after", "before"):
+        if direction in request.args:
+            try:
+                key = request.args[direction]
+                cursors[direction] = (int(key) if sort == "number" else key,
+                                      int(request.args[direction + "_id"]))
+            except (KeyError, ValueError):
+                return redirect(url_for("students_list", sort=sort))
+
+    db = get_db()
+    page = db.get_students_page(sort, cursors.get("after"), cursors.get("before"))
 
     return render_template("students_list.html", 
-        students = students,
+        students = page["students"] if page else None,
+        page = page,
+        sort = sort,
+        total = db.get_students_estimate(),
         person = session.get("person")
         )
 
@@ -775,12 +970,11 @@ def student_delete_update():
         return redirect(url_for("home_page"))
 
     data = request.form
-    db = Database()
+    db = get_db()
     
     if data["button"] == "delete":
         students = data.getlist("selected")
-        for stu in students:
-            db.delete_student(int(stu))
+        db.delete_students([int(key) for key in students])
     elif data["button"] == "update":
         return render_template("student_update.html",
             student = db.get_student_w_join(int(data.getlist("selected")[0]))
@@ -794,14 +988,14 @@ def student_update():
         return redirect(url_for("home_page"))
 
     data = request.form
-    db = Database()
+    db = get_db()
 
-    attrs = ["NUMBER", "EARNED_CREDITS"]
+    attrs = ["number", "credits"]
     values = [int(data["number"]), data["credit"]]
 
     db.update_student(data["id"], attrs, values)
 
-    attrs = ["NAME", "EMAIL"]
+    attrs = ["name", "email"]
     values = [data["name"], data["email"]]
 
     db.update_person(data["id"], attrs, values)
@@ -816,7 +1010,7 @@ def login_page():
 def login_action():
     data = request.form
     
-    db = Database()
+    db = get_db()
     person = db.get_person_by_mail(data["mail"])
 
     attempted_hashed_passw = hashlib.md5(data["password"].encode()).hexdigest()
@@ -839,19 +1033,38 @@ def logout():
 @app.route("/lesson_create", methods = ["POST", ])
 def lesson_create():
     data = request.form
-    lesson = Lesson(data["crn"], data["date"], data["code"], data["instructor"], data["location"], data["assistant"], data["credit"], data["cap"])
-    db = Database()
+    lesson = Lesson(data["crn"], data["date"], data["code"], data["instructor"], data.get("location") or None, data["assistant"], data["credit"], data["cap"],
+                    room_type = data.get("room_type") or None, board_type = data.get("board_type") or None)
+    db = get_db()
     db.create_lesson(lesson)
 
     return redirect(url_for("admin_page"))
 
+@app.route("/su/allocate_rooms", methods = ["POST", ])
+def allocate_rooms():
+    """
+    Assigns classrooms to lessons, only to the ones without a location if only_unassigned=1.
+    :return: Summary of the run as JSON
+    """
+    if not session.get("logged_in") or not session.get("person")["admin"]:
+        return redirect(url_for("home_page"))
+
+    summary = room_allocation.run(only_unassigned = request.form.get("only_unassigned") == "1",
+                                  dry_run = request.form.get("dry_run") == "1")
+    if summary is None:
+        return jsonify({"Success": False})
+
+    summary["Success"] = True
+    return jsonify(summary)
+
 @app.route("/enroll", methods = ["GET", "POST"])
 def enroll_page():
-    db = Database()
+    db = get_db()
     enrolled_list = db.get_enrolled(session.get("person")["id"])
     enrolled = []
     for enr in enrolled_list:
         enrolled.append(enr[2])
+    waitlist = db.get_waitlist_positions(session.get("person")["id"]) or {}
 
     if request.method == "GET":
         if not session["logged_in"]:
@@ -861,7 +1074,8 @@ def enroll_page():
             authenticated = session.get("logged_in"),
             username = "anon" if not session.get("logged_in") else session["person"]["name"],
             person = session.get("person"),
-            enrolled = enrolled
+            enrolled = enrolled,
+            waitlist = waitlist
             )
 
     else:
@@ -876,7 +1090,8 @@ def enroll_page():
             username = "anon" if not session.get("logged_in") else session["person"]["name"],
             person = session.get("person"),
             result = result,
-            enrolled = enrolled
+            enrolled = enrolled,
+            waitlist = waitlist
             )
 
 
@@ -886,16 +1101,45 @@ def enroll_action():
     if not lesson_id or not session["logged_in"]:
         return redirect(url_for("home_page"))
 
-    db = Database()
-    enrollments = db.get_enrolled(session["person"]["id"])
-    for enr in enrollments:
-        if enr[2] == lesson_id:
-            return redirect(url_for("enroll_page"))
-
+    db = get_db()
     if db.enroll_for_student(student_id = session["person"]["id"], lesson_id = lesson_id):
         return jsonify({"Success": True})
 
-    return jsonify({"Success": False})
+    conflicts = db.get_conflicts(student_id = session["person"]["id"], lesson_id = lesson_id)
+    if conflicts:
+        return jsonify({"Success": False, "Conflicts": conflicts})
+
+    # The lesson is full, queue the student instead of letting them retry until a seat frees up
+    position = db.join_waitlist(student_id = session["person"]["id"], lesson_id = lesson_id)
+    return jsonify({"Success": False, "Waitlist": position})
+
+@app.route("/enroll_bulk_action", methods = ["GET", "POST"])
+def enroll_bulk_action():
+    """
+    Enrolls the student in every lesson given as lesson_id and/or crn parameters in one transaction.
+    :return: Status of each lesson as JSON
+    """
+    if not session.get("logged_in"):
+        return redirect(url_for("home_page"))
+
+    try:
+        lesson_ids = [int(lesson_id) for lesson_id in request.values.getlist("lesson_id")]
+        crns = [int(crn) for crn in request.values.getlist("crn")]
+    except ValueError:
+        return jsonify({"Success": False}), 400
+
+    if not lesson_ids and not crns:
+        return jsonify({"Success": False}), 400
+
+    db = get_db()
+    results = db.enroll_many(session["person"]["id"], lesson_ids=lesson_ids, crns=crns)
+    if results is None:
+        return jsonify({"Success": False})
+
+    return jsonify({
+        "Success": any(result["Status"] == "enrolled" for result in results),
+        "Results": results
+    })
 
 @app.route("/leave_action", methods = ["GET", ])
 def leave_action():
@@ -903,26 +1147,61 @@ def leave_action():
     if not lesson_id or not session["logged_in"]:
         return redirect(url_for("home_page"))
 
-    db = Database()
+    db = get_db()
     if db.leave_for_student(student_id = session["person"]["id"], lesson_id = lesson_id):
         return jsonify({"Success": True})
 
     return jsonify({"Success": False})
 
+@app.route("/leave_waitlist_action", methods = ["GET", ])
+def leave_waitlist_action():
+    lesson_id = request.args.get("lesson_id")
+    if not lesson_id or not session["logged_in"]:
+        return redirect(url_for("home_page"))
+
+    db = get_db()
+    if db.leave_waitlist(student_id = session["person"]["id"], lesson_id = lesson_id):
+        return jsonify({"Success": True})
+
+    return jsonify({"Success": False})
+
+@app.route("/preferences", methods = ["GET", "POST"])
+def preferences():
+    """
+    GET lists the student's ranked sections, POST replaces them for one course.
+    POST parameters are the course code and the lesson_id of the sections, most wanted first.
+    """
+    if not session.get("logged_in") or session.get("person")["type"] != "student":
+        return redirect(url_for("home_page"))
+
+    db = get_db()
+    if request.method == "POST":
+        code = request.form.get("code")
+        try:
+            lesson_ids = [int(lesson_id) for lesson_id in request.form.getlist("lesson_id")]
+        except ValueError:
+            return jsonify({"Success": False}), 400
+        if not code or len(set(lesson_ids)) != len(lesson_ids):
+            return jsonify({"Success": False}), 400
+        if not db.set_preferences(session["person"]["id"], code, lesson_ids):
+            return jsonify({"Success": False})
+
+    return jsonify({"Success": True, "Preferences": db.get_preferences(session["person"]["id"])})
+
 @app.route("/schedule", methods = ["GET", ])
 def schedule():
     if not session["logged_in"] or session.get("person")["type"] != "student":
         return redirect(url_for("home_page"))
 
 
-    db = Database()
-    enrollments = db.get_enrolled_w_join(session["person"]["id"])
+    db = get_db()
+    schedule = db.get_schedule(session["person"]["id"])
 
     return render_template("schedule.html",
             authenticated = session.get("logged_in"),
             username = "anon" if not session.get("logged_in") else session["person"]["name"],
             person = session.get("person"),
-            enrollments = enrollments
+            schedule = schedule
             )
 
 if __name__ == "__main__":
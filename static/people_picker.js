@@ -0,0 +1,31 @@
+// Person dropdowns marked with data-people only come with the first few people. A search box
+// above each one asks /people_search for the people whose name starts with what was typed.
+$(function(){
+	$("select[data-people]").each(function(){
+		var $select = $(this);
+		var $search = $('<input class="form-control form-control-sm mb-1" type="search" placeholder="Search by name"/>');
+		var timer = null;
+
+		$search.insertBefore($select);
+		$search.on("input", function(){
+			clearTimeout(timer);
+			timer = setTimeout(function(){
+				$.ajax({
+					url: "/people_search",
+					data: {q: $search.val(), type: $select.data("people") || ""},
+					success: function(people){
+						// The current choice and a "None" entry stay whatever the search finds.
+						var $keep = $select.find("option:selected, option[value='0']");
+						var kept = $keep.map(function(){ return this.value; }).get();
+						$select.find("option").not($keep).remove();
+						$.each(people, function(_, person){
+							if(kept.indexOf(String(person.ID)) === -1){
+								$select.append($("<option/>").val(person.ID).text(person.Name));
+							}
+						});
+					}
+				});
+			}, 250);
+		});
+	});
+});
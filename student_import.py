@@ -0,0 +1,96 @@
+"""
+Bulk import of students from CSV.
+
+The first line of the file names the columns, in any order:
+
+    name,email,number,credits,department,faculty,club,lab,password,photo
+
+name, email, number, department and faculty are required. department, faculty, club and lab are
+IDs. A row whose email already belongs to a student updates that student. The whole file goes to
+the database with one COPY and is imported in one transaction, rows that do not pass the checks are
+left out and reported.
+
+    $ DATABASE_URL=postgres://... python student_import.py intake.csv
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+from database import Database
+
+IMPORT_COLUMNS = ("name", "email", "number", "credits", "department", "faculty", "club", "lab",
+                  "password", "photo")
+
+REQUIRED_COLUMNS = ("name", "email", "number", "department", "faculty")
+
+
+def read_header(stream):
+    """
+    Reads the header line of the CSV, the stream is left at the first row.
+
+    :return: List of column names in file order
+    :raise ValueError: If a column is unknown, repeated or a required one is missing
+    """
+    line = stream.readline()
+    if isinstance(line, bytes):
+        line = line.decode("utf-8-sig")
+    columns = [column.strip().lower() for column in next(csv.reader([line]), [])]
+
+    unknown = [column for column in columns if column not in IMPORT_COLUMNS]
+    if unknown:
+        raise ValueError("unknown columns: " + ", ".join(unknown))
+    if len(set(columns)) != len(columns):
+        raise ValueError("repeated columns")
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError("missing columns: " + ", ".join(missing))
+    return columns
+
+
+def run(stream, dry_run=False):
+    """
+    :param stream: CSV file object, text or binary in UTF-8
+    :param dry_run: Check the rows without keeping anything
+    :return: Summary dictionary, None if the import failed
+    :raise ValueError: If the header is not valid
+    """
+    started = time.monotonic()
+    columns = read_header(stream)
+
+    db = Database(scoped=True)
+    result = db.import_students(columns, stream)
+    committed = db.close(commit=not dry_run and result is not None)
+    if result is None:
+        return None
+
+    result["committed"] = committed
+    result["seconds"] = round(time.monotonic() - started, 3)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Imports students from a CSV file.")
+    parser.add_argument("file", help="CSV file with a header line")
+    parser.add_argument("--dry-run", action="store_true", help="check the rows without importing them")
+    args = parser.parse_args()
+
+    if os.getenv("DATABASE_URL") is None:
+        print("Usage: DATABASE_URL=url python student_import.py file.csv [--dry-run]", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        with open(args.file, encoding="utf-8-sig", newline="") as stream:
+            summary = run(stream, args.dry_run)
+    except ValueError as err:
+        print("Import Students Error: ", err, file=sys.stderr)
+        sys.exit(1)
+
+    if summary is None:
+        sys.exit(1)
+    for row, email, reason in summary["rejected"]:
+        print("row %d (%s): %s" % (row, email, reason))
+    summary["rejected"] = len(summary["rejected"])
+    for key, value in summary.items():
+        print("%-10s %s" % (key + ":", value))
@@ -0,0 +1,34 @@
+from allocation import allocate
+
+PERIODS = {
+    1: [(510, 630)],
+    2: [(540, 660)],
+    3: [(1950, 2070)],
+}
+
+
+def test_student_does_not_get_clashing_sections_of_two_courses():
+    rows = [
+        ("AAA101", 1, 10, 7, 1),
+        # Section 2 is ranked first but meets during section 1 of the other course.
+        ("BBB101", 2, 10, 7, 1),
+        ("BBB101", 3, 10, 7, 2),
+    ]
+    assert sorted(allocate(rows, seed=1, periods=PERIODS)) == [(7, 1), (7, 3)]
+
+
+def test_student_is_left_out_of_a_course_with_only_clashing_sections():
+    rows = [
+        ("AAA101", 1, 10, 7, 1),
+        ("BBB101", 2, 10, 7, 1),
+        ("BBB101", 2, 10, 8, 1),
+    ]
+    assert sorted(allocate(rows, seed=1, periods=PERIODS)) == [(7, 1), (8, 2)]
+
+
+def test_lessons_without_meetings_never_clash():
+    rows = [
+        ("AAA101", 1, 10, 7, 1),
+        ("BBB101", 2, 10, 7, 1),
+    ]
+    assert sorted(allocate(rows, seed=1)) == [(7, 1), (7, 2)]
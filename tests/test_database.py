@@ -0,0 +1,229 @@
+import io
+
+import psycopg2
+import pytest
+
+import database
+from cache import schedule_cache
+from database import LESSON_SEARCH_KEYS, Database
+
+
+@pytest.fixture
+def notes(url):
+    """
+    Scratch table the tests write to, outside of the application's tables.
+    """
+    connection = psycopg2.connect(url)
+    connection.autocommit = True
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS TEST_NOTES (NOTE TEXT)")
+    cursor.execute("TRUNCATE TEST_NOTES")
+    yield cursor
+    cursor.execute("DROP TABLE TEST_NOTES")
+    connection.close()
+
+
+def _write(db, note):
+    with db._connect() as connection:
+        cursor = connection.cursor()
+        cursor.execute("INSERT INTO TEST_NOTES (NOTE) VALUES (%s)", [note])
+        cursor.close()
+
+
+def _read(cursor):
+    cursor.execute("SELECT NOTE FROM TEST_NOTES ORDER BY NOTE")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def test_caught_error_keeps_later_writes(notes):
+    db = Database(scoped=True, memoize=True)
+    _write(db, "a before")
+    # get_person() catches the invalid input error and returns None.
+    assert db.get_person("not a number") is None
+    _write(db, "b after")
+
+    assert db.close() is True
+    assert _read(notes) == ["a before", "b after"]
+
+
+def test_error_only_rolls_back_its_block(notes):
+    db = Database(scoped=True)
+    _write(db, "a kept")
+    with pytest.raises(psycopg2.Error):
+        with db._connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute("INSERT INTO TEST_NOTES (NOTE) VALUES ('b dropped')")
+            cursor.execute("SELECT 1 / 0")
+    _write(db, "c kept")
+
+    assert db.close() is True
+    assert _read(notes) == ["a kept", "c kept"]
+
+
+def test_close_without_commit_discards_everything(notes):
+    db = Database(scoped=True)
+    _write(db, "a")
+
+    assert db.close(commit=False) is False
+    assert _read(notes) == []
+
+
+def test_join_waitlist_after_memoized_positions(url):
+    db = Database(scoped=True, memoize=True)
+    try:
+        with db._connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute("""SELECT LESSONS.LESSON_ID, STUDENTS.STU_ID FROM LESSONS CROSS JOIN STUDENTS
+                WHERE NOT EXISTS (SELECT 1 FROM ENROLLMENT e WHERE e.LESSON_ID = LESSONS.LESSON_ID AND e.STUDENT_ID = STUDENTS.STU_ID)
+                AND NOT EXISTS (SELECT 1 FROM WAITLIST w WHERE w.LESSON_ID = LESSONS.LESSON_ID AND w.STUDENT_ID = STUDENTS.STU_ID)
+                LIMIT 1""")
+            row = cursor.fetchone()
+            if row is None:
+                pytest.skip("needs a lesson and a student not enrolled in it")
+            lesson, student = row
+            # Rolled back with the rest of the test.
+            cursor.execute("UPDATE LESSONS SET ENROLLED = CAP WHERE LESSON_ID = %s", [lesson])
+            cursor.execute("SELECT count(*) FROM WAITLIST WHERE LESSON_ID = %s", [lesson])
+            ahead = cursor.fetchone()[0]
+            cursor.close()
+
+        assert lesson not in db.get_waitlist_positions(student)
+        assert db.join_waitlist(student, lesson) == ahead + 1
+        # Joining again keeps the place.
+        assert db.join_waitlist(student, lesson) == ahead + 1
+        assert db.get_waitlist_positions(student)[lesson] == ahead + 1
+    finally:
+        db.close(commit=False)
+
+
+def _lesson_row(cursor, where, values):
+    cursor.execute("""SELECT LESSONS.LESSON_ID, LESSONS.CRN, LESSONS.CODE, LESSONS.DATE, PEOPLE.NAME,
+        LESSONS.CAP, LESSONS.ENROLLED FROM LESSONS JOIN PEOPLE ON PEOPLE.P_ID = LESSONS.INSTRUCTOR
+        WHERE """ + where, values)
+    return cursor.fetchone()
+
+
+def test_search_lesson_rows_follow_keys(url):
+    db = Database(scoped=True)
+    try:
+        with db._connect() as connection:
+            cursor = connection.cursor()
+            expected = _lesson_row(cursor, "LESSONS.LOCATION IS NOT NULL ORDER BY LESSONS.LESSON_ID LIMIT 1", [])
+            if expected is None:
+                pytest.skip("needs a lesson with an instructor and a classroom")
+            # Distinct values, so a shifted column can not go unnoticed. Rolled back at the end.
+            cursor.execute("UPDATE LESSONS SET CAP = 98765, ENROLLED = 98764 WHERE LESSON_ID = %s", [expected[0]])
+            expected = dict(zip(LESSON_SEARCH_KEYS, _lesson_row(cursor, "LESSONS.LESSON_ID = %s", [expected[0]])))
+            cursor.close()
+        assert len({repr(value) for value in expected.values()}) == len(LESSON_SEARCH_KEYS)
+
+        rows = db.search_lesson_by_crn(expected["CRN"])
+        assert rows == [expected]
+        assert list(rows[0]) == list(LESSON_SEARCH_KEYS)
+        assert expected in db.search_lesson_by_instructor(expected["Lecturer"])
+    finally:
+        db.close(commit=False)
+
+
+def test_lesson_without_room_is_listed(url):
+    db = Database(scoped=True)
+    try:
+        with db._connect() as connection:
+            cursor = connection.cursor()
+            expected = _lesson_row(cursor, "TRUE ORDER BY LESSONS.LESSON_ID LIMIT 1", [])
+            cursor.execute("SELECT STU_ID FROM STUDENTS ORDER BY STU_ID LIMIT 1")
+            student = cursor.fetchone()
+            if expected is None or student is None:
+                pytest.skip("needs a lesson with an instructor and a student")
+            # Rolled back at the end.
+            cursor.execute("UPDATE LESSONS SET LOCATION = NULL WHERE LESSON_ID = %s", [expected[0]])
+            cursor.execute("""INSERT INTO ENROLLMENT (STUDENT_ID, LESSON_ID) VALUES (%s, %s)
+                ON CONFLICT DO NOTHING""", [student[0], expected[0]])
+            cursor.close()
+        expected = dict(zip(LESSON_SEARCH_KEYS, expected))
+
+        assert db.search_lesson_by_crn(expected["CRN"]) == [expected]
+        assert expected in db.search_lesson_by_instructor(expected["Lecturer"])
+        assert expected["CRN"] in [row[0] for row in db.get_enrolled_w_join(student[0])]
+    finally:
+        db.close(commit=False)
+
+
+def test_write_room_allocation_keeps_unlisted_lessons(url):
+    db = Database(scoped=True)
+    try:
+        with db._connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT LESSON_ID FROM LESSONS ORDER BY LESSON_ID LIMIT 2")
+            lessons = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT CL_ID FROM CLASSES ORDER BY CL_ID LIMIT 1")
+            room = cursor.fetchone()
+            if len(lessons) < 2 or room is None:
+                pytest.skip("needs two lessons and a classroom")
+            cursor.execute("UPDATE LESSONS SET LOCATION = %s WHERE LESSON_ID = %s", [room[0], lessons[0]])
+            cursor.execute("UPDATE LESSONS SET LOCATION = NULL WHERE LESSON_ID = %s", [lessons[1]])
+            cursor.close()
+
+        assert db.write_room_allocation([(lessons[1], room[0])]) == 1
+
+        with db._connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT LESSON_ID, LOCATION FROM LESSONS WHERE LESSON_ID = ANY(%s)", [lessons])
+            assert dict(cursor.fetchall()) == {lessons[0]: room[0], lessons[1]: room[0]}
+            cursor.close()
+    finally:
+        db.close(commit=False)
+
+
+@pytest.fixture
+def enrolled(url):
+    """
+    (student ID, instructor ID, instructor name) of a committed enrollment, removed afterwards.
+    """
+    connection = psycopg2.connect(url)
+    connection.autocommit = True
+    cursor = connection.cursor()
+    cursor.execute("""SELECT STUDENTS.STU_ID, LESSONS.LESSON_ID, PEOPLE.P_ID, PEOPLE.NAME
+        FROM LESSONS JOIN PEOPLE ON PEOPLE.P_ID = LESSONS.INSTRUCTOR CROSS JOIN STUDENTS
+        WHERE NOT EXISTS (SELECT 1 FROM ENROLLMENT e WHERE e.STUDENT_ID = STUDENTS.STU_ID)
+        LIMIT 1""")
+    row = cursor.fetchone()
+    if row is None:
+        connection.close()
+        pytest.skip("needs a lesson with an instructor and a student without lessons")
+    student, lesson, instructor, name = row
+    cursor.execute("INSERT INTO ENROLLMENT (STUDENT_ID, LESSON_ID) VALUES (%s, %s)", [student, lesson])
+    yield student, instructor, name
+    cursor.execute("DELETE FROM ENROLLMENT WHERE STUDENT_ID = %s AND LESSON_ID = %s", [student, lesson])
+    cursor.execute("UPDATE PEOPLE SET NAME = %s WHERE P_ID = %s", [name, instructor])
+    connection.close()
+
+
+def test_schedule_sees_writes_of_other_workers(enrolled, monkeypatch):
+    student, instructor, name = enrolled
+    schedule_cache.clear()
+    assert Database().get_schedule(student)["lessons"][0]["Instructor"] == name
+
+    # Another worker: its write can not drop the timetable cached in this process.
+    with monkeypatch.context() as patch:
+        patch.setattr(database, "SHARED_CACHES", {})
+        writer = Database(scoped=True)
+        assert writer.update_person(instructor, ["name"], ["Renamed " + name])
+        assert writer.close() is True
+
+    assert Database().get_schedule(student)["lessons"][0]["Instructor"] == "Renamed " + name
+
+
+def test_import_rejects_malformed_rows(url):
+    stream = io.StringIO("\n".join([
+        "new1@x,Import One,990001,1,1,pw",
+        "new2@x,Import Two,990002,1,pw",
+        "new3@x,Import Three,99x,1,1,pw",
+        "new4@x,Import Four,990004,1,1,pw",
+    ]) + "\n")
+    db = Database(scoped=True)
+    result = db.import_students(["email", "name", "number", "department", "faculty", "password"], stream)
+    db.close(commit=False)
+
+    assert result["created"] == 2
+    assert result["rejected"] == [(2, "new2@x", "expected 6 values, got 5"), (3, "new3@x", "invalid number")]
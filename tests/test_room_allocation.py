@@ -0,0 +1,50 @@
+from room_allocation import allocate_rooms, release_clashes
+
+MONDAY_MORNING = [(510, 630)]
+TUESDAY_MORNING = [(1950, 2070)]
+
+
+def _allocate(lessons, rooms):
+    todo = {lesson: row[:4] for lesson, row in lessons.items()}
+    assigned, unplaced = allocate_rooms(todo, rooms)
+    return assigned, unplaced, release_clashes(lessons, assigned, unplaced)
+
+
+def test_unplaced_lesson_gives_up_a_room_taken_by_a_placed_one():
+    rooms = {1: (100, "Lecture", "White")}
+    lessons = {
+        # Fits room 1 and is placed there.
+        10: (50, None, None, MONDAY_MORNING, None),
+        # Too big for any room, had room 1 at the same time.
+        20: (200, None, None, MONDAY_MORNING, 1),
+    }
+    assigned, unplaced, cleared = _allocate(lessons, rooms)
+
+    assert assigned == {10: 1}
+    assert unplaced == [20]
+    assert cleared == [20]
+
+
+def test_unplaced_lesson_keeps_a_room_that_is_still_free():
+    rooms = {1: (100, "Lecture", "White")}
+    lessons = {
+        10: (50, None, None, MONDAY_MORNING, None),
+        20: (200, None, None, TUESDAY_MORNING, 1),
+    }
+    assigned, unplaced, cleared = _allocate(lessons, rooms)
+
+    assert assigned == {10: 1}
+    assert unplaced == [20]
+    assert cleared == []
+
+
+def test_unplaced_lessons_do_not_keep_the_same_room_at_once():
+    rooms = {1: (100, "Lecture", "White")}
+    lessons = {
+        20: (200, None, None, MONDAY_MORNING, 1),
+        30: (300, None, None, MONDAY_MORNING, 1),
+    }
+    assigned, unplaced, cleared = _allocate(lessons, rooms)
+
+    assert assigned == {}
+    assert cleared == [30]
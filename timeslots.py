@@ -0,0 +1,127 @@
+"""
+Meeting times of lessons.
+
+LESSONS.DATE is free text such as "Monday 08:30-10:30" or "Tue/Thu 13.30-15.30". parse() turns it
+into (weekday, start, end) slots that are stored in LESSON_SLOTS, where every slot also has a
+PERIOD range of minutes since Monday 00:00 so overlaps can be found with the GiST index on it.
+"""
+import re
+
+MINUTES_PER_DAY = 24 * 60
+
+DAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+DAYS = {
+    "monday": 0, "mon": 0, "pazartesi": 0, "pzt": 0,
+    "tuesday": 1, "tue": 1, "tues": 1, "sali": 1, "salı": 1,
+    "wednesday": 2, "wed": 2, "carsamba": 2, "çarşamba": 2, "çrş": 2,
+    "thursday": 3, "thu": 3, "thur": 3, "thurs": 3, "persembe": 3, "perşembe": 3, "prş": 3,
+    "friday": 4, "fri": 4, "cuma": 4,
+    "saturday": 5, "sat": 5, "cumartesi": 5, "cmt": 5,
+    "sunday": 6, "sun": 6, "pazar": 6,
+}
+
+_TOKEN = re.compile(
+    r"(?P<start>\d{1,2})(?:[:.](?P<start_minute>\d{2}))?\s*-\s*(?P<end>\d{1,2})(?:[:.](?P<end_minute>\d{2}))?"
+    r"|(?P<word>[^\W\d_]+)")
+
+# Writes the slots of lessons from the arrays returned by slot_arrays().
+INSERT_SLOTS = """INSERT INTO LESSON_SLOTS (LESSON_ID, WEEKDAY, START_TIME, END_TIME, PERIOD)
+    SELECT slot.LESSON_ID, slot.WEEKDAY, make_time(slot.START_MINUTE / 60, slot.START_MINUTE %% 60, 0),
+        make_time(slot.END_MINUTE / 60, slot.END_MINUTE %% 60, 0),
+        int4range(slot.WEEKDAY * 1440 + slot.START_MINUTE, slot.WEEKDAY * 1440 + slot.END_MINUTE)
+    FROM unnest(%s::INTEGER[], %s::INTEGER[], %s::INTEGER[], %s::INTEGER[])
+        AS slot (LESSON_ID, WEEKDAY, START_MINUTE, END_MINUTE)"""
+
+
+def _minutes(hour, minute):
+    hour = int(hour)
+    minute = int(minute or 0)
+    if hour > 24 or minute > 59 or hour * 60 + minute > MINUTES_PER_DAY:
+        return None
+    return hour * 60 + minute
+
+
+def parse(text):
+    """
+    Reads the meeting times out of a LESSONS.DATE value. A time range applies to the day names
+    written before it, or to the days of the previous range if there are none in between, so
+    "Mon, Wed 08:30-10:30" and "Friday 09:00-10:00 13:00-14:00" both work.
+
+    :param text: Value of LESSONS.DATE
+    :return: Sorted list of (weekday, start, end) tuples. Monday is 0, start and end are minutes
+        after midnight. Empty if no slot could be read.
+    """
+    slots = set()
+    pending = []
+    days = []
+    for match in _TOKEN.finditer(text or ""):
+        if match.group("word"):
+            day = DAYS.get(match.group("word").lower())
+            if day is not None:
+                pending.append(day)
+            continue
+
+        start = _minutes(match.group("start"), match.group("start_minute"))
+        end = _minutes(match.group("end"), match.group("end_minute"))
+        if start is None or end is None or end <= start:
+            continue
+        if pending:
+            days, pending = pending, []
+        for day in days:
+            slots.add((day, start, end))
+    return sorted(slots)
+
+
+def slot_arrays(lessons):
+    """
+    :param lessons: (lesson ID, LESSONS.DATE) pairs
+    :return: [lesson IDs, weekdays, starts, ends] lists of the parsed slots, parameters for
+        INSERT_SLOTS
+    """
+    arrays = [[], [], [], []]
+    for lesson_id, text in lessons:
+        for slot in parse(text):
+            arrays[0].append(lesson_id)
+            arrays[1].append(slot[0])
+            arrays[2].append(slot[1])
+            arrays[3].append(slot[2])
+    return arrays
+
+
+def clock(minutes):
+    return "%02d:%02d" % divmod(minutes, 60)
+
+
+def minutes(text):
+    """
+    :param text: Time of day, "HH:MM" or "HH.MM"
+    :return: Minutes after midnight, None if the text is not a time
+    """
+    match = re.fullmatch(r"\s*(\d{1,2})(?:[:.](\d{2}))?\s*", text or "")
+    if match is None:
+        return None
+    return _minutes(match.group(1), match.group(2))
+
+
+def weekly_grid(slots):
+    """
+    Lays meetings out as a timetable. Rows run between consecutive start/end times of the
+    meetings, so a row never has a meeting starting or ending inside it.
+
+    :param slots: (weekday, start, end, label) tuples, times in minutes after midnight
+    :return: Dictionary with "days" (names of the columns, Monday to Friday and any weekend day
+        with a meeting) and "rows" (list of dictionaries with "start", "end" and "cells", one
+        tuple of labels per day)
+    """
+    weekdays = sorted(set(range(5)) | {slot[0] for slot in slots})
+    times = sorted({slot[1] for slot in slots} | {slot[2] for slot in slots})
+
+    rows = []
+    for start, end in zip(times, times[1:]):
+        cells = tuple(tuple(sorted(label for day, first, last, label in slots
+                                   if day == weekday and first <= start and end <= last))
+                      for weekday in weekdays)
+        if any(cells):
+            rows.append({"start": clock(start), "end": clock(end), "cells": cells})
+    return {"days": tuple(DAY_NAMES[weekday] for weekday in weekdays), "rows": rows}
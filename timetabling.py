@@ -0,0 +1,178 @@
+"""
+Exam timetabling.
+
+Two sections conflict when a student is enrolled in both, so their exams can not share a slot.
+ENROLLMENT is read once, grouped into one array of sections per student with more than one section
+(array_agg ... GROUP BY STUDENT_ID HAVING count(*) > 1), and Database.get_exam_conflicts() expands
+every array into pairs in Python to get the adjacency list per section. That read and expansion is
+the part that has to keep up with about a million enrollment rows.
+
+Slots are then given out with DSatur: the section whose neighbours already use the most slots goes
+next and takes the earliest slot that no neighbour uses and that still has enough free rooms for
+it. Rooms come from CLASSES.CAP, a section gets the smallest room it fits in, or is split over the
+largest free rooms when no room is big enough.
+
+    $ DATABASE_URL=postgres://... python timetabling.py --start 2024-01-08 --days 10
+"""
+import argparse
+import bisect
+import datetime
+import heapq
+import os
+import sys
+import time
+
+from database import Database
+
+DEFAULT_TIMES = ("09:00", "13:00", "17:00")
+
+
+class _Rooms:
+    """
+    Free rooms of one slot, sorted by capacity.
+    """
+
+    def __init__(self, rooms):
+        self.free = sorted((cap, room) for room, cap in rooms)
+        self.seats = sum(cap for cap, _ in self.free)
+
+    def fit(self, size):
+        """
+        Takes rooms for an exam of the given size.
+
+        :return: List of (room, seats) pairs, None if the free rooms are not enough
+        """
+        if size > self.seats or not self.free:
+            return None
+
+        taken = []
+        remaining = size
+        # Largest rooms first until the rest fits into a single room.
+        while remaining > self.free[-1][0]:
+            cap, room = self.free.pop()
+            taken.append((cap, room, cap))
+            remaining -= cap
+        index = bisect.bisect_left(self.free, (remaining, -1))
+        cap, room = self.free.pop(index)
+        taken.append((cap, room, remaining))
+
+        self.seats -= sum(cap for cap, _, _ in taken)
+        return [(room, seats) for _, room, seats in taken]
+
+
+def schedule_exams(sizes, neighbours, rooms, slots):
+    """
+    :param sizes: Dictionary of lesson ID -> number of students
+    :param neighbours: Dictionary of lesson ID -> lesson IDs sharing a student with it
+    :param rooms: List of (room ID, capacity) pairs available in every slot
+    :param slots: Number of exam slots
+    :return: (exams, unscheduled) where exams maps lesson ID -> (slot, [(room ID, seats), ...])
+        and unscheduled is the set of lessons no slot could take
+    """
+    free = [_Rooms(rooms) for _ in range(slots)]
+    saturation = {lesson: set() for lesson in sizes}
+    degree = {lesson: len(neighbours.get(lesson, ())) for lesson in sizes}
+    exams = {}
+    unscheduled = set()
+
+    queue = [(0, -degree[lesson], -sizes[lesson], lesson) for lesson in sizes]
+    heapq.heapify(queue)
+    while queue:
+        used, _, _, lesson = heapq.heappop(queue)
+        if lesson in exams or lesson in unscheduled or -used != len(saturation[lesson]):
+            continue
+
+        blocked = saturation[lesson]
+        for slot in range(slots):
+            if slot in blocked:
+                continue
+            placed = free[slot].fit(sizes[lesson])
+            if placed is not None:
+                exams[lesson] = (slot, placed)
+                break
+        else:
+            unscheduled.add(lesson)
+            continue
+
+        for other in neighbours.get(lesson, ()):
+            if other in saturation and other not in exams and slot not in saturation[other]:
+                saturation[other].add(slot)
+                heapq.heappush(queue, (-len(saturation[other]), -degree[other], -sizes[other], other))
+
+    return exams, unscheduled
+
+
+def slot_starts(start, days, times=DEFAULT_TIMES):
+    """
+    :param start: First exam day, weekends are skipped
+    :param days: Number of exam days
+    :param times: Start times of the slots of a day, "HH:MM"
+    :return: List of datetimes, one per slot
+    """
+    clock = [datetime.time(*map(int, value.split(":"))) for value in times]
+    starts = []
+    day = start
+    while len(starts) < days * len(clock):
+        if day.weekday() < 5:
+            starts.extend(datetime.datetime.combine(day, value) for value in clock)
+        day += datetime.timedelta(days=1)
+    return starts
+
+
+def run(start, days, times=DEFAULT_TIMES, dry_run=False):
+    """
+    Builds the exam timetable of every lesson with students and replaces the EXAMS table with it.
+
+    :return: Summary dictionary, None if the input could not be read
+    """
+    started = time.monotonic()
+    db = Database(scoped=True)
+    sizes = db.get_exam_sections()
+    neighbours = db.get_exam_conflicts()
+    rooms = db.get_exam_rooms()
+    if sizes is None or neighbours is None or rooms is None:
+        db.close(commit=False)
+        return None
+    loaded = time.monotonic()
+
+    starts = slot_starts(start, days, times)
+    exams, unscheduled = schedule_exams(sizes, neighbours, rooms, len(starts))
+    scheduled = time.monotonic()
+
+    rows = [(lesson, slot, starts[slot], room, seats)
+            for lesson, (slot, placed) in sorted(exams.items()) for room, seats in placed]
+    written = 0 if dry_run else db.write_exams(rows)
+    committed = db.close(commit=not dry_run and written is not None)
+
+    return {
+        "sections": len(sizes),
+        "conflicts": sum(len(other) for other in neighbours.values()) // 2,
+        "slots": len(starts),
+        "slots_used": len({slot for slot, _ in exams.values()}),
+        "scheduled": len(exams),
+        "split": sum(1 for _, placed in exams.values() if len(placed) > 1),
+        "unscheduled": sorted(unscheduled),
+        "committed": committed,
+        "load_seconds": round(loaded - started, 3),
+        "schedule_seconds": round(scheduled - loaded, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the exam timetable.")
+    parser.add_argument("--start", type=datetime.date.fromisoformat, default=datetime.date.today(),
+                        help="first exam day, YYYY-MM-DD")
+    parser.add_argument("--days", type=int, default=10, help="number of exam days")
+    parser.add_argument("--times", default=",".join(DEFAULT_TIMES), help="slot start times of a day")
+    parser.add_argument("--dry-run", action="store_true", help="schedule without writing EXAMS")
+    args = parser.parse_args()
+
+    if os.getenv("DATABASE_URL") is None:
+        print("Usage: DATABASE_URL=url python timetabling.py [--start YYYY-MM-DD] [--days N]", file=sys.stderr)
+        sys.exit(1)
+
+    summary = run(args.start, args.days, tuple(args.times.split(",")), args.dry_run)
+    if summary is None:
+        sys.exit(1)
+    for key, value in summary.items():
+        print("%-17s %s" % (key + ":", value))
@@ -0,0 +1,188 @@
+"""
+UPDATE statements of the editable tables.
+
+Every table lists the attributes the application may change, with the column and type each one is
+stored in. compile_update() builds the UPDATE of one set of attributes once per process and
+execute_prepared() PREPAREs it on a connection the first time it runs there, after that only
+EXECUTE and the values are sent. Prepared statements live as long as the connection and are not
+undone by a rollback, so pooled connections keep them across requests.
+"""
+import collections
+import functools
+import hashlib
+import threading
+import weakref
+
+# name: table in the database, key: primary key column, tags: cache tags of Database, columns:
+# attribute -> (column, type)
+Table = collections.namedtuple("Table", "name key key_type tags columns")
+
+# name: of the prepared statement, prepare: PREPARE statement, execute: EXECUTE statement with
+# placeholders for the values
+Statement = collections.namedtuple("Statement", "name prepare execute")
+
+TABLES = {
+    "rooms": Table("ROOMS", "ROOM_ID", "INTEGER", ("rooms",), {
+        "building": ("BUILDING", "INTEGER"),
+        "room_name": ("ROOM_NAME", "TEXT"),
+        "class": ("CLASS", "BOOLEAN"),
+        "lab": ("LAB", "BOOLEAN"),
+        "room": ("ROOM", "BOOLEAN"),
+        "available": ("AVAILABLE", "BOOLEAN"),
+    }),
+    "classrooms": Table("CLASSES", "CL_ID", "INTEGER", ("classrooms",), {
+        "type": ("TYPE", "TEXT"),
+        "air_conditioner": ("AIR_CONDITIONER", "BOOLEAN"),
+        "last_restoration": ("LAST_RESTORATION", "TEXT"),
+        "board_type": ("BOARD_TYPE", "TEXT"),
+        "cap": ("CAP", "INTEGER"),
+    }),
+    "instructors": Table("INSTRUCTORS", "INS_ID", "INTEGER", ("instructors",), {
+        "department": ("DEPARTMENT", "INTEGER"),
+        "room": ("ROOM", "INTEGER"),
+        "lab": ("LAB", "INTEGER"),
+        "bachelors": ("BACHELORS", "TEXT"),
+        "masters": ("MASTERS", "TEXT"),
+        "doctorates": ("DOCTORATES", "TEXT"),
+    }),
+    "people": Table("PEOPLE", "P_ID", "INTEGER", ("people",), {
+        "name": ("NAME", "TEXT"),
+        "email": ("EMAIL", "TEXT"),
+        "photo": ("PHOTO", "TEXT"),
+        "password": ("PASSWORD", "TEXT"),
+        "type": ("TYPE", "TEXT"),
+    }),
+    "students": Table("STUDENTS", "STU_ID", "INTEGER", ("students",), {
+        "number": ("NUMBER", "INTEGER"),
+        "credits": ("EARNED_CREDITS", "INTEGER"),
+        "department": ("DEPARTMENT", "INTEGER"),
+        "faculty": ("FACULTY", "INTEGER"),
+        "club": ("CLUB", "INTEGER"),
+        "lab": ("LAB", "INTEGER"),
+    }),
+    "faculties": Table("FACULTIES", "FAC_ID", "INTEGER", ("faculties",), {
+        "name": ("FAC_NAME", "TEXT"),
+        "building": ("FAC_BUILDING", "INTEGER"),
+        "dean": ("DEAN", "INTEGER"),
+        "vdean_1": ("DEAN_ASST_1", "INTEGER"),
+        "vdean_2": ("DEAN_ASST_2", "INTEGER"),
+    }),
+    "assistants": Table("ASSISTANTS", "AS_ID", "INTEGER", ("assistants",), {
+        "person": ("AS_PERSON", "INTEGER"),
+        "lab": ("LAB", "INTEGER"),
+        "degree": ("DEGREE", "TEXT"),
+        "department": ("DEPARTMENT", "INTEGER"),
+        "faculty": ("FACULTY", "INTEGER"),
+    }),
+    "labs": Table("LABS", "LAB_ID", "INTEGER", ("labs",), {
+        "name": ("LAB_NAME", "TEXT"),
+        "department": ("DEPARTMENT", "INTEGER"),
+        "faculty": ("FACULTY", "INTEGER"),
+        "building": ("BUILDING", "INTEGER"),
+        "room": ("ROOM", "INTEGER"),
+        "investigator": ("INVESTIGATOR", "INTEGER"),
+    }),
+    "departments": Table("DEPARTMENTS", "DEP_ID", "INTEGER", ("departments",), {
+        "name": ("DEP_NAME", "TEXT"),
+        "faculty": ("FACULTY", "INTEGER"),
+        "building": ("BUILDING", "INTEGER"),
+        "dean": ("DEAN", "INTEGER"),
+    }),
+    "papers": Table("PAPERS", "PAPER_ID", "INTEGER", ("papers",), {
+        "title": ("TITLE", "TEXT"),
+        "platform": ("PLAT", "TEXT"),
+        "citation": ("CITATION_COUNT", "INTEGER"),
+        "author": ("AUTHOR", "INTEGER"),
+        "isConference": ("CONFERENCE", "BOOLEAN"),
+    }),
+    "buildings": Table("BUILDINGS", "BU_ID", "INTEGER", ("buildings",), {
+        "name": ("BU_NAME", "TEXT"),
+        "code": ("BU_CODE", "TEXT"),
+        "campus": ("CAMPUS", "TEXT"),
+    }),
+    "clubs": Table("CLUBS", "CLUB_ID", "INTEGER", ("clubs",), {
+        "name": ("NAME", "TEXT"),
+        "faculty": ("FACULTY", "INTEGER"),
+        "advisor": ("ADVISOR", "INTEGER"),
+        "chairman": ("CHAIRMAN", "INTEGER"),
+        "vice_1": ("V_CHAIRMAN_1", "INTEGER"),
+        "vice_2": ("V_CHAIRMAN_2", "INTEGER"),
+    }),
+}
+
+# Connection -> names of the statements prepared on it. Connections the pool drops fall out.
+_prepared = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+
+
+def _columns(table, attrs):
+    if table not in TABLES:
+        raise ValueError("Unknown table: %s" % table)
+    if not attrs:
+        raise ValueError("Nothing to update in %s" % table)
+
+    columns = TABLES[table].columns
+    unknown = [attr for attr in attrs if attr not in columns]
+    if unknown:
+        raise ValueError("Unknown attributes of %s: %s" % (table, ", ".join(unknown)))
+    return [columns[attr] for attr in attrs]
+
+
+def _name(kind, table, attrs):
+    return "%s_%s_%s" % (kind, table, hashlib.md5(",".join(attrs).encode()).hexdigest()[:12])
+
+
+@functools.lru_cache(maxsize=256)
+def compile_update(table, attrs):
+    """
+    :param table: Key of TABLES
+    :param attrs: Tuple of attributes to set, the values are given in the same order
+    :return: Statement updating one row, its values are the attributes followed by the key
+    :raise ValueError: If the table or an attribute is unknown
+    """
+    columns = _columns(table, attrs)
+    definition = TABLES[table]
+    name = _name("update", table, attrs)
+
+    types = [column_type for _, column_type in columns] + [definition.key_type]
+    assignments = ["%s = $%d" % (column, number) for number, (column, _) in enumerate(columns, 1)]
+    prepare = "PREPARE %s (%s) AS UPDATE %s SET %s WHERE %s = $%d" % (
+        name, ", ".join(types), definition.name, ", ".join(assignments), definition.key, len(types))
+    execute = "EXECUTE %s (%s)" % (name, ", ".join(["%s"] * len(types)))
+    return Statement(name, prepare, execute)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_update_many(table, attrs):
+    """
+    :param table: Key of TABLES
+    :param attrs: Tuple of attributes to set
+    :return: Statement updating many rows, its values are one array of keys followed by one array
+        per attribute
+    :raise ValueError: If the table or an attribute is unknown
+    """
+    columns = _columns(table, attrs)
+    definition = TABLES[table]
+    name = _name("update_many", table, attrs)
+
+    # The arrays are sent as text and every value is cast on its way in, so a batch can mix
+    # Python values and strings from forms like the single row statement does.
+    assignments = ["%s = v.%s::%s" % (column, column, column_type) for column, column_type in columns]
+    prepare = "PREPARE %s (%s) AS UPDATE %s SET %s FROM unnest(%s) AS v (ROW_KEY, %s) WHERE %s.%s = v.ROW_KEY::%s" % (
+        name, ", ".join(["TEXT[]"] * (len(columns) + 1)), definition.name, ", ".join(assignments),
+        ", ".join("$%d" % number for number in range(1, len(columns) + 2)),
+        ", ".join(column for column, _ in columns), definition.name, definition.key, definition.key_type)
+    execute = "EXECUTE %s (%s)" % (name, ", ".join(["%s"] * (len(columns) + 1)))
+    return Statement(name, prepare, execute)
+
+
+def execute_prepared(cursor, statement, values):
+    """
+    Runs a compiled statement, preparing it first if its connection has not seen it yet.
+    """
+    with _prepared_lock:
+        names = _prepared.setdefault(cursor.connection, set())
+    if statement.name not in names:
+        cursor.execute(statement.prepare)
+        names.add(statement.name)
+    cursor.execute(statement.execute, values)